@@ -1,12 +1,88 @@
 import numpy as np
 from numpy import ndarray as Array
 
-from post_process_jfsd.utils import log_bin_stat
+from post_process_jfsd.utils import log_bin_reduce, frame_chunks, frame_selection, lin_bin_index, bin_deviations, merge_bin_deviations, compute_dtype
+from post_process_jfsd.output import write_output, output_metadata
+from post_process_jfsd.cache import cached_array, cache_key, input_fingerprint
 
 
-def calculate_particle_stress_correction(trajectory: Array, input_params: tuple, raw_stress_flag: bool, fileout: str) -> tuple[Array, Array]:
+def particle_stress_tensor(trajectory: Array, input_params: tuple, chunk_size: int = 100, dtype: type = np.float64) -> Array:
     """
-    Function to calculate the <xF> term of the stress tensor and output it seperately
+    Function to calculate the <xF> term of the stress tensor for every frame. The interacting pairs are found with a neighbour list of the periodic box, so the cost scales linearly with the number of particles
+
+    Parameters
+    ------------
+    trajectory: (Array)
+        The positions of the particles for every frame (can be memory-mapped)
+    input_params: (tuple)
+        The simulation input parameters
+    chunk_size: (int)
+        The number of frames read from the trajectory at once
+    dtype: (type)
+        The floating point type of the positions and pair distances. The sums over the pairs are accumulated in double precision
+
+    Returns
+    -------------
+    stress_tensor: (Array)
+        The dimensionless <xF> stress tensor of every frame; has dimensions (n_steps, 3, 3)
+    """
+    # Untuple parameters
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    # Potential characteristics
+    k = 2500 / dt
+    sigma = 2. * (1.001)
+
+    import freud
+
+    # The neighbour query only finds the pairs within the potential range
+    box = freud.box.Box.cube(box_length)
+    query_args = dict(r_max=sigma, exclude_ii=True)
+
+    # Initialize stress tensor
+    stress_tensor = np.zeros((n_steps, 3, 3))
+
+    for chunk in frame_chunks(n_steps, chunk_size):
+
+        positions_chunk = np.asarray(trajectory[chunk], dtype=dtype)
+
+        for step, positions in zip(range(chunk.start, chunk.stop), positions_chunk):
+
+            nlist = freud.locality.AABBQuery(box, positions).query(positions, query_args).toNeighborList()
+            i, j = nlist.query_point_indices, nlist.point_indices
+
+            # Distance vectors of the interacting pairs with the minimum image convention
+            distance_vectors = positions[i] - positions[j]
+            distance_vectors -= box_length * np.round(distance_vectors / box_length)
+            norms = np.linalg.norm(distance_vectors, axis=1)
+
+            # Calculate forces
+            Fp = (k * (1 - sigma / norms) / norms)[:, np.newaxis] * distance_vectors
+
+            # Sum the xF term over all pairs (every pair appears twice, as in the sum over i and j)
+            S = distance_vectors.T.astype(np.float64, copy=False) @ Fp.astype(np.float64, copy=False)
+
+            # Average over the particles (1/N), multiply with the number density (N/V) and normalize
+            stress_tensor[step] = S / (box_length)**3 / kT
+
+    return stress_tensor
+
+
+# The independent components of the symmetric <xF> tensor and their indices in the flattened 3x3 tensor, xy first
+PARTICLE_STRESS_COMPONENTS = {"xy": 1, "xx": 0, "yy": 4, "zz": 8, "xz": 2, "yz": 5}
+PARTICLE_STRESS_HEADER = r"\g(g)   " + "   ".join(rf"\g(s)\-({component})" for component in PARTICLE_STRESS_COMPONENTS)
+
+
+def particle_stress_components(stress_tensor: Array) -> dict:
+    """
+    A helper function to get the output columns of the independent components of the flattened <xF> tensor, which has dimensions (n, 9)
+    """
+    return {f"stress_{component}": stress_tensor[:, index] for component, index in PARTICLE_STRESS_COMPONENTS.items()}
+
+
+def calculate_particle_stress_correction(trajectory: Array, input_params: tuple, raw_stress_flag: bool, fileout: str, chunk_size: int = 100, output_format: str = "text", cache_dir: str | None = None, directory: str = ".", precision: str = "float64") -> tuple[Array, Array]:
+    """
+    Function to calculate the <xF> term of the stress tensor and output it seperately. All six independent components of the (symmetric) tensor are written, with the xy component first
 
     Parameters
     ------------
@@ -18,6 +94,16 @@ def calculate_particle_stress_correction(trajectory: Array, input_params: tuple,
         Flag whether the only-over-particle-averaged stress is outputed
     fileout: (str)
         The name of the parent directory
+    chunk_size: (int)
+        The number of frames read from the trajectory at once
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    cache_dir: (str)
+        The directory where the <xF> tensor of every frame is cached for later runs. If None, nothing is cached
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision of the pair distances ("float64" or "float32")
 
     Returns
     -------------
@@ -29,71 +115,57 @@ def calculate_particle_stress_correction(trajectory: Array, input_params: tuple,
     # Untuple parameters
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
-    # Potential characteristics
-    k = 2500 / dt
-    sigma = 2. * (1.001)
-
-    # Initialize stress tensor
-    stress_tensor = np.zeros((n_steps, 3, 3))
-
-    for step in range(n_steps):
-
-        # Calculate the particle distance vectors (only the lower triangular part)
-        distance_vectors = np.zeros((N, N, 3))
-        norm_matrix = np.zeros((N, N, 3))
-        
-        positions = trajectory[step]
-        distance_vectors = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]  # shape: (N, N, 3)
-
-        # Compute Euclidean norms for each distance vector
-        norms = np.linalg.norm(distance_vectors, axis=2)  # shape: (N, N)
-
-        # Broadcast norms into shape (N, N, 3)
-        norm_matrix = np.repeat(norms[:, :, np.newaxis], 3, axis=2)
-
-        norm_matrix = np.where(norm_matrix == 0.0, np.inf, norm_matrix)
-        
-        # Calculate forces
-        Fp = np.zeros((N, N, 3))
-        Fp = k * (1-sigma/norm_matrix) * distance_vectors / norm_matrix
-        
-        Fp = np.where(norm_matrix < sigma, Fp, 0.0)
-        
-        # Calculate the xF term
-        stress_tensor_temp = np.zeros((N, N, 3, 3))
-        
-        stress_tensor_temp = distance_vectors[..., :, np.newaxis] * Fp[..., np.newaxis, :]
-        S_p = np.sum(stress_tensor_temp, axis=1)
-
-        # Average and normalize
-        S = np.average(S_p, axis=0) * N / (box_length)**3 / kT
-        
-        stress_tensor[step] = S
-
+    dtype = compute_dtype(precision)
+    key = cache_key(input_fingerprint(trajectory, "trajectory", directory), output_metadata(input_params), precision) if cache_dir is not None else None
+    stress_tensor = cached_array(cache_dir, "xF", key, lambda: particle_stress_tensor(trajectory, input_params, chunk_size, dtype))
 
     # Reshape just for my convenience
     stress_tensor = np.reshape(stress_tensor, (n_steps, 9))
 
-    binned_times, binned_stress_xy = log_bin_stat(time, np.transpose(stress_tensor)[1], num_bins=80)
+    binned_times, binned_stress_tensor, _, _ = log_bin_reduce(time, stress_tensor, num_bins=80)
+    binned_stress_xy = binned_stress_tensor[:, 1]
 
-    file = open("ParticleStressaveraged"+fileout+".dat","w+")
-    file.write("\g(g)   \g(s)\-(xy)\n")
-    for i in range(len(binned_times)):
-        file.write(str(binned_times[i] * shear_rate)+"   "+str(binned_stress_xy[i])+"\n")
-    file.close
+    write_output("ParticleStressaveraged"+fileout, PARTICLE_STRESS_HEADER,
+                 dict({"strain": binned_times * shear_rate}, **particle_stress_components(binned_stress_tensor)),
+                 input_params, output_format, directory=directory)
 
     if raw_stress_flag:
-        file = open("ParticleStress"+fileout+".dat","w+")
-        file.write("\g(g)   \g(s)\-(xy)\n")
-        for i in range(len(time)):
-            file.write(str(time[i]*shear_rate)+"   "+str(np.transpose(stress_tensor)[1][i])+"\n")
-        file.close
+        write_output("ParticleStress"+fileout, PARTICLE_STRESS_HEADER,
+                     dict({"strain": time * shear_rate}, **particle_stress_components(stress_tensor)),
+                     input_params, output_format, directory=directory)
 
-    return time*shear_rate, binned_stress_xy
+    return binned_times*shear_rate, binned_stress_xy
 
 
+def average_stresslet(stresslet: Array, chunk_size: int = 1000, dtype: type = np.float64) -> Array:
+    """
+    Function to calculate the particle averaged stresslet of every frame, reading a few frames at a time
 
-def caclulate_average_stress(stresslet: Array, input_params: tuple, raw_stress_flag: bool, N_stress_bins: int, fileout: str) -> tuple[Array, Array]:
+    Parameters
+    ----------
+    stresslet: (Array)
+        The stresslet, can be memory-mapped; has dimensions (n_steps, N, 5)
+    chunk_size: (int)
+        The number of frames read at once
+    dtype: (type)
+        The floating point type the frames are converted to. The sums over the particles are accumulated in double precision
+
+    Returns
+    -------------
+    av_stresslet: (Array)
+        The particle averaged stresslet; has dimensions (n_steps, 5)
+    """
+    n_steps, N = stresslet.shape[:2]
+
+    av_stresslet = np.empty((n_steps, stresslet.shape[2]))
+    for chunk in frame_chunks(n_steps, chunk_size):
+        av_stresslet[chunk] = np.sum(np.asarray(stresslet[chunk], dtype=dtype), axis=1, dtype=np.float64) / N
+
+    return av_stresslet
+
+
+
+def caclulate_average_stress(stresslet: Array, input_params: tuple, raw_stress_flag: bool, N_stress_bins: int, fileout: str, output_format: str = "text", cache_dir: str | None = None, directory: str = ".", precision: str = "float64") -> tuple[Array, Array]:
     """
     A function to calculate the logarithmic binned average of the stresslet. There is also option to save the only-particle-averaged stresslet
 
@@ -110,6 +182,14 @@ def caclulate_average_stress(stresslet: Array, input_params: tuple, raw_stress_f
         The number of bins for the stress average
     fileout: (str)
         The name of the parent directory, for naming the output file
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    cache_dir: (str)
+        The directory where the particle averaged stresslet is cached for later runs (e.g. with a different number of bins). If None, nothing is cached
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision the stresslet is read in, a few frames at a time ("float64" or "float32"). The particle averages are accumulated in double precision
 
     Returns
     -------------
@@ -133,43 +213,232 @@ def caclulate_average_stress(stresslet: Array, input_params: tuple, raw_stress_f
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
     
     #Take ensemble average
-    av_stresslet = np.average(stresslet, 1)
+    key = cache_key(input_fingerprint(stresslet, "stresslet", directory), precision) if cache_dir is not None else None
+    av_stresslet = cached_array(cache_dir, "av_stresslet", key, lambda: average_stresslet(stresslet, dtype=compute_dtype(precision)))
+
+    return write_average_stress(av_stresslet, input_params, raw_stress_flag, N_stress_bins, fileout, output_format, directory)
+
+
+def write_average_stress(av_stresslet: Array, input_params: tuple, raw_stress_flag: bool, N_stress_bins: int, fileout: str, output_format: str = "text", directory: str = ".") -> tuple[Array, Array]:
+    """
+    A function to bin the particle averaged stresslet and write the stress output files (see caclulate_average_stress)
+
+    Parameters
+    ----------
+
+    av_stresslet: (ndarray)
+        The particle averaged stresslet of every frame. Should be shape (N_steps, 5)
+    input_params: (tuple)
+        The simulation parameters
+    raw_stress_flag: bool
+        Flag the output of the only-particle-averaged stresslet
+    N_stress_bins: (int)
+        The number of bins for the stress average
+    fileout: (str)
+        The name of the parent directory, for naming the output file
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+
+    Returns
+    -------------
+    binned_times/tb*Pe: (Array)
+        The strain values 
+    binned_stress_xy: (Array)
+        The dimensionless average xy component of the stresslet
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
 
     if raw_stress_flag == True: # store the only-particle averaged stress
 
         raw_stresslet = av_stresslet * N / (box_length**3) / kT # Translate the stresslet to the stress tensor and normalize
 
-        file4 = open("AVST"+fileout+"raw.dat","w+")
-        file4.write("t/t\-(B)   \g(g)   \g(s)\-(xy)   \g(s)\-(xx)   \g(s)\-(yy)   \g(s)\-(zz)\n")
-        for i in range(n_steps):
-            file4.write(str(time[i]/tb)+"   "+str(time[i]*shear_rate)+"   "+str(raw_stresslet[i][1])+"   "+str(raw_stresslet[i][0])+"   "+str(raw_stresslet[i][2])+"   "+str(0.0 - raw_stresslet[i][0] - raw_stresslet[i][2])+"\n")
-        file4.close
+        write_output("AVST"+fileout+"raw", r"t/t\-(B)   \g(g)   \g(s)\-(xy)   \g(s)\-(xx)   \g(s)\-(yy)   \g(s)\-(zz)",
+                     {"time": time / tb, "strain": time * shear_rate,
+                      "stress_xy": raw_stresslet[:, 1], "stress_xx": raw_stresslet[:, 0], "stress_yy": raw_stresslet[:, 3],
+                      "stress_zz": 0.0 - raw_stresslet[:, 0] - raw_stresslet[:, 3]},
+                     input_params, output_format, directory=directory)
 
-    #Prepare the stresslets for the binning
-    xy_stresslet = av_stresslet[:,[1]].ravel()
-    xx_stresslet = av_stresslet[:,[0]].ravel()
-    yy_stresslet = av_stresslet[:,[3]].ravel()
-    zz_stresslet = 0.0 - xx_stresslet - yy_stresslet
-
-    #Calculate the binned stresslet for every component
-    binned_times, binned_stresslet_xy = log_bin_stat(time, xy_stresslet, num_bins=N_stress_bins)
-    _, binned_stresslet_xx = log_bin_stat(time, xx_stresslet, num_bins=N_stress_bins)
-    _, binned_stresslet_yy = log_bin_stat(time, yy_stresslet, num_bins=N_stress_bins)
-    _, binned_stresslet_zz = log_bin_stat(time, zz_stresslet, num_bins=N_stress_bins)
+    #Calculate the binned stresslet for all five components at once
+    binned_times, binned_stresslet, _, _ = log_bin_reduce(time, av_stresslet, num_bins=N_stress_bins)
 
     #Trasnlate the stresslet to stress tensor using the particle number density and normalize
-    binned_stresslet_xy = binned_stresslet_xy * N / (box_length**3) / kT
-    binned_stresslet_xx = binned_stresslet_xx * N / (box_length**3) / kT
-    binned_stresslet_yy = binned_stresslet_yy * N / (box_length**3) / kT
-    binned_stresslet_zz = binned_stresslet_zz * N / (box_length**3) / kT
+    binned_stresslet = binned_stresslet * N / (box_length**3) / kT
+    binned_stresslet_xy = binned_stresslet[:, 1]
+    binned_stresslet_xx = binned_stresslet[:, 0]
+    binned_stresslet_yy = binned_stresslet[:, 3]
+    binned_stresslet_zz = 0.0 - binned_stresslet_xx - binned_stresslet_yy
 
     
     # Save the averaged stresslet
-    file3 = open("AVST"+fileout+".dat","w+") #storing the stress tensor
-    file3.write("t/t\-(B)   \g(g)   \g(s)\-(xy)   \g(s)\-(xx)   \g(s)\-(yy)   \g(s)\-(zz)\n")
-    for i in range(len(binned_times)):
-        file3.write(str(binned_times[i]/tb)+"   "+str(binned_times[i]*shear_rate)+"   "+str(binned_stresslet_xy[i])+"   "+str(binned_stresslet_xx[i])+"   "+str(binned_stresslet_yy[i])+"   "+str(binned_stresslet_zz[i])+"\n")
-    file3.close
+    write_output("AVST"+fileout, r"t/t\-(B)   \g(g)   \g(s)\-(xy)   \g(s)\-(xx)   \g(s)\-(yy)   \g(s)\-(zz)",
+                 {"time": binned_times / tb, "strain": binned_times * shear_rate,
+                  "stress_xy": binned_stresslet_xy, "stress_xx": binned_stresslet_xx, "stress_yy": binned_stresslet_yy,
+                  "stress_zz": binned_stresslet_zz},
+                 input_params, output_format, directory=directory) #storing the stress tensor
+
+    return binned_times*shear_rate, binned_stresslet_xy
+
+
+def stress_profile(trajectory: Array,
+                   stresslet: Array,
+                   input_params: tuple,
+                   n_bins: int,
+                   fileout: str,
+                   frame_range: list | None = None,
+                   stride: int = 1,
+                   chunk_size: int = 1000,
+                   output_format: str = "text",
+                   directory: str = ".") -> tuple[Array, Array, Array]:
+    """
+    Function to calculate the stress profile across the gradient (y) direction, averaged over all of the (selected) frames, to reveal stress heterogeneities (e.g. shear banding). Every particle stresslet is binned by the y position of the particle, with the same bins as the velocity profile
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The positions of the particles
+    stresslet: (Array)
+        The stresslets of the particles. Should be shape (N_steps, N, 5)
+    input_params: (tuple)
+        The input parameters
+    n_bins: (int)
+        The number of the bin edges (n_bins - 1 bins)
+    fileout: (str)
+        The name of the parent directory
+    frame_range: (list)
+        The [start, stop] frames over which the profile is averaged (e.g. only the steady state). If None or empty, all frames are used
+    stride: (int)
+        The step between the averaged frames
+    chunk_size: (int)
+        The number of frames read at once
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+
+    Returns
+    ------------
+    binned_y: (Array)
+        The y binned coordinate values
+    binned_stress: (Array)
+        The dimensionless xy, xx, yy and zz stress components of every bin; has dimensions (n_bins - 1, 4)
+    stress_errors: (Array)
+        The standard errors of the binned stress components
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    frames = frame_selection(n_steps, frame_range, stride)
+
+    counts, sums, squared_deviations = stress_bin_sums(trajectory, stresslet, frames, box_length, n_bins, chunk_size)
+
+    return write_stress_profile(counts, sums, squared_deviations, input_params, n_bins, fileout, len(frames), output_format, directory)
+
+
+def stress_bin_sums(trajectory: Array, stresslet: Array, frames: Array, box_length: float, n_bins: int, chunk_size: int = 1000) -> tuple[Array, Array, Array]:
+    """
+    Function to accumulate the xy, xx, yy and zz stresslet components of the particles in bins of their y position
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The positions of the particles
+    stresslet: (Array)
+        The stresslets of the particles
+    frames: (Array)
+        The indices of the accumulated frames
+    box_length: (float)
+        The length of the box
+    n_bins: (int)
+        The number of the bin edges (n_bins - 1 bins)
+    chunk_size: (int)
+        The number of frames read at once
+
+    Returns
+    ------------
+    counts: (Array)
+        The number of particles in every bin
+    sums: (Array)
+        The sum of the stresslet components in every bin; has dimensions (n_bins - 1, 4)
+    squared_deviations: (Array)
+        The sum of the squared deviations from the mean stresslet components of every bin
+    """
+    counts = np.zeros(n_bins - 1, dtype=np.int64)
+    sums = np.zeros((n_bins - 1, 4))
+    squared_deviations = np.zeros((n_bins - 1, 4))
+
+    # Accumulate all components in the y bins at once, over chunks of frames
+    for chunk in frame_chunks(len(frames), chunk_size):
+        positions = np.asarray(trajectory[frames[chunk], :, 1]) # the y positions
+        stresslet_chunk = np.asarray(stresslet[frames[chunk]]).reshape(-1, 5)
+
+        # The xy, xx, yy and zz components (the stresslet is traceless)
+        components = np.stack((stresslet_chunk[:, 1], stresslet_chunk[:, 0], stresslet_chunk[:, 3],
+                               0.0 - stresslet_chunk[:, 0] - stresslet_chunk[:, 3]), axis=1)
+
+        index = lin_bin_index(positions.ravel(), box_length, n_bins)
+        counts, sums, squared_deviations = merge_bin_deviations(counts, sums, squared_deviations, *bin_deviations(index, components, n_bins - 1))
+
+    return counts, sums, squared_deviations
+
+
+def write_stress_profile(counts: Array, sums: Array, squared_deviations: Array, input_params: tuple, n_bins: int, fileout: str, n_frames: int, output_format: str = "text", directory: str = ".") -> tuple[Array, Array, Array]:
+    """
+    Function to write the stress profile from the accumulated bin sums (see stress_bin_sums)
+
+    Parameters
+    -----------
+    counts: (Array)
+        The number of particles in every bin
+    sums: (Array)
+        The sum of the stresslet components in every bin
+    squared_deviations: (Array)
+        The sum of the squared deviations from the mean stresslet components of every bin
+    input_params: (tuple)
+        The input parameters
+    n_bins: (int)
+        The number of the bin edges (n_bins - 1 bins)
+    fileout: (str)
+        The name of the parent directory
+    n_frames: (int)
+        The number of accumulated frames (for the local density)
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+
+    Returns
+    ------------
+    binned_y: (Array)
+        The y binned coordinate values
+    binned_stress: (Array)
+        The dimensionless xy, xx, yy and zz stress components of every bin
+    stress_errors: (Array)
+        The standard errors of the binned stress components
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    bin_counts = counts[:, np.newaxis]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_stresslet = sums / bin_counts
+        stresslet_errors = np.sqrt(squared_deviations / bin_counts / (bin_counts - 1))
+
+    # Translate the mean stresslet to the stress tensor with the mean number density and normalize (as in the average stress)
+    binned_stress = (mean_stresslet * N / (box_length**3) / kT)[::-1] # same orientation as the velocity profile
+    stress_errors = (stresslet_errors * N / (box_length**3) / kT)[::-1]
+
+    # The local number density relative to the mean, for the stress of the particles in a bin per volume
+    relative_density = (counts / n_frames / (N / (n_bins - 1)))[::-1]
+
+    # Create the y_bins
+    y_range = np.linspace(0.0 - 0.5 * box_length,  0.5 * box_length, n_bins,)
+    binned_y = (y_range[:-1] + y_range[1:]) / 2.0 # take the center of the bin
+
+    write_output("Stressprofile"+fileout, r"y   n/n\-(0)   \g(s)\-(xy)   \g(s)\-(xx)   \g(s)\-(yy)   \g(s)\-(zz)   \g(d)\g(s)\-(xy)   \g(d)\g(s)\-(xx)   \g(d)\g(s)\-(yy)   \g(d)\g(s)\-(zz)",
+                 {"y": binned_y, "density": relative_density,
+                  "stress_xy": binned_stress[:, 0], "stress_xx": binned_stress[:, 1], "stress_yy": binned_stress[:, 2], "stress_zz": binned_stress[:, 3],
+                  "stress_xy_error": stress_errors[:, 0], "stress_xx_error": stress_errors[:, 1], "stress_yy_error": stress_errors[:, 2], "stress_zz_error": stress_errors[:, 3]},
+                 input_params, output_format, directory=directory)
 
-    return binned_times*shear_rate, binned_stresslet_xy
\ No newline at end of file
+    return binned_y, binned_stress, stress_errors
@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from post_process_jfsd.cache import CACHE_DIR
+
+
+# Name of the log file written in every run directory
+LOG_FILE = "post_process.log"
+
+
+def find_run_directories(patterns: list[str]) -> list[str]:
+    """
+    A function to expand the given directories and glob patterns into the list of simulation directories
+
+    Parameters
+    ----------
+    patterns: (list)
+        Directories or glob patterns (e.g. "sweep/phi_*")
+
+    Returns
+    ----------
+    directories: (list)
+        The matching directories, sorted and without duplicates
+    """
+    directories = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        directories.update(os.path.normpath(match) for match in matches if os.path.isdir(match))
+
+    return sorted(directories)
+
+
+def _written_files(directory: str, start_time: float) -> list[str]:
+    """
+    The files of a run directory modified after the start of its post processing (without the log file and the cache)
+    """
+    written = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename != LOG_FILE and filename != CACHE_DIR and os.path.isfile(path) and os.path.getmtime(path) >= start_time:
+            written.append(filename)
+
+    return written
+
+
+def process_run(directory: str, settings_path: str, cache: bool = True, incremental: bool = False) -> dict:
+    """
+    Post processes one simulation directory, writing the printed output to a log file in the directory. Errors are caught and reported, so a failing run does not stop the batch
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory
+    settings_path: (str)
+        The settings file shared by all runs
+    cache: (bool)
+        Flag whether the cache of intermediate results can be used
+    incremental: (bool)
+        Flag whether only the frames written since the last incremental run are processed
+
+    Returns
+    ----------
+    summary: (dict)
+        The directory, status ("done" or "failed"), written files, error message and wall time of the run
+    """
+    # Imported here, so the batch module can be loaded without the analysis dependencies
+    from post_process_jfsd.main import post_process
+
+    start_time = time.time()
+    error = None
+
+    with open(os.path.join(directory, LOG_FILE), "w") as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                post_process(directory, settings_path, cache, incremental)
+                print("Done!")
+            except Exception as exception:
+                traceback.print_exc()
+                error = f"{type(exception).__name__}: {exception}"
+
+    return dict(directory=directory,
+                status="failed" if error else "done",
+                outputs=_written_files(directory, start_time),
+                error=error,
+                wall_time=time.time() - start_time)
+
+
+def run_batch(patterns: list[str],
+              settings_path: str = "post_process_settings.toml",
+              n_workers: int = 1,
+              cache: bool = True,
+              summary_file: str = "post_process_batch.json",
+              incremental: bool = False) -> list[dict]:
+    """
+    Post processes many simulation directories (e.g. of a parameter sweep) with the same settings, processing several runs at the same time
+
+    Parameters
+    ----------
+    patterns: (list)
+        Directories or glob patterns of the simulation directories
+    settings_path: (str)
+        The settings file shared by all runs
+    n_workers: (int)
+        The number of runs processed at the same time (each in its own process)
+    cache: (bool)
+        Flag whether the cache of intermediate results can be used
+    summary_file: (str)
+        The .json index of the written files and the failures of all runs. If None, no index is written
+    incremental: (bool)
+        Flag whether only the frames written since the last incremental run are processed (e.g. to monitor running simulations)
+
+    Returns
+    ----------
+    summaries: (list)
+        The summary of every run (see process_run), in the order of the directories
+    """
+    directories = find_run_directories(patterns)
+    if not directories:
+        raise ValueError(f"No simulation directories match {patterns}")
+    if not os.path.isfile(settings_path):
+        raise FileNotFoundError(f"The settings file {settings_path} does not exist")
+
+    print(f"Post processing {len(directories)} directories with {settings_path}\n")
+
+    summaries = {}
+    n_workers = min(max(int(n_workers), 1), len(directories))
+
+    if n_workers == 1:
+        for directory in directories:
+            summaries[directory] = process_run(directory, settings_path, cache, incremental)
+            print(f"{summaries[directory]['status']:>6}  {directory}")
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(process_run, directory, settings_path, cache, incremental): directory for directory in directories}
+            for future in as_completed(futures):
+                directory = futures[future]
+                try:
+                    summaries[directory] = future.result()
+                except Exception as exception:
+                    # The worker process itself failed (e.g. out of memory)
+                    summaries[directory] = dict(directory=directory, status="failed", outputs=[],
+                                                error=f"{type(exception).__name__}: {exception}", wall_time=None)
+                print(f"{summaries[directory]['status']:>6}  {directory}")
+
+    summaries = [summaries[directory] for directory in directories]
+    failed = [summary for summary in summaries if summary["status"] == "failed"]
+
+    if summary_file is not None:
+        with open(summary_file, "w") as f:
+            json.dump(dict(settings=os.path.abspath(settings_path),
+                           n_runs=len(summaries),
+                           n_failed=len(failed),
+                           runs=summaries), f, indent=2)
+
+    print(f"\n{len(summaries) - len(failed)} of {len(summaries)} runs done")
+    for summary in failed:
+        print(f"Failed: {summary['directory']} ({summary['error']}), see {os.path.join(summary['directory'], LOG_FILE)}")
+
+    return summaries
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="JFSD post processing of many simulation directories with the same settings")
+    parser.add_argument("directories", nargs="+", help="Simulation directories or glob patterns (e.g. 'sweep/phi_*')")
+    parser.add_argument("-s", "--settings", default="post_process_settings.toml", help="The settings file shared by all runs")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of runs processed at the same time")
+    parser.add_argument("-o", "--summary", default="post_process_batch.json", help="The .json index of the outputs and failures of all runs")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every intermediate result, without reading or writing the cache")
+    parser.add_argument("--incremental", action="store_true", help="Update the outputs of running simulations with the frames written since the last incremental run")
+    args = parser.parse_args()
+
+    # The figures are only saved, never shown (also in the worker processes)
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
+    print("JFSD batch post processing script\n")
+
+    summaries = run_batch(args.directories, args.settings, args.workers, not args.no_cache, args.summary, args.incremental)
+
+    # A non-zero exit status if any run failed, for use in job scripts
+    if any(summary["status"] == "failed" for summary in summaries):
+        raise SystemExit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
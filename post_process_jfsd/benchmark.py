@@ -0,0 +1,361 @@
+import numpy as np
+from numpy import ndarray as Array
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from post_process_jfsd.synthetic import synthetic_simulation
+
+
+# The benchmarked analyses, called with the loaded synthetic simulation
+ANALYSES = {
+    "msd_windowed": lambda case: _calculate_msd(case, True),
+    "msd_log": lambda case: _calculate_msd(case, 'log'),
+    "msd_direct": lambda case: _calculate_msd(case, False),
+    "stress": lambda case: _average_stress(case),
+    "xF": lambda case: _particle_stress(case),
+    "gofr": lambda case: _gofr(case),
+    "gofxy": lambda case: _gofxy(case),
+    "sq": lambda case: _sq(case),
+    "structure_evolution": lambda case: _structure_evolution(case),
+    "velocity_profile": lambda case: _velocity_profile(case),
+    "stress_profile": lambda case: _stress_profile(case),
+    "stress_acf": lambda case: _stress_acf(case),
+    "vacf": lambda case: _vacf(case),
+    "dynamics": lambda case: _dynamics(case),
+    "lve": lambda case: _lve(case),
+    "ovito": lambda case: _ovito(case),
+}
+
+# The analyses with a float32 compute mode (the precision setting)
+PRECISION_ANALYSES = ("msd_windowed", "msd_log", "msd_direct", "stress", "xF", "sq", "gofxy", "structure_evolution", "dynamics")
+
+# The dependencies that should only be imported when their analysis runs, not at startup
+HEAVY_MODULES = ("freud", "scipy", "matplotlib", "cmcrameri")
+
+# The entry points of the command line scripts
+STARTUP_MODULES = ("post_process_jfsd.main", "post_process_jfsd.batch")
+
+
+def _calculate_msd(case: dict, windowed_msd_flag: bool | str):
+    from post_process_jfsd.msd import calculate_msd
+    calculate_msd(case["trajectory"], case["input_params"], windowed_msd_flag, case["fileout"], directory=case["directory"], precision=case["precision"])
+
+
+def _average_stress(case: dict):
+    from post_process_jfsd.av_stress import caclulate_average_stress
+    caclulate_average_stress(case["stresslet"], case["input_params"], True, 80, case["fileout"], directory=case["directory"], precision=case["precision"])
+
+
+def _particle_stress(case: dict):
+    from post_process_jfsd.av_stress import calculate_particle_stress_correction
+    calculate_particle_stress_correction(case["trajectory"], case["input_params"], False, case["fileout"], directory=case["directory"], precision=case["precision"])
+
+
+def _gofr(case: dict):
+    from post_process_jfsd.gofr import gofr
+    r_max = min(5.0, 0.45 * case["input_params"][7])
+    gofr(case["trajectory"], -1, case["last_frame_index"], case["input_params"], 80, r_max, case["fileout"], [0, None], directory=case["directory"])
+
+
+def _gofxy(case: dict):
+    from post_process_jfsd.gofr_2d import gofxy_image
+    image_size = min(4.0, 0.25 * case["input_params"][7])
+    gofxy_image(case["trajectory"], case["input_params"], case["last_frame_index"], 0, False, case["fileout"], 0.7, 100,
+                image_size, image_size, [0, None], directory=case["directory"], precision=case["precision"])
+
+
+def _structure_evolution(case: dict):
+    from post_process_jfsd.structure_evolution import structure_evolution
+    r_max, image_size = min(5.0, 0.45 * case["input_params"][7]), min(4.0, 0.25 * case["input_params"][7])
+    structure_evolution(case["trajectory"], case["last_frame_index"], case["input_params"], case["fileout"], 80, r_max, 100, image_size, image_size, 0.7,
+                        n_log_frames=20, window=2, directory=case["directory"], precision=case["precision"])
+
+
+def _sq(case: dict):
+    from post_process_jfsd.structure_factor import structure_factor
+    structure_factor(case["trajectory"], -1, case["last_frame_index"], case["input_params"], case["fileout"], directory=case["directory"], precision=case["precision"])
+
+
+def _velocity_profile(case: dict):
+    from post_process_jfsd.velocity_profile import vel_profile
+    vel_profile(case["trajectory"], case["velocities"], case["input_params"], 80, case["fileout"], directory=case["directory"])
+
+
+def _stress_profile(case: dict):
+    from post_process_jfsd.av_stress import stress_profile
+    stress_profile(case["trajectory"], case["stresslet"], case["input_params"], 80, case["fileout"], directory=case["directory"])
+
+
+def _stress_acf(case: dict):
+    from post_process_jfsd.correlation import calculate_stress_autocorrelation
+    calculate_stress_autocorrelation(case["stresslet"], case["input_params"], case["fileout"], ["xy", "xz", "yz"], directory=case["directory"])
+
+
+def _vacf(case: dict):
+    from post_process_jfsd.correlation import calculate_velocity_autocorrelation
+    calculate_velocity_autocorrelation(case["velocities"], case["trajectory"], case["input_params"], case["fileout"], True, directory=case["directory"])
+
+
+def _dynamics(case: dict):
+    from post_process_jfsd.dynamics import calculate_self_dynamics
+    calculate_self_dynamics(case["trajectory"], case["input_params"], case["fileout"], [1.0, 2.0, 3.5, 5.0], directory=case["directory"], precision=case["precision"])
+
+
+def _lve(case: dict):
+    from post_process_jfsd.msdtolve import msd_to_lve
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = case["input_params"]
+    lag_time = time[1:] / tb
+    msd_to_lve(case["fileout"], directory=case["directory"], msd_data=(lag_time, 6.0 * lag_time / (1.0 + lag_time)**0.5))
+
+
+def _ovito(case: dict):
+    from post_process_jfsd.npy_to_xyz import npy_to_xyz
+    npy_to_xyz(case["trajectory"], case["fileout"], directory=case["directory"])
+
+
+def measure_analysis(name: str, directory: str, repeats: int = 1, precision: str = "float64") -> dict:
+    """
+    A function to time an analysis of a synthetic simulation and measure its memory. It should run in a fresh process, so the peak RSS belongs to this analysis only
+
+    Parameters
+    ----------
+    name: (str)
+        The name of the analysis (one of ANALYSES)
+    directory: (str)
+        The directory of the synthetic simulation; the outputs are written there
+    repeats: (int)
+        The number of timed runs. The fastest is reported
+    precision: (str)
+        The floating point precision of the analyses in PRECISION_ANALYSES ("float64" or "float32")
+
+    Returns
+    ----------
+    measurement: (dict)
+        The wall and CPU time of the fastest run, the peak of the memory allocated by python and numpy and the peak RSS of the process
+    """
+    from post_process_jfsd.utils import load_and_check, simulation_parameters, dir_name
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        trajectory, stresslet, velocities, last_frame_index = load_and_check(True, True, lazy=True, directory=directory)
+        input_params = simulation_parameters(trajectory, directory)
+
+    case = dict(trajectory=trajectory, stresslet=stresslet, velocities=velocities, last_frame_index=last_frame_index,
+                input_params=input_params, fileout=dir_name(directory), directory=directory, precision=precision)
+
+    wall_times, cpu_times = [], []
+    tracemalloc.start()
+    for _ in range(repeats):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ANALYSES[name](case)
+        wall_times.append(time.perf_counter() - start_wall)
+        cpu_times.append(time.process_time() - start_cpu)
+    peak_allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    fastest = int(np.argmin(wall_times))
+
+    return dict(wall_time=wall_times[fastest],
+                cpu_time=cpu_times[fastest],
+                peak_allocated_MB=peak_allocated / 1e6,
+                peak_rss_MB=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3) # ru_maxrss is in kB on Linux
+
+
+def measure_startup(module: str = "post_process_jfsd.main", repeats: int = 5) -> dict:
+    """
+    A function to time the import of a module in fresh interpreters, as at the start of a command line script
+
+    Parameters
+    ----------
+    module: (str)
+        The imported module
+    repeats: (int)
+        The number of started interpreters. The fastest is reported
+
+    Returns
+    ----------
+    measurement: (dict)
+        The wall time of the fastest interpreter (start and import), the time of the import alone and the heavy dependencies (HEAVY_MODULES) that were imported
+    """
+    code = ("import sys, time, json; start = time.perf_counter(); import " + module + "; "
+            "print(json.dumps([time.perf_counter() - start, sorted(m for m in sys.modules if m.split('.')[0] in sys.argv[1:])]))")
+
+    wall_times, import_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code, *HEAVY_MODULES], capture_output=True, text=True, check=True).stdout
+        wall_times.append(time.perf_counter() - start)
+        import_time, loaded = json.loads(output)
+        import_times.append(import_time)
+
+    heavy = sorted({name.split(".")[0] for name in loaded})
+
+    return dict(module=module, wall_time=min(wall_times), import_time=min(import_times), heavy_modules=heavy)
+
+
+def read_outputs(directory: str, exclude: set = frozenset()) -> dict:
+    """
+    A helper function to read all the outputs (.dat and .npz files) of a directory, except the excluded file names
+    """
+    from post_process_jfsd.output import read_output
+
+    outputs = {}
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension in (".dat", ".npz") and filename not in exclude:
+            outputs[filename] = read_output(name, directory)
+
+    return outputs
+
+
+def output_deviation(outputs: dict, reference_outputs: dict) -> float:
+    """
+    The maximum relative deviation of all the columns of a set of outputs from the same outputs of a reference run
+    """
+    deviations = [relative_deviation(outputs[filename][key], reference[key])
+                  for filename, reference in reference_outputs.items() for key in reference]
+
+    return max(deviations, default=0.0)
+
+
+def run_benchmarks(N_values: list[int],
+                   step_values: list[int],
+                   analyses: list[str] | None = None,
+                   system: str = "hard_spheres",
+                   repeats: int = 1,
+                   seed: int = 0,
+                   precision: str = "float64") -> list[dict]:
+    """
+    A function to benchmark the analyses on synthetic simulations over a grid of particle numbers and trajectory lengths. Every analysis runs in a fresh process. In float32 mode, the analyses of PRECISION_ANALYSES also run once in float64, and the maximum deviation of their outputs from the float64 outputs is reported
+
+    Parameters
+    ----------
+    N_values: (list)
+        The numbers of particles
+    step_values: (list)
+        The numbers of frames
+    analyses: (list)
+        The names of the benchmarked analyses. If None, all of ANALYSES
+    system: (str)
+        "hard_spheres" or "crystal" (see synthetic.synthetic_simulation)
+    repeats: (int)
+        The number of timed runs of every analysis
+    seed: (int)
+        The seed of the synthetic data
+    precision: (str)
+        The floating point precision of the analyses ("float64" or "float32")
+
+    Returns
+    ----------
+    results: (list)
+        One entry per analysis, N and number of frames, with the measurements of measure_analysis, the throughput in particle frames per second and the deviation from float64 (None if not compared)
+    """
+    analyses = list(ANALYSES) if analyses is None else analyses
+    unknown = [name for name in analyses if name not in ANALYSES]
+    if unknown:
+        raise ValueError(f"Unknown analyses {unknown}. Available analyses are {list(ANALYSES)}")
+    from post_process_jfsd.utils import compute_dtype
+    compute_dtype(precision)
+
+    results = []
+    print(f"{'analysis':<18}{'N':>8}{'frames':>8}{'wall [s]':>11}{'cpu [s]':>10}{'Mframes*N/s':>13}{'alloc [MB]':>12}{'RSS [MB]':>10}{'max dev':>10}")
+
+    for N in N_values:
+        for n_steps in step_values:
+            with tempfile.TemporaryDirectory() as temporary_directory:
+                directory = os.path.join(temporary_directory, f"bench_N{N}_T{n_steps}")
+                synthetic_simulation(directory, N, n_steps, system=system, seed=seed)
+
+                inputs = set(os.listdir(directory))
+
+                for name in analyses:
+                    compare = precision != "float64" and name in PRECISION_ANALYSES
+                    if compare:
+                        # The float64 outputs of the same analysis, as reference
+                        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                            executor.submit(measure_analysis, name, directory, 1, "float64").result()
+                        reference_outputs = read_outputs(directory, inputs)
+
+                    # A fresh process for every analysis, so the peak RSS is not inherited
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                        measurement = executor.submit(measure_analysis, name, directory, repeats, precision).result()
+
+                    deviation = output_deviation(read_outputs(directory, inputs), reference_outputs) if compare else None
+                    throughput = N * n_steps / measurement["wall_time"]
+                    results.append(dict(analysis=name, N=N, n_steps=n_steps, system=system, precision=precision, throughput=throughput,
+                                        max_deviation=deviation, **measurement))
+                    print(f"{name:<18}{N:>8}{n_steps:>8}{measurement['wall_time']:>11.3f}{measurement['cpu_time']:>10.3f}"
+                          f"{throughput / 1e6:>13.3f}{measurement['peak_allocated_MB']:>12.1f}{measurement['peak_rss_MB']:>10.1f}"
+                          f"{'-' if deviation is None else f'{deviation:.1e}':>10}")
+
+                    # Every analysis starts from the inputs only
+                    for filename in set(os.listdir(directory)) - inputs:
+                        if os.path.isfile(os.path.join(directory, filename)):
+                            os.remove(os.path.join(directory, filename))
+
+    return results
+
+
+def relative_deviation(result: Array, reference: Array) -> float:
+    """
+    The maximum absolute deviation of a result from its reference, relative to the largest reference value
+    """
+    result, reference = np.asarray(result, dtype=np.float64), np.asarray(reference, dtype=np.float64)
+    if result.shape != reference.shape:
+        return np.inf
+
+    return float(np.nanmax(np.abs(result - reference)) / max(np.nanmax(np.abs(reference)), 1e-300))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the post processing analyses on synthetic data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="Time the analyses over a grid of system sizes and trajectory lengths")
+    bench_parser.add_argument("--N", type=int, nargs="+", default=[500, 2000], help="The numbers of particles")
+    bench_parser.add_argument("--steps", type=int, nargs="+", default=[200, 1000], help="The numbers of frames")
+    bench_parser.add_argument("--analyses", nargs="+", default=None, choices=list(ANALYSES), help="The analyses to time (default: all)")
+    bench_parser.add_argument("--system", default="hard_spheres", choices=["hard_spheres", "crystal"], help="The synthetic system")
+    bench_parser.add_argument("--repeats", type=int, default=1, help="The number of timed runs per analysis (the fastest is reported)")
+    bench_parser.add_argument("--precision", default="float64", choices=["float64", "float32"],
+                              help="The precision of the analyses; in float32 the maximum deviation from float64 is reported")
+    bench_parser.add_argument("--output", default=None, help="A .json file for the results")
+
+    startup_parser = subparsers.add_parser("startup", help="Time the start of the command line scripts")
+    startup_parser.add_argument("--repeats", type=int, default=5, help="The number of started interpreters (the fastest is reported)")
+    startup_parser.add_argument("--max-time", type=float, default=None, help="Fail if the import of a script takes longer (in seconds)")
+
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        print(f"{'module':<26}{'start [s]':>11}{'import [s]':>12}  heavy dependencies")
+        failed = False
+        for module in STARTUP_MODULES:
+            measurement = measure_startup(module, args.repeats)
+            print(f"{module:<26}{measurement['wall_time']:>11.3f}{measurement['import_time']:>12.3f}  {', '.join(measurement['heavy_modules']) or '-'}")
+            failed |= bool(measurement["heavy_modules"]) or (args.max_time is not None and measurement["import_time"] > args.max_time)
+        if failed:
+            raise SystemExit(1)
+    else:
+        results = run_benchmarks(args.N, args.steps, args.analyses, args.system, args.repeats, precision=args.precision)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
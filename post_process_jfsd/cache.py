@@ -0,0 +1,180 @@
+import numpy as np
+from numpy import ndarray as Array
+from typing import Callable
+import hashlib
+import os
+
+
+# Default name of the cache directory, inside the simulation directory
+CACHE_DIR = ".post_process_cache"
+
+
+def _file_fingerprint(filename: str, shape: tuple) -> str:
+    """
+    The fingerprint of (the first frames of) an array stored in a .npy file: its path, size and modification time
+    """
+    stat = os.stat(filename)
+
+    return f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}:{shape}"
+
+
+def _loaded_from(array: Array, source_file: str) -> bool:
+    """
+    Checks cheaply whether an array holds the first frames of a .npy file: same type and frame shape, and the same first and last frame
+    """
+    if not os.path.isfile(source_file) or len(array) == 0:
+        return False
+
+    source = np.load(source_file, mmap_mode='r')
+
+    return (source.dtype == array.dtype and source.shape[1:] == array.shape[1:] and len(array) <= len(source)
+            and np.array_equal(source[0], array[0]) and np.array_equal(source[len(array) - 1], array[-1]))
+
+
+def array_fingerprint(array: Array, source_file: str | None = None) -> str:
+    """
+    A function to identify the contents of an input array. Memory-mapped arrays, and arrays read into memory from a given source file, are identified by their file (path, size and modification time), so no data is hashed. Other arrays are identified by a checksum of their data
+
+    Parameters
+    ----------
+    array: (Array)
+        The (possibly memory-mapped) input array
+    source_file: (str)
+        The .npy file the array was read from, if any. It is only used if the array matches the beginning of the file
+
+    Returns
+    ----------
+    fingerprint: (str)
+        A string that changes when the contents of the array change
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return _file_fingerprint(array.filename, array.shape)
+
+    if source_file is not None and _loaded_from(array, source_file):
+        return _file_fingerprint(source_file, array.shape)
+
+    checksum = hashlib.sha256(np.ascontiguousarray(array).data).hexdigest()
+
+    return f"{checksum}:{array.shape}:{array.dtype.str}"
+
+
+def input_fingerprint(array: Array, name: str, directory: str = ".") -> str:
+    """
+    A function to identify an input array of a simulation directory ("trajectory", "stresslet" or "velocities", as loaded by utils.load_and_check) by its .npy file, whether it is memory-mapped or read into memory
+
+    Parameters
+    ----------
+    array: (Array)
+        The input array
+    name: (str)
+        The name of the input file, without the extension
+    directory: (str)
+        The simulation directory
+
+    Returns
+    ----------
+    fingerprint: (str)
+        A string that changes when the contents of the array change (see array_fingerprint)
+    """
+    return array_fingerprint(array, os.path.join(directory, name + ".npy"))
+
+
+def cache_key(*items) -> str:
+    """
+    A function to get the key of a cached result from everything it depends on (input fingerprints, simulation parameters and analysis settings)
+
+    Parameters
+    ----------
+    items:
+        The fingerprints, parameters and settings (numbers, strings, tuples and dicts of them)
+
+    Returns
+    ----------
+    key: (str)
+        The hash of the items
+    """
+    return hashlib.sha256(repr(items).encode()).hexdigest()[:32]
+
+
+def cached_array(cache_dir: str | None, name: str, key: str, compute: Callable, writes_file: bool = False) -> Array:
+    """
+    A function to reuse an intermediate array from the cache, or compute and store it
+
+    Parameters
+    ----------
+    cache_dir: (str)
+        The cache directory. If None, the array is always computed and not stored
+    name: (str)
+        The name of the intermediate result (part of the file name)
+    key: (str)
+        The key of the result (see cache_key)
+    compute: (Callable)
+        The function computing the array. If writes_file is True, it is called with the name of the .npy file it should write, else without arguments
+    writes_file: (bool)
+        Flag whether the compute function writes the .npy file itself (for arrays too large for the memory)
+
+    Returns
+    ----------
+    array: (Array)
+        The computed or cached array. Arrays written by the compute function are returned memory-mapped
+    """
+    if cache_dir is None:
+        return compute(None) if writes_file else compute()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{name}_{key}.npy")
+
+    if os.path.exists(path):
+        os.utime(path) # mark as recently used
+        return np.load(path, mmap_mode='r' if writes_file else None)
+
+    # Write to a temporary file first, so an interrupted run never leaves a broken cache entry
+    temporary_path = os.path.join(cache_dir, f"{name}_{key}.{os.getpid()}.tmp.npy")
+    if writes_file:
+        compute(temporary_path)
+        os.replace(temporary_path, path)
+        return np.load(path, mmap_mode='r')
+
+    array = compute()
+    np.save(temporary_path, array)
+    os.replace(temporary_path, path)
+
+    return array
+
+
+def evict_cache(cache_dir: str, max_size_MB: float) -> int:
+    """
+    A function to limit the size of the cache, removing the least recently used results first
+
+    Parameters
+    ----------
+    cache_dir: (str)
+        The cache directory
+    max_size_MB: (float)
+        The maximum total size of the cache in MB
+
+    Returns
+    ----------
+    n_removed: (int)
+        The number of removed results
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".npy") and not filename.endswith(".tmp.npy"):
+            stat = os.stat(os.path.join(cache_dir, filename))
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+    total_size = sum(size for _, size, _ in entries)
+    n_removed = 0
+
+    for _, size, filename in sorted(entries):
+        if total_size <= max_size_MB * 1e6:
+            break
+        os.remove(os.path.join(cache_dir, filename))
+        total_size -= size
+        n_removed += 1
+
+    return n_removed
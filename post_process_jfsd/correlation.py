@@ -0,0 +1,308 @@
+import numpy as np
+from numpy import ndarray as Array
+from concurrent.futures import ProcessPoolExecutor
+
+from post_process_jfsd.utils import frame_chunks, share_array, open_source, log_bin_reduce
+from post_process_jfsd.output import write_output, output_metadata
+from post_process_jfsd.cache import cached_array, cache_key, input_fingerprint
+from post_process_jfsd.av_stress import average_stresslet
+
+
+# The column of every off-diagonal stress component in the stresslet (S_xx, S_xy, S_xz, S_yy, S_yz)
+STRESS_COMPONENTS = {"xy": 1, "xz": 2, "yz": 4}
+
+# The maximum number of values of a particle block (frames * particles * 3), so the FFTs of long series fit in memory (about 50 bytes per value)
+MAX_BLOCK_VALUES = 2**24
+
+# The minimum number of particles of a block, so long series are still read in a few passes over the file, with contiguous reads of every frame.
+# The FFTs of such a block take about 16 * 3 * 50 bytes per frame (2.4 GB for 10^6 frames)
+MIN_BLOCK_PARTICLES = 16
+
+
+def autocorrelation(series: Array) -> Array:
+    """
+    Function to calculate the autocorrelation of time series, averaged over all time origins. The correlation is calculated with zero padded FFTs, so the cost is O(T log T)
+
+    Parameters
+    -----------
+    series: (Array)
+        The time series; has dimensions (n_steps,) or (n_steps, ...) for several series
+
+    Returns
+    -----------
+    correlation: (Array)
+        <x(t + m) x(t)> of every lag time m, for every series; has the same dimensions as series
+    """
+    from scipy.fft import rfft, irfft, next_fast_len
+
+    series = np.asarray(series, dtype=np.float64)
+    n_steps = series.shape[0]
+    remaining = (n_steps - np.arange(n_steps)).reshape((n_steps,) + (1,) * (series.ndim - 1)) # Number of time origins of every lag time
+
+    n_fft = next_fast_len(2 * n_steps, real=True)
+    power = np.abs(rfft(series, n=n_fft, axis=0))**2
+
+    return irfft(power, n=n_fft, axis=0)[:n_steps] / remaining
+
+
+def stress_autocorrelation(stresslet: Array, input_params: tuple, components: list[str] = ("xy",), chunk_size: int = 1000, cache_dir: str | None = None, directory: str = ".") -> Array:
+    """
+    Function to calculate the relaxation modulus G(t) from the autocorrelation of the shear stress fluctuations (fluctuation-dissipation theorem)
+
+    Parameters
+    -----------
+    stresslet: (Array)
+        The stresslet, can be memory-mapped; has dimensions (n_steps, N, 5)
+    input_params: (tuple)
+        The simulation parameters
+    components: (list)
+        The off-diagonal stress components ("xy", "xz", "yz") whose autocorrelations are averaged
+    chunk_size: (int)
+        The number of frames read at once
+    cache_dir: (str)
+        The directory where the particle averaged stresslet is cached (shared with the stress average). If None, nothing is cached
+    directory: (str)
+        The simulation directory of the stresslet file (identifies the cached average)
+
+    Returns
+    -----------
+    modulus: (Array)
+        G(t) = V/kT <ds(t) ds(0)> of every lag time (ds the fluctuation of the shear stress), normalized by kT/a^3
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    unknown = [component for component in components if component not in STRESS_COMPONENTS]
+    if unknown or not components:
+        raise ValueError(f"Unknown stress components {list(components)}. Use some of {list(STRESS_COMPONENTS)}")
+
+    # The stress fluctuations need the average in double precision (the precision is part of the key shared with the stress average)
+    key = cache_key(input_fingerprint(stresslet, "stresslet", directory), "float64") if cache_dir is not None else None
+    av_stresslet = cached_array(cache_dir, "av_stresslet", key, lambda: average_stresslet(stresslet, chunk_size))
+
+    # The stress of the system is the sum of the particle stresslets over the volume
+    volume = box_length**3
+    stress = av_stresslet[:, [STRESS_COMPONENTS[component] for component in components]] * N / volume
+    stress = stress - np.mean(stress, axis=0)
+
+    return np.mean(autocorrelation(stress), axis=1) * volume / kT / kT
+
+
+def velocity_autocorrelation_block(source: str | tuple | Array, n_steps: int, first_particle: int, last_particle: int, position_source: str | tuple | Array | None = None, shear_rate: float = 0.0) -> Array:
+    """
+    Function to calculate the velocity autocorrelation of a block of particles, using all time origins
+
+    Parameters
+    -----------
+    source: (str | tuple | Array)
+        The velocities, or their file name / shared memory block (see utils.share_array)
+    n_steps: (int)
+        The number of written frames (a memory-mapped file can have unwritten frames at the end)
+    first_particle: (int)
+        The index of the first particle of the block
+    last_particle: (int)
+        The index after the last particle of the block
+    position_source: (str | tuple | Array)
+        The trajectory, or its file name / shared memory block. If given, the affine flow velocity shear_rate * y is subtracted from the x velocities
+    shear_rate: (float)
+        The shear rate of the affine flow
+
+    Returns
+    -----------
+    vacf_sum: (Array)
+        <v(t + m) . v(t)> of every lag time m, summed over the particles of the block
+    """
+    velocities = np.array(open_source(source)[:n_steps, first_particle:last_particle], dtype=np.float64)
+
+    if position_source is not None:
+        velocities[..., 0] -= shear_rate * open_source(position_source)[:n_steps, first_particle:last_particle, 1]
+
+    return np.sum(autocorrelation(velocities), axis=(1, 2))
+
+
+def velocity_autocorrelation(velocities: Array, trajectory: Array | None = None, shear_rate: float = 0.0, block_size: int = 1000, n_workers: int = 1) -> Array:
+    """
+    Function to calculate the velocity autocorrelation function, averaged over the particles and all time origins. The particles are processed in independent blocks, so the memory is bounded by the block size, and the blocks can be shared by a pool of worker processes
+
+    Parameters
+    -----------
+    velocities: (Array)
+        The velocities, can be memory-mapped; has dimensions (n_steps, N, 3)
+    trajectory: (Array)
+        The trajectory. If given, the affine flow velocity shear_rate * y is subtracted from the x velocities
+    shear_rate: (float)
+        The shear rate of the affine flow
+    block_size: (int)
+        The maximum number of particles processed at once by every worker. It is reduced for long series, so a block has at most MAX_BLOCK_VALUES values, but not below MIN_BLOCK_PARTICLES (the memory then grows with the number of frames, see MIN_BLOCK_PARTICLES)
+    n_workers: (int)
+        The number of worker processes
+
+    Returns
+    -----------
+    vacf: (Array)
+        <v(t) . v(0)> of every lag time
+    """
+    (n_steps, N, _) = velocities.shape
+    block_size = min(int(block_size), max(MAX_BLOCK_VALUES // (3 * n_steps), MIN_BLOCK_PARTICLES))
+    blocks = [(block.start, block.stop) for block in frame_chunks(N, block_size)]
+    n_workers = min(max(int(n_workers), 1), len(blocks))
+
+    if n_workers == 1:
+        vacf_sum = sum(velocity_autocorrelation_block(velocities, n_steps, first, last, trajectory, shear_rate) for first, last in blocks)
+    else:
+        # The workers read their blocks from the memory-mapped files or shared memory copies of the arrays
+        source, shared_block = share_array(velocities)
+        position_source, shared_positions = share_array(trajectory) if trajectory is not None else (None, None)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(velocity_autocorrelation_block, source, n_steps, first, last, position_source, shear_rate) for first, last in blocks]
+                vacf_sum = sum(future.result() for future in futures)
+        finally:
+            for block in (shared_block, shared_positions):
+                if block is not None:
+                    block.close()
+                    block.unlink()
+
+    return vacf_sum / N
+
+
+def running_integral(time: Array, values: Array) -> Array:
+    """
+    A helper function to get the running integral of values over time with the trapezoidal rule (e.g. the Green-Kubo integrals)
+    """
+    return np.concatenate(([0.0], np.cumsum(0.5 * (values[1:] + values[:-1]) * np.diff(time))))
+
+
+def _log_binned_correlation(time: Array, data: Array, num_bins: int) -> tuple[Array, Array]:
+    """
+    The log binned values of correlation functions, with the zero lag time kept as the first row (it is not in the log bins)
+    """
+    binned_time, binned_data, counts, _ = log_bin_reduce(time, data, num_bins=num_bins)
+    filled = counts > 0
+
+    return np.concatenate(([0.0], binned_time[filled])), np.concatenate((data[:1], binned_data[filled]))
+
+
+def calculate_stress_autocorrelation(stresslet: Array,
+                                     input_params: tuple,
+                                     fileout: str,
+                                     components: list[str] = ("xy",),
+                                     N_bins: int = 80,
+                                     chunk_size: int = 1000,
+                                     output_format: str = "text",
+                                     cache_dir: str | None = None,
+                                     directory: str = ".") -> tuple[Array, Array, Array]:
+    """
+    Function to calculate the relaxation modulus G(t) from the shear stress autocorrelation and the Green-Kubo viscosity, its running integral. Both are log binned and written in an output file
+
+    Parameters
+    -----------
+    stresslet: (Array)
+        The stresslet, can be memory-mapped; has dimensions (n_steps, N, 5)
+    input_params: (tuple)
+        The simulation parameters
+    fileout: (str)
+        The name of the parent directory (for naming the output file)
+    components: (list)
+        The off-diagonal stress components ("xy", "xz", "yz") whose autocorrelations are averaged
+    N_bins: (int)
+        The number of logarithmic bins
+    chunk_size: (int)
+        The number of frames read at once
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    cache_dir: (str)
+        The directory where the particle averaged stresslet and G(t) are cached for later runs. If None, nothing is cached
+    directory: (str)
+        The simulation directory, where the output file is written
+
+    Returns
+    -----------
+    time/tb: (Array)
+        The binned lag times normalized by the brownian time
+    modulus: (Array)
+        The binned G(t), normalized by kT/a^3
+    viscosity: (Array)
+        The binned Green-Kubo viscosity integral up to every lag time, normalized by kT tb/a^3
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    key = cache_key(input_fingerprint(stresslet, "stresslet", directory), output_metadata(input_params), list(components)) if cache_dir is not None else None
+    modulus = cached_array(cache_dir, "stress_acf", key, lambda: stress_autocorrelation(stresslet, input_params, components, chunk_size, cache_dir, directory))
+
+    viscosity = running_integral(time / tb, modulus)
+
+    binned_time, binned = _log_binned_correlation(time, np.stack((modulus, viscosity), axis=1), N_bins)
+
+    write_output("Stressautocorrelation"+fileout, r"t/t\-(B)    G(t)    \g(h)(t)",
+                 {"time": binned_time / tb, "modulus": binned[:, 0], "viscosity": binned[:, 1]},
+                 input_params, output_format, comments=[f"Shear stress components: {', '.join(components)}", "G(t) normalized by kT/a^3, eta(t) by kT t_B/a^3"], directory=directory)
+
+    return binned_time / tb, binned[:, 0], binned[:, 1]
+
+
+def calculate_velocity_autocorrelation(velocities: Array,
+                                       trajectory: Array,
+                                       input_params: tuple,
+                                       fileout: str,
+                                       non_affine: bool = False,
+                                       N_bins: int = 80,
+                                       block_size: int = 1000,
+                                       n_workers: int = 1,
+                                       output_format: str = "text",
+                                       cache_dir: str | None = None,
+                                       directory: str = ".") -> tuple[Array, Array, Array]:
+    """
+    Function to calculate the velocity autocorrelation function and the Green-Kubo diffusion coefficient, its running integral. Both are log binned and written in an output file
+
+    Parameters
+    -----------
+    velocities: (Array)
+        The velocities, can be memory-mapped; has dimensions (n_steps, N, 3)
+    trajectory: (Array)
+        The trajectory (only needed for the non-affine velocities)
+    input_params: (tuple)
+        The simulation parameters
+    fileout: (str)
+        The name of the parent directory (for naming the output file)
+    non_affine: (bool)
+        Flag whether the affine flow velocity (shear_rate * y along x) is subtracted from the velocities
+    N_bins: (int)
+        The number of logarithmic bins
+    block_size: (int)
+        The maximum number of particles processed at once
+    n_workers: (int)
+        The number of worker processes sharing the particle blocks
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    cache_dir: (str)
+        The directory where the velocity autocorrelation is cached for later runs. If None, nothing is cached
+    directory: (str)
+        The simulation directory, where the output file is written
+
+    Returns
+    -----------
+    time/tb: (Array)
+        The binned lag times normalized by the brownian time
+    vacf: (Array)
+        The binned velocity autocorrelation, normalized by (a/tb)^2
+    diffusion: (Array)
+        The binned Green-Kubo diffusion coefficient, (1/3) of the integral of the velocity autocorrelation over t/tb up to every lag time, normalized by a^2/tb
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    key = cache_key(input_fingerprint(velocities, "velocities", directory), output_metadata(input_params), non_affine) if cache_dir is not None else None
+    vacf = cached_array(cache_dir, "vacf", key,
+                        lambda: velocity_autocorrelation(velocities, trajectory if non_affine else None, shear_rate, block_size, n_workers))
+
+    # Both Green-Kubo integrals run over t/tb (see calculate_stress_autocorrelation), so the velocities are normalized by a/tb
+    vacf = vacf * tb**2
+    diffusion = running_integral(time / tb, vacf) / 3.0
+
+    binned_time, binned = _log_binned_correlation(time, np.stack((vacf, diffusion), axis=1), N_bins)
+
+    fileoutadd = "nonaffine" if non_affine else ""
+    write_output("VACF"+fileoutadd+fileout, r"t/t\-(B)    <v(t)v(0)>    D(t)",
+                 {"time": binned_time / tb, "vacf": binned[:, 0], "diffusion": binned[:, 1]},
+                 input_params, output_format, comments=["<v(t)v(0)> normalized by (a/t_B)^2, D(t) by a^2/t_B"], directory=directory)
+
+    return binned_time / tb, binned[:, 0], binned[:, 1]
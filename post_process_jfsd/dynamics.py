@@ -0,0 +1,250 @@
+import numpy as np
+from numpy import ndarray as Array
+from concurrent.futures import ProcessPoolExecutor
+
+from post_process_jfsd.utils import frame_chunks, share_array, open_source, compute_dtype
+from post_process_jfsd.msd import cached_unwrapped_trajectory, log_lags
+from post_process_jfsd.output import write_output
+
+
+def self_dynamics_block(source: str | tuple | Array,
+                        first_particle: int,
+                        last_particle: int,
+                        lags: Array,
+                        origins: Array,
+                        q_values: Array,
+                        r_bins: Array,
+                        dtype: type = np.float64) -> tuple[Array, Array, Array, Array]:
+    """
+    Function to accumulate the self displacement statistics of a block of particles. Every displacement is computed once and feeds all the observables: its second and fourth moments, the self-intermediate scattering function and the van Hove histogram
+
+    Parameters
+    -----------
+    source: (str | tuple | Array)
+        The unwrapped trajectory, or its file name / shared memory block (see utils.share_array)
+    first_particle: (int)
+        The index of the first particle of the block
+    last_particle: (int)
+        The index after the last particle of the block
+    lags: (Array)
+        The lag times (in frames)
+    origins: (Array)
+        The time origins (in frames); for every lag only the origins with origin + lag inside the trajectory are used
+    q_values: (Array)
+        The wave numbers of the self-intermediate scattering function
+    r_bins: (Array)
+        The edges of the displacement bins of the van Hove histogram, starting at 0
+    dtype: (type)
+        The floating point type of the positions and displacements. The sums are accumulated in double precision
+
+    Returns
+    -----------
+    r2_sum: (Array)
+        The sum of the squared displacements for every lag
+    r4_sum: (Array)
+        The sum of the fourth power of the displacements for every lag
+    fs_sum: (Array)
+        The sum of sin(q r) / (q r) for every lag and wave number; has dimensions (len(lags), len(q_values))
+    histogram: (Array)
+        The number of displacements in every bin for every lag (longer displacements are not counted); has dimensions (len(lags), len(r_bins) - 1)
+    """
+    unwrapped_trajectory = open_source(source)
+    n_steps = unwrapped_trajectory.shape[0]
+
+    # Only the frames at the origins and at the origins + lags are read, once
+    frames = np.unique(np.concatenate([origins] + [origins[origins + lag < n_steps] + lag for lag in lags]))
+    positions = np.asarray(unwrapped_trajectory[frames, first_particle:last_particle], dtype=dtype)
+    q_values = np.asarray(q_values, dtype=dtype)
+    origin_index = np.searchsorted(frames, origins)
+
+    n_r_bins = len(r_bins) - 1
+    dr = r_bins[-1] / n_r_bins
+
+    r2_sum, r4_sum = np.zeros(len(lags)), np.zeros(len(lags))
+    fs_sum = np.zeros((len(lags), len(q_values)))
+    histogram = np.zeros((len(lags), n_r_bins))
+
+    for i, lag in enumerate(lags):
+        valid = origins + lag < n_steps
+        displacements = positions[np.searchsorted(frames, origins[valid] + lag)] - positions[origin_index[valid]]
+        r2 = np.sum(displacements**2, axis=2).ravel()
+        r = np.sqrt(r2)
+
+        r2_sum[i] = np.sum(r2, dtype=np.float64)
+        r4_sum[i] = np.sum(r2**2, dtype=np.float64)
+        # Isotropic average of exp(i q.r) over the directions of q (np.sinc(x) = sin(pi x) / (pi x))
+        fs_sum[i] = np.sinc(np.multiply.outer(r, q_values) / np.pi).sum(axis=0, dtype=np.float64)
+        histogram[i] = np.bincount(np.minimum((r / dr).astype(np.intp), n_r_bins), minlength=n_r_bins + 1)[:n_r_bins]
+
+    return r2_sum, r4_sum, fs_sum, histogram
+
+
+def self_dynamics(unwrapped_trajectory: Array,
+                  lags: Array,
+                  origins: Array,
+                  q_values: Array,
+                  r_bins: Array,
+                  block_size: int = 1000,
+                  n_workers: int = 1,
+                  dtype: type = np.float64) -> tuple[Array, Array, Array, Array]:
+    """
+    Function to calculate the self dynamics of an unwrapped trajectory in a single pass over the displacements: the msd, the non-Gaussian parameter, the self-intermediate scattering function F_s(q,t) and the self part of the van Hove function G_s(r,t). The particles are processed in independent blocks, which can be shared by a pool of worker processes
+
+    Parameters
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory, can be memory-mapped
+    lags: (Array)
+        The lag times (in frames)
+    origins: (Array)
+        The time origins (in frames)
+    q_values: (Array)
+        The wave numbers of F_s(q,t)
+    r_bins: (Array)
+        The edges of the displacement bins of G_s(r,t), starting at 0
+    block_size: (int)
+        The number of particles processed at once by every worker
+    n_workers: (int)
+        The number of worker processes
+    dtype: (type)
+        The floating point type of the displacements
+
+    Returns
+    -----------
+    msd: (Array)
+        The msd of every lag
+    alpha2: (Array)
+        The non-Gaussian parameter 3 <r^4> / (5 <r^2>^2) - 1 of every lag
+    fs: (Array)
+        F_s(q,t); has dimensions (len(lags), len(q_values))
+    gs: (Array)
+        G_s(r,t), normalized so that its integral over the whole space is 1 (the displacements beyond the last bin are missing from the integral); has dimensions (len(lags), len(r_bins) - 1)
+    """
+    (n_steps, N, _) = unwrapped_trajectory.shape
+    lags, origins, q_values = np.asarray(lags), np.asarray(origins), np.asarray(q_values, dtype=np.float64)
+    blocks = [(block.start, block.stop) for block in frame_chunks(N, block_size)]
+    n_workers = min(max(int(n_workers), 1), len(blocks))
+
+    if n_workers == 1:
+        partials = [self_dynamics_block(unwrapped_trajectory, first, last, lags, origins, q_values, r_bins, dtype) for first, last in blocks]
+    else:
+        # The workers read their blocks from the memory-mapped file or a shared memory copy of the trajectory
+        source, shared_block = share_array(unwrapped_trajectory)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(self_dynamics_block, source, first, last, lags, origins, q_values, r_bins, dtype) for first, last in blocks]
+                partials = [future.result() for future in futures]
+        finally:
+            if shared_block is not None:
+                shared_block.close()
+                shared_block.unlink()
+
+    r2_sum, r4_sum, fs_sum, histogram = [sum(partial) for partial in zip(*partials)]
+
+    # Number of displacements of every lag
+    n_samples = N * np.sum(origins[np.newaxis, :] + lags[:, np.newaxis] < n_steps, axis=1)
+
+    msd = r2_sum / n_samples
+    alpha2 = 3.0 * (r4_sum / n_samples) / (5.0 * msd**2) - 1.0
+    fs = fs_sum / n_samples[:, np.newaxis]
+    shell_volumes = 4.0 / 3.0 * np.pi * (r_bins[1:]**3 - r_bins[:-1]**3)
+    gs = histogram / (n_samples[:, np.newaxis] * shell_volumes)
+
+    return msd, alpha2, fs, gs
+
+
+def calculate_self_dynamics(trajectory: Array,
+                            input_params: tuple,
+                            fileout: str,
+                            q_values: list,
+                            r_max: float = 5.0,
+                            N_vanhove_bins: int = 100,
+                            N_lags: int = 40,
+                            n_origins: int = 64,
+                            non_affine: bool = False,
+                            block_size: int = 1000,
+                            n_workers: int = 1,
+                            output_format: str = "text",
+                            cache_dir: str | None = None,
+                            directory: str = ".",
+                            precision: str = "float64") -> tuple[Array, Array, Array, Array]:
+    """
+    Function to calculate the self-intermediate scattering function F_s(q,t), the self van Hove function G_s(r,t) and the non-Gaussian parameter alpha_2(t) at logarithmically spaced lag times, from the unwrapped trajectory of the msd. They are written in three output files
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The input trajectory
+    input_params: (tuple)
+        The simulation parameters
+    fileout: (str)
+        The name of the parent directory (for naming the output files)
+    q_values: (list)
+        The wave numbers of F_s(q,t) (normalized by the particle radius)
+    r_max: (float)
+        The largest displacement of the G_s(r,t) histogram
+    N_vanhove_bins: (int)
+        The number of displacement bins of G_s(r,t)
+    N_lags: (int)
+        The number of logarithmic lag times (fewer if they coincide at short times)
+    n_origins: (int)
+        The maximum number of evenly spaced time origins
+    non_affine: (bool)
+        Flag whether the displacements of the affine shear flow are subtracted
+    block_size: (int)
+        The number of particles processed at once by every worker
+    n_workers: (int)
+        The number of worker processes sharing the particle blocks
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    cache_dir: (str)
+        The directory of the cached unwrapped trajectory (shared with the msd). If None, the trajectory is unwrapped in memory
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision of the unwrapped trajectory and of the displacements ("float64" or "float32")
+
+    Returns
+    -----------
+    time/tb: (Array)
+        The lag times normalized by the brownian time
+    fs: (Array)
+        F_s(q,t); has dimensions (n_lags, len(q_values))
+    gs: (Array)
+        G_s(r,t); has dimensions (n_lags, N_vanhove_bins)
+    alpha2: (Array)
+        The non-Gaussian parameter
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    if n_steps < 2:
+        raise ValueError("The self dynamics need at least two frames")
+
+    unwrapped_trajectory = cached_unwrapped_trajectory(trajectory, input_params, non_affine=non_affine, cache_dir=cache_dir, precision=precision, directory=directory)
+
+    lags = log_lags(n_steps, N_lags)
+    origins = np.unique(np.rint(np.linspace(0, n_steps - 2, max(int(n_origins), 1))).astype(int))
+    r_bins = np.linspace(0.0, r_max, N_vanhove_bins + 1)
+    q_values = np.asarray(q_values, dtype=np.float64)
+
+    msd, alpha2, fs, gs = self_dynamics(unwrapped_trajectory, lags, origins, q_values, r_bins, block_size, n_workers, compute_dtype(precision))
+
+    lag_time = time[lags] / tb
+    fileoutadd = "nonaffine" if non_affine else ""
+    comments = [f"{len(origins)} time origins"]
+
+    write_output("Fsqt"+fileoutadd+fileout, r"t/t\-(B)   " + "   ".join(rf"F\-(s)(q={q:g},t)" for q in q_values),
+                 dict({"time": lag_time}, **{f"fs_q{q:g}": fs[:, j] for j, q in enumerate(q_values)}),
+                 input_params, output_format, comments=comments, directory=directory)
+
+    write_output("Alpha2"+fileoutadd+fileout, r"t/t\-(B)   MSD   \g(a)\-(2)",
+                 {"time": lag_time, "msd": msd, "alpha2": alpha2},
+                 input_params, output_format, comments=comments, directory=directory)
+
+    r_values = (r_bins[:-1] + r_bins[1:]) / 2.0
+    lag_grid, r_grid = np.meshgrid(lag_time, r_values, indexing='ij')
+    write_output("VanHove"+fileoutadd+fileout, r"t/t\-(B)   r/R   G\-(s)(r,t)",
+                 {"time": lag_grid.ravel(), "r": r_grid.ravel(), "gs": gs.ravel()},
+                 input_params, output_format, comments=comments, directory=directory)
+
+    return lag_time, fs, gs, alpha2
@@ -1,10 +1,65 @@
 import numpy as np
 from numpy import ndarray as Array
-import freud
+from concurrent.futures import ProcessPoolExecutor
 
-def gofr(trajectory: Array, frame: int, last_frame_index: int, input_params: tuple, N_gofr_bins: int, r_max: float, fileout: str) -> tuple[Array, Array]:
+from post_process_jfsd.utils import frame_selection, array_source, open_source
+from post_process_jfsd.output import write_output
+
+
+def rdf_for_frames(source: str | Array, frames: Array, box_length: float, N_gofr_bins: int, r_max: float) -> tuple[Array, Array, int]:
+    """
+    Function to accumulate the radial distribution function over a set of frames
+
+    Parameters
+    ------------
+    source: (str | Array)
+        The trajectory, or the file name of the memory-mapped trajectory
+    frames: (Array)
+        The frames to be accumulated
+    box_length: (float)
+        The length of the cubic box
+    N_gofr_bins: (int)
+        Number of g(r) bins
+    r_max: (float)
+        Maximum r for g(r) calculation
+
+    Returns
+    ------------
+    r_values: (Array)
+        The centers of the radial bins
+    gofr: (Array)
+        The g(r) averaged over the frames
+    n_frames: (int)
+        The number of accumulated frames
+    """
+    import freud
+
+    trajectory = open_source(source)
+
+    # Initialize the calculator and make the freud box
+    gofr_calculator = freud.density.RDF(bins = N_gofr_bins, r_max = r_max)
+    box = freud.box.Box.cube(box_length)
+
+    for frame in frames:
+        gofr_calculator.compute(system = (box, np.asarray(trajectory[frame])), reset = False)
+
+    return gofr_calculator.bin_centers, gofr_calculator.rdf, len(frames)
+
+
+def gofr(trajectory: Array, 
+         frame: int, 
+         last_frame_index: int, 
+         input_params: tuple, 
+         N_gofr_bins: int, 
+         r_max: float, 
+         fileout: str,
+         frame_range: list | None = None,
+         stride: int = 1,
+         n_workers: int = 1,
+         output_format: str = "text",
+         directory: str = ".") -> tuple[Array, Array]:
     """
-    A function to calculate the radial distribution function for a given trajectory
+    A function to calculate the radial distribution function for a given trajectory, either for one frame or averaged over a range of frames
 
     Parameters
     ------------
@@ -12,7 +67,7 @@ def gofr(trajectory: Array, frame: int, last_frame_index: int, input_params: tup
     trajectory: (Array)
         The input array
     frame: (int)
-        Frame for which g(r) will be calculated
+        Frame for which g(r) will be calculated (if no frame range is given)
     last_frame_index: (int)
         The last non zero frame of the simulation
     input_params: (tuple)
@@ -23,6 +78,16 @@ def gofr(trajectory: Array, frame: int, last_frame_index: int, input_params: tup
         Maximum r for g(r) calculation
     fileout: (str)
         The name of the parent directory
+    frame_range: (list)
+        The [start, stop] frames over which g(r) is averaged. If None or empty, only the given frame is used
+    stride: (int)
+        The step between the averaged frames
+    n_workers: (int)
+        The number of worker processes sharing the frames
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
 
     Returns
     ------------
@@ -32,30 +97,40 @@ def gofr(trajectory: Array, frame: int, last_frame_index: int, input_params: tup
     gofr: (Array)
         The calculated radial pdf
     """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
-    # Testing if input frame is out of range
-    if frame > last_frame_index:
-        raise ValueError(f"Selected frame is out of range. Last frame has index {last_frame_index}. Exiting...")
+    if frame_range:
+        frames = frame_selection(last_frame_index + 1, frame_range, stride)
+    else:
+        # Testing if input frame is out of range
+        if frame > last_frame_index:
+            raise ValueError(f"Selected frame is out of range. Last frame has index {last_frame_index}. Exiting...")
+        frames = np.arange(last_frame_index + 1)[[frame]]
 
-    positions = trajectory[frame]
-    
-    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    n_workers = min(max(int(n_workers), 1), len(frames))
 
-    # Initialize the calculator, set the r_values and make the freud box
-    gofr_calculator = freud.density.RDF(bins = N_gofr_bins, r_max = r_max)
-    r_values = np.linspace(0, r_max, N_gofr_bins)
-    box = freud.box.Box.cube(box_length)
+    if n_workers == 1:
+        r_values, gofr, n_frames = rdf_for_frames(trajectory, frames, box_length, N_gofr_bins, r_max)
+    else:
+        # Every worker accumulates its own histogram over a contiguous part of the frames
+        frame_sets = np.array_split(frames, n_workers)
+        source = array_source(trajectory)
+        if isinstance(source, str):
+            jobs = [(source, frame_set) for frame_set in frame_sets]
+        else:
+            jobs = [(trajectory[frame_set], np.arange(len(frame_set))) for frame_set in frame_sets]
 
-    gofr_calculator.compute(system = (box,positions))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(rdf_for_frames, job_source, job_frames, box_length, N_gofr_bins, r_max) for job_source, job_frames in jobs]
+            partials = [future.result() for future in futures]
 
-    gofr = gofr_calculator.rdf
+        # The normalization is the same for every frame, so the partial g(r) are merged by their number of frames
+        r_values = partials[0][0]
+        n_frames = sum(partial[2] for partial in partials)
+        gofr = sum(partial[1] * partial[2] for partial in partials) / n_frames
 
     # Write the output in a file
-    file = open("gofr"+fileout+".dat","w+")
-    file.write("r/R   g(r)\n")
-    for i in range(len(r_values)):
-        file.write(str(r_values[i])+"   "+str(gofr[i])+"\n")
-    file.close
+    write_output("gofr"+fileout, "r/R   g(r)", {"r": r_values, "gofr": gofr}, input_params, output_format,
+                 comments=[f"Averaged over {n_frames} frames ({frames[0]} to {frames[-1]}, stride {stride if frame_range else 1})", "r at the bin centers"], directory=directory)
 
     return r_values, gofr
-    
\ No newline at end of file
@@ -1,48 +1,171 @@
 import numpy as np
 from numpy import ndarray as Array
-from matplotlib import pyplot as plt
-import cmcrameri.cm as cmc
+import os
+import warnings
 
+from post_process_jfsd.utils import frame_selection, compute_dtype
+from post_process_jfsd.output import write_output
 
-def gofxy_for_frame(trajectory: Array, 
+
+def pair_vectors(positions: Array, box: "freud.box.Box", r_max: float) -> tuple[Array, Array]:
+    """
+    Function to find all the pairs of particles closer than r_max with a periodic neighbour query, and their distance vectors
+
+    Parameters
+    -----------
+    positions: (Array)
+        The positions of the particles in the frame
+    box: (freud.box.Box)
+        The periodic simulation box
+    r_max: (float)
+        The largest pair distance
+
+    Returns
+    -----------
+    i: (Array)
+        The index of the first particle of every pair (every pair appears twice, once for each particle)
+    distance_vectors: (Array)
+        The distance vectors of the pairs with the minimum image convention; has dimensions (n_pairs, 3)
+    """
+    import freud
+
+    nlist = freud.locality.AABBQuery(box, positions).query(positions, dict(r_max=r_max, exclude_ii=True)).toNeighborList()
+    i, j = nlist.query_point_indices, nlist.point_indices
+
+    # Interparticle distances with the minimum image convention
+    distance_vectors = positions[i] - positions[j]
+    distance_vectors -= box.Lx * np.round(distance_vectors / box.Lx)
+
+    return i, distance_vectors
+
+
+def gofxy_from_pairs(i: Array, distance_vectors: Array, n_particles: int, x_bins: Array, y_bins: Array, slice_width: float) -> tuple[Array, int]:
+    """
+    Function to bin the pairs of a frame (see pair_vectors) on the xy image. The pairs have to include all pairs within the image corners
+
+    Parameters
+    -----------
+    i: (Array)
+        The index of the first particle of every pair
+    distance_vectors: (Array)
+        The distance vectors of the pairs
+    n_particles: (int)
+        The number of particles in the frame
+    x_bins: (Array)
+        The edges of the x bins
+    y_bins: (Array)
+        The edges of the y bins
+    slice_width: (float)
+        The width of the z-axis slice for which the xy average is calculated
+
+    Returns
+    -----------
+    gofxy_sum: (Array)
+        The sum of the normalized gofxy of every particle; has dimensions (len(x_bins) - 1, len(y_bins) - 1)
+    n_particles: (int)
+        The number of particles with neighbours within the image
+    """
+    Xmax, Ymax = x_bins[-1], y_bins[-1]
+    n_x, n_y = len(x_bins) - 1, len(y_bins) - 1
+    dx, dy = (x_bins[-1] - x_bins[0]) / n_x, (y_bins[-1] - y_bins[0]) / n_y
+
+    # Bin indices of every pair (the upper edges are included in the last bins)
+    x_index = np.minimum(np.floor((distance_vectors[:, 0] - x_bins[0]) / dx).astype(int), n_x - 1)
+    y_index = np.minimum(np.floor((distance_vectors[:, 1] - y_bins[0]) / dy).astype(int), n_y - 1)
+
+    # Select only the pairs within the slice and the image
+    in_image = (np.abs(distance_vectors[:, 2]) < slice_width) & (np.abs(distance_vectors[:, 0]) <= Xmax) & (np.abs(distance_vectors[:, 1]) <= Ymax)
+    i, x_index, y_index = i[in_image], x_index[in_image], y_index[in_image]
+
+    # Every particle image is normalized to a probability density, as in a per-particle histogram
+    pairs_per_particle = np.bincount(i, minlength=n_particles)
+    weights = 1.0 / (pairs_per_particle[i] * dx * dy)
+
+    gofxy_sum = np.bincount(x_index * n_y + y_index, weights=weights, minlength=n_x * n_y).reshape(n_x, n_y)
+    
+    return gofxy_sum, np.count_nonzero(pairs_per_particle)
+
+
+def gofxy_for_frame(positions: Array,
+                    box: "freud.box.Box",
                     x_bins: Array, 
                     y_bins: Array, 
-                    Xmax: float, Ymax: float, 
-                    N: int, 
-                    slice_width: float, 
-                    frame: int) -> Array:
+                    slice_width: float) -> tuple[Array, int]:
     """
-    Function to calculate the gofxy for a specific frame
+    Function to calculate the gofxy for a specific frame. The pairs are found with a periodic neighbour query and binned all at once
 
     Parameters
     -----------
-    
-    frame: (int)
-           Frame indice to be calculated
+    positions: (Array)
+        The positions of the particles in the frame
+    box: (freud.box.Box)
+        The periodic simulation box
+    x_bins: (Array)
+        The edges of the x bins
+    y_bins: (Array)
+        The edges of the y bins
+    slice_width: (float)
+        The width of the z-axis slice for which the xy average is calculated
 
     Returns
     -----------
-    gofxy: (ndarray)
+    gofxy_sum: (Array)
+        The sum of the normalized gofxy of every particle; has dimensions (len(x_bins) - 1, len(y_bins) - 1)
+    n_particles: (int)
+        The number of particles with neighbours within the image
     """
-    positions = trajectory[frame]
+    # All the pairs within the image corners (excluding the self contribution), up to just below half of the box (the reach of the periodic query)
+    r_max = min(np.sqrt(x_bins[-1]**2 + y_bins[-1]**2 + slice_width**2), 0.5 * box.Lx * (1.0 - 1e-6))
+    i, distance_vectors = pair_vectors(positions, box, r_max)
 
-    # Calculate interparticle distances
-    distance_vectors = np.zeros((N, N, 3))
-    distance_vectors = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]  # shape: (N, N, 3)
+    return gofxy_from_pairs(i, distance_vectors, len(positions), x_bins, y_bins, slice_width)
 
-    # Select only the particles within the slice and remove the self contribution
-    indices = np.where(np.abs(distance_vectors[:,:,2]) < slice_width, 1, 0)
-    indices += -1 * np.eye(N, dtype=int)
 
-    # Setting all the x and y distances outside the slice to a number bigger than the binning box
-    x_distances = np.where(indices, distance_vectors[:,:,0], Xmax + 10)
-    y_distances = np.where(indices, distance_vectors[:,:,1], Ymax + 10)
+def gofxy_for_frames(trajectory: Array,
+                     frames: Array,
+                     box_length: float,
+                     x_bins: Array,
+                     y_bins: Array,
+                     slice_width: float,
+                     dtype: type = np.float64) -> Array:
+    """
+    Function to calculate the gofxy averaged over a set of frames
 
-    # g of xy for every particle and average the images
-    gofxy_set = np.array([np.histogram2d(x_distances[i], y_distances[i], bins = (x_bins, y_bins), density=True)[0] for i in range(N)])
-    gofxy = gofxy_set.mean(axis=0)
-    
-    return gofxy
+    Parameters
+    -----------
+    trajectory: (Array)
+        The input trajectory (can be memory-mapped)
+    frames: (Array)
+        The frames over which the gofxy is averaged
+    box_length: (float)
+        The length of the cubic box
+    x_bins: (Array)
+        The edges of the x bins
+    y_bins: (Array)
+        The edges of the y bins
+    slice_width: (float)
+        The width of the z-axis slice for which the xy average is calculated
+    dtype: (type)
+        The floating point type of the positions and distance vectors
+
+    Returns
+    -----------
+    gofxy: (Array)
+        The averaged gofxy; has dimensions (len(x_bins) - 1, len(y_bins) - 1)
+    """
+    import freud
+
+    box = freud.box.Box.cube(box_length)
+
+    gofxy = np.zeros((len(x_bins) - 1, len(y_bins) - 1))
+    n_particles = 0
+
+    for frame in frames:
+        gofxy_frame, n_particles_frame = gofxy_for_frame(np.asarray(trajectory[frame], dtype=dtype), box, x_bins, y_bins, slice_width)
+        gofxy += gofxy_frame
+        n_particles += n_particles_frame
+
+    return gofxy / max(n_particles, 1)
 
 
 def gofxy_image(
@@ -55,10 +178,16 @@ def gofxy_image(
     slice_width: float,
     N_gofxy_bins: int,
     Xmax: float,
-    Ymax: float)  -> Array :
+    Ymax: float,
+    frame_range: list | None = None,
+    stride: int = 1,
+    rest_frame_range: list | None = None,
+    output_format: str = "text",
+    directory: str = ".",
+    precision: str = "float64")  -> Array :
 
     """
-    Create the image of the xy projection of the g(r) for a specific time frame. There is the option to subtract from it the g(r) at rest (of the first frame)
+    Create the image of the xy projection of the g(r) for a specific time frame, or averaged over a range of frames. There is the option to subtract from it the g(r) at rest (of the first frames)
 
     Parameters
     -----------
@@ -69,7 +198,7 @@ def gofxy_image(
     last_frame_index: (int)
         The index of the last non-zero frame of the trajectory (in case of premature ending)
     frame: (int)
-        Frame for which g(r) is calculated
+        Frame for which g(r) is calculated (if no frame range is given)
     subtract_rest: (bool)
         Choose whether to subtract the zeroth frame
     fileout: (str)
@@ -82,21 +211,50 @@ def gofxy_image(
         The maximum x value of the image (total image ranges [-Xmax, Xmax])
     Ymax: (float)
         The maximum y value of the image (total image ranges [-Ymax, Ymax])
+    frame_range: (list)
+        The [start, stop] frames over which the gofxy is averaged. If None or empty, only the given frame is used
+    stride: (int)
+        The step between the averaged frames
+    rest_frame_range: (list)
+        The [start, stop] frames over which the subtracted rest gofxy is averaged (with the same stride). If None or empty, only the zeroth frame is used
+    output_format: (str)
+        The format of the file with the gofxy values ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision of the distance vectors ("float64" or "float32")
 
     Returns
     -----------
     gofxy_to_be_plotted: (Array)
-        The gofxy values for the given frame; has dimensions (n_bins, n_bins)
+        The gofxy values for the given frames; has dimensions (n_bins, n_bins)
     """
-    # Testing if input frame is out of range
-    if frame > last_frame_index:
-        raise ValueError(f"Selected frame is out of range. Last frame has index {last_frame_index}. Exiting...")
+    # A figure without pyplot is drawn by the non-interactive Agg backend
+    from matplotlib.figure import Figure
+    import cmcrameri.cm as cmc
 
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    dtype = compute_dtype(precision)
+
+    # Select the frames
+    if frame_range:
+        frames = frame_selection(last_frame_index + 1, frame_range, stride)
+        frame_label = f"{frames[0]}-{frames[-1]}"
+    else:
+        # Testing if input frame is out of range
+        if frame > last_frame_index:
+            raise ValueError(f"Selected frame is out of range. Last frame has index {last_frame_index}. Exiting...")
+        frames = [frame]
+        frame_label = str(frame)
 
     # Testing if Xmax and Ymax are bigger than box size
     if (Xmax > box_length / 2.) or (Ymax > box_length / 2.) :
-        raise ValueError(f"Xmax and Ymax cannot be larger than half of the box size. Try values larger than {box_length*0.5}")
+        raise ValueError(f"Xmax and Ymax cannot be larger than half of the box size. Try values smaller than {box_length*0.5}")
+
+    # Testing if the corners of the image are reachable by the periodic neighbour query, which stops at half of the box size
+    if np.sqrt(Xmax**2 + Ymax**2 + slice_width**2) >= box_length / 2.:
+        warnings.warn(f"The image corners (sqrt(Xmax^2 + Ymax^2 + slice_width^2)) are further than half of the box size ({box_length*0.5}). "
+                      "The pairs beyond it are not counted, so the corners of the image are incomplete. Use smaller Xmax and Ymax for a complete image", RuntimeWarning)
 
     # Create bins
     x_bins = np.linspace(-Xmax, Xmax, N_gofxy_bins)
@@ -108,19 +266,32 @@ def gofxy_image(
 
     # Plot results
     X, Y = np.meshgrid(xedges, yedges)
+    fig = Figure()
+    ax = fig.subplots()
+
+    gofxy_to_be_plotted = gofxy_for_frames(trajectory, frames, box_length, x_bins, y_bins, slice_width, dtype)
 
     if subtract_rest==True:
-        gofxy_to_be_plotted = gofxy_for_frame(trajectory, x_bins, y_bins, Xmax, Ymax, N, slice_width, frame) - gofxy_for_frame(trajectory, x_bins, y_bins, Xmax, Ymax, N, slice_width, frame = 0)
-        plt.pcolormesh(X, Y, gofxy_to_be_plotted, cmap=cmc.berlin)
+        if rest_frame_range:
+            rest_frames = frame_selection(last_frame_index + 1, rest_frame_range, stride)
+        else:
+            rest_frames = [0]
+        gofxy_to_be_plotted = gofxy_to_be_plotted - gofxy_for_frames(trajectory, rest_frames, box_length, x_bins, y_bins, slice_width, dtype)
+        mesh = ax.pcolormesh(X, Y, gofxy_to_be_plotted, cmap=cmc.berlin)
         title_add = "_zeroth_frame_subtracted"
     else:
-        gofxy_to_be_plotted = gofxy_for_frame(trajectory, x_bins, y_bins, Xmax, Ymax, N, slice_width, frame)
-        plt.pcolormesh(X, Y, gofxy_to_be_plotted)
+        mesh = ax.pcolormesh(X, Y, gofxy_to_be_plotted)
         title_add = ""
-    plt.colorbar()
-    plt.title(fileout+f" Frame = {frame} " + title_add)
+    fig.colorbar(mesh)
+    ax.set_title(fileout+f" Frame = {frame_label} " + title_add)
 
     # Save the image
-    plt.savefig("gofxy"+fileout+"frame"+str(frame)+title_add+".png")
+    fig.savefig(os.path.join(directory, "gofxy"+fileout+"frame"+frame_label+title_add+".png"))
+
+    # Save the values at the bin centers
+    x_centers, y_centers = np.meshgrid((x_bins[:-1] + x_bins[1:]) / 2.0, (y_bins[:-1] + y_bins[1:]) / 2.0, indexing='ij')
+    write_output("gofxy"+fileout+"frame"+frame_label+title_add, "x   y   g(x,y)",
+                 {"x": x_centers.ravel(), "y": y_centers.ravel(), "gofxy": gofxy_to_be_plotted.ravel()},
+                 input_params, output_format, directory=directory)
 
-    return gofxy_to_be_plotted
\ No newline at end of file
+    return gofxy_to_be_plotted
@@ -0,0 +1,278 @@
+import numpy as np
+from numpy import ndarray as Array
+import os
+
+from post_process_jfsd.utils import frame_chunks, merge_bin_deviations
+from post_process_jfsd.output import write_output, output_metadata
+from post_process_jfsd.cache import cache_key
+from post_process_jfsd.av_stress import write_average_stress
+from post_process_jfsd.msd import unwrap_frames, write_msd
+from post_process_jfsd.gofr import rdf_for_frames
+from post_process_jfsd.velocity_profile import velocity_bin_sums, write_velocity_profile
+
+
+# Name of the file with the accumulators of the incremental mode, inside the simulation directory
+STATE_FILE = "post_process_state.npz"
+
+
+def _first_frame(frame_range: list | None) -> int:
+    """
+    The first accumulated frame of a frame range (the stop of the range is ignored, as the trajectory keeps growing)
+    """
+    first = int(frame_range[0]) if frame_range else 0
+    if first < 0:
+        raise ValueError(f"The incremental mode needs a non-negative first frame, got {frame_range}")
+
+    return first
+
+
+def _new_frames(first: int, stride: int, n_done: int, n_frames: int) -> Array:
+    """
+    The frames first, first + stride, ... that were written after the first n_done frames
+    """
+    if n_done <= first:
+        start = first
+    else:
+        start = first + -(-(n_done - first) // stride) * stride
+
+    return np.arange(start, n_frames, stride)
+
+
+def load_state(directory: str, key: str, trajectory: Array) -> dict | None:
+    """
+    A function to load the accumulators of the previous invocation, if they are still valid for the trajectory
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory
+    key: (str)
+        The key of the simulation parameters and the settings of the accumulators
+    trajectory: (Array)
+        The trajectory, without the unwritten frames
+
+    Returns
+    ----------
+    state: (dict)
+        The accumulators by name, or None if there is no valid state
+    """
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+
+    n_done = int(state["n_frames"])
+    if str(state["key"]) != key:
+        print("The settings or simulation parameters changed. Processing all frames")
+        return None
+    # A new simulation in the same directory changes the first frame, and a restarted one the last processed frame
+    if n_done > trajectory.shape[0] or not (np.array_equal(state.get("first_frame"), trajectory[0]) and np.array_equal(state["last_frame"], trajectory[n_done - 1])):
+        print("The trajectory was rewritten. Processing all frames")
+        return None
+
+    return state
+
+
+def save_state(directory: str, state: dict):
+    """
+    A function to save the accumulators for the next invocation. The file is replaced at once, so an interrupted run keeps the previous state
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory
+    state: (dict)
+        The accumulators by name
+    """
+    path = os.path.join(directory, STATE_FILE)
+    temporary_path = path + f".{os.getpid()}.tmp.npz"
+
+    np.savez(temporary_path, **state)
+    os.replace(temporary_path, path)
+
+
+def update_incremental(trajectory: Array,
+                       stresslet: Array | None,
+                       velocities: Array | None,
+                       input_params: tuple,
+                       fileout: str,
+                       stress_flag: bool = False,
+                       raw_stress_flag: bool = False,
+                       N_stress_bins: int = 80,
+                       msd_flag: bool = False,
+                       non_affine: bool = False,
+                       N_msd_bins: int = 80,
+                       gofr_flag: bool = False,
+                       N_gofr_bins: int = 80,
+                       r_max: float = 5.0,
+                       gofr_frame_range: list | None = None,
+                       gofr_stride: int = 1,
+                       v_profile_flag: bool = False,
+                       v_profile_bins: int = 80,
+                       v_profile_frame_range: list | None = None,
+                       v_profile_stride: int = 1,
+                       chunk_size: int = 1000,
+                       output_format: str = "text",
+                       directory: str = ".") -> int:
+    """
+    A function to update the outputs of a still running simulation. Running sums of the analyses are kept in a state file, so only the frames written since the last invocation are read and processed
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The trajectory, without the unwritten frames (can be memory-mapped)
+    stresslet: (Array)
+        The stresslet, without the unwritten frames. Needed for the stress
+    velocities: (Array)
+        The velocities, without the unwritten frames. Needed for the velocity profile
+    input_params: (tuple)
+        The simulation parameters of the written frames
+    fileout: (str)
+        The name of the parent directory, for naming the output files
+    stress_flag: (bool)
+        Flag whether the binned average stress is updated
+    raw_stress_flag: (bool)
+        Flag whether the only-particle-averaged stress is written
+    N_stress_bins: (int)
+        The number of bins for the stress average
+    msd_flag: (bool)
+        Flag whether the msd is updated. Only the direct msd (first frame as time origin) can be updated incrementally
+    non_affine: (bool)
+        Flag whether the msd of the non-affine displacements is calculated
+    N_msd_bins: (int)
+        The number of logarithmic bins of the binned msd
+    gofr_flag: (bool)
+        Flag whether the g(r) is updated. It is averaged over all written frames after the first frame of the range
+    N_gofr_bins: (int)
+        Number of g(r) bins
+    r_max: (float)
+        Maximum r for g(r) calculation
+    gofr_frame_range: (list)
+        The [start, stop] frames of the g(r) average; only the start is used. If None or empty, all frames are used
+    gofr_stride: (int)
+        The step between the averaged frames of the g(r)
+    v_profile_flag: (bool)
+        Flag whether the velocity profile is updated
+    v_profile_bins: (int)
+        The number of the bins of the velocity profile
+    v_profile_frame_range: (list)
+        The [start, stop] frames of the velocity profile average; only the start is used. If None or empty, all frames are used
+    v_profile_stride: (int)
+        The step between the averaged frames of the velocity profile
+    chunk_size: (int)
+        The number of frames read at once
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the state and the output files are written
+
+    Returns
+    ----------
+    n_new_frames: (int)
+        The number of frames processed in this invocation
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    gofr_first = _first_frame(gofr_frame_range)
+    v_profile_first = _first_frame(v_profile_frame_range)
+
+    # Everything the accumulators depend on, except for the number of frames (and the kind of accumulated velocity deviations, so older states are recomputed)
+    metadata = output_metadata(input_params)
+    metadata.pop("n_steps")
+    key = cache_key(metadata,
+                    (stress_flag,),
+                    (msd_flag, non_affine),
+                    (gofr_flag, N_gofr_bins, r_max, gofr_first, gofr_stride),
+                    (v_profile_flag, v_profile_bins, v_profile_first, v_profile_stride, "squared_deviations"))
+
+    state = load_state(directory, key, trajectory)
+    if state is None:
+        state = dict(n_frames=np.array(0),
+                     av_stresslet=np.zeros((0, 5)),
+                     msd=np.zeros(0),
+                     origin=np.zeros((N, 3)),
+                     previous_frame=np.zeros((N, 3)),
+                     previous_unwrapped=np.zeros((N, 3)),
+                     gofr_sum=np.zeros(N_gofr_bins),
+                     gofr_r=np.zeros(N_gofr_bins),
+                     gofr_frames=np.array(0),
+                     v_counts=np.zeros(v_profile_bins - 1, dtype=np.int64),
+                     v_sums=np.zeros(v_profile_bins - 1),
+                     v_squared_deviations=np.zeros(v_profile_bins - 1))
+
+    n_done = int(state["n_frames"])
+    print(f"Frames already processed: {n_done}, new frames: {n_steps - n_done}")
+
+    if n_steps == n_done:
+        return 0
+    if n_steps < 2:
+        print("Not enough frames written yet")
+        return 0
+
+    if stress_flag:
+        av_stresslet = np.empty((n_steps - n_done, 5))
+        for chunk in frame_chunks(n_steps - n_done, chunk_size):
+            av_stresslet[chunk] = np.average(np.asarray(stresslet[n_done + chunk.start:n_done + chunk.stop]), 1)
+        state["av_stresslet"] = np.concatenate((state["av_stresslet"], av_stresslet))
+
+    if msd_flag:
+        if n_done == 0:
+            state["origin"] = np.asarray(trajectory[0], dtype=np.float64)
+            state["previous_frame"] = state["origin"]
+            state["previous_unwrapped"] = state["origin"]
+            msd = [np.zeros(1)]
+            first_new = 1
+        else:
+            msd = []
+            first_new = n_done
+
+        # Continue the unwrapping from the last processed frame
+        strain = shear_rate * time
+        for chunk in frame_chunks(n_steps - first_new, chunk_size):
+            frames = slice(first_new + chunk.start, first_new + chunk.stop)
+            positions = np.asarray(trajectory[frames], dtype=np.float64)
+            unwrapped = unwrap_frames(positions, state["previous_frame"], state["previous_unwrapped"], strain[frames], input_params, non_affine)
+            msd.append(np.mean(np.sum((unwrapped - state["origin"])**2, axis=2), axis=1))
+            state["previous_frame"] = positions[-1]
+            state["previous_unwrapped"] = unwrapped[-1]
+
+        state["msd"] = np.concatenate([state["msd"]] + msd)
+
+    if gofr_flag:
+        frames = _new_frames(gofr_first, gofr_stride, n_done, n_steps)
+        if len(frames) > 0:
+            r_values, gofr, n_frames = rdf_for_frames(trajectory, frames, box_length, N_gofr_bins, r_max)
+            state["gofr_r"] = r_values
+            state["gofr_sum"] = state["gofr_sum"] + gofr * n_frames
+            state["gofr_frames"] = state["gofr_frames"] + n_frames
+
+    if v_profile_flag:
+        frames = _new_frames(v_profile_first, v_profile_stride, n_done, n_steps)
+        state["v_counts"], state["v_sums"], state["v_squared_deviations"] = merge_bin_deviations(state["v_counts"], state["v_sums"], state["v_squared_deviations"],
+                                                                                                 *velocity_bin_sums(trajectory, velocities, frames, box_length, v_profile_bins, chunk_size))
+
+    state["n_frames"] = np.array(n_steps)
+    state["first_frame"] = np.asarray(trajectory[0])
+    state["last_frame"] = np.asarray(trajectory[n_steps - 1])
+    state["key"] = np.array(key)
+    save_state(directory, state)
+
+    # Update the outputs from the accumulators
+    if stress_flag:
+        write_average_stress(state["av_stresslet"], input_params, raw_stress_flag, N_stress_bins, fileout, output_format, directory)
+
+    if msd_flag:
+        write_msd(time[1:], state["msd"][1:], input_params, False, fileout, non_affine, N_msd_bins, output_format, directory)
+
+    if gofr_flag and state["gofr_frames"] > 0:
+        n_frames = int(state["gofr_frames"])
+        last = gofr_first + (n_frames - 1) * gofr_stride
+        write_output("gofr"+fileout, "r/R   g(r)", {"r": state["gofr_r"], "gofr": state["gofr_sum"] / n_frames}, input_params, output_format,
+                     comments=[f"Averaged over {n_frames} frames ({gofr_first} to {last}, stride {gofr_stride})", "r at the bin centers"], directory=directory)
+
+    if v_profile_flag:
+        write_velocity_profile(state["v_counts"], state["v_sums"], state["v_squared_deviations"], input_params, v_profile_bins, fileout, output_format, directory)
+
+    return n_steps - n_done
@@ -0,0 +1,162 @@
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import time
+
+
+# Name of the report written next to the outputs
+REPORT_FILE = "post_process_report.json"
+
+
+def io_counters() -> dict:
+    """
+    A function to get the input/output counters of this process. On Linux they are read from /proc/self/io, elsewhere only the block counts of getrusage are available
+
+    Returns
+    ----------
+    counters: (dict)
+        The bytes read and written through system calls ("rchar", "wchar") and from/to the storage ("read_bytes", "write_bytes")
+
+    Notes
+    ----------
+    Pages of memory-mapped files are read without system calls, so they only appear in "read_bytes", and only if they were not already cached
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f.read().splitlines())
+        return {key: int(counters[key]) for key in ("rchar", "wchar", "read_bytes", "write_bytes")}
+    except (OSError, KeyError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return dict(rchar=0, wchar=0, read_bytes=usage.ru_inblock * 512, write_bytes=usage.ru_oublock * 512)
+
+
+def reset_peak_rss() -> bool:
+    """
+    A function to reset the peak resident memory of this process (Linux only), so the peak of a single stage can be measured
+
+    Returns
+    ----------
+    reset: (bool)
+        Flag whether the peak was reset. If not, the measured peak is the peak since the start of the process
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """
+    A function to get the peak resident memory of this process in bytes, since its start or the last reset_peak_rss
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kB on Linux
+
+
+def _cpu_time() -> float:
+    """
+    The CPU time of this process and its finished child processes (e.g. the worker pools of an analysis)
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+@contextlib.contextmanager
+def measure_stage(name: str, records: list | None, profile_file: str | None = None):
+    """
+    A context manager to measure a stage of the post processing: wall time, CPU time, peak resident memory and bytes read and written
+
+    Parameters
+    ----------
+    name: (str)
+        The name of the stage
+    records: (list)
+        The list where the measurement of the stage is appended (a dict). If None, nothing is measured
+    profile_file: (str)
+        If given, the stage runs under cProfile and the profile is saved in this file (readable with pstats or snakeviz)
+    """
+    if records is None and profile_file is None:
+        yield
+        return
+
+    peak_reset = reset_peak_rss()
+    start_io = io_counters()
+    start_wall, start_cpu = time.perf_counter(), _cpu_time()
+
+    profiler = cProfile.Profile() if profile_file is not None else None
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+
+        wall_time, cpu_time = time.perf_counter() - start_wall, _cpu_time() - start_cpu
+        end_io = io_counters()
+
+        if records is not None:
+            records.append(dict(stage=name,
+                                wall_time=wall_time,
+                                cpu_time=cpu_time,
+                                peak_rss_MB=peak_rss() / 1e6,
+                                peak_rss_of_stage=peak_reset,
+                                read_MB=(end_io["rchar"] - start_io["rchar"]) / 1e6,
+                                written_MB=(end_io["wchar"] - start_io["wchar"]) / 1e6,
+                                storage_read_MB=(end_io["read_bytes"] - start_io["read_bytes"]) / 1e6,
+                                storage_written_MB=(end_io["write_bytes"] - start_io["write_bytes"]) / 1e6,
+                                process=os.getpid(),
+                                profile=profile_file))
+
+
+def print_report(records: list):
+    """
+    A function to print the measurements of the stages as a table
+
+    Parameters
+    ----------
+    records: (list)
+        The measurements of measure_stage
+    """
+    print(f"{'stage':<18}{'wall [s]':>10}{'cpu [s]':>10}{'peak RSS [MB]':>15}{'read [MB]':>11}{'written [MB]':>14}")
+    for record in records:
+        print(f"{record['stage']:<18}{record['wall_time']:>10.3f}{record['cpu_time']:>10.3f}{record['peak_rss_MB']:>15.1f}"
+              f"{max(record['read_MB'], record['storage_read_MB']):>11.1f}{max(record['written_MB'], record['storage_written_MB']):>14.1f}")
+
+
+def write_report(records: list, filename: str, metadata: dict | None = None) -> str:
+    """
+    A function to write the measurements of the stages in a .json file
+
+    Parameters
+    ----------
+    records: (list)
+        The measurements of measure_stage
+    filename: (str)
+        The name of the report file
+    metadata: (dict)
+        Extra information stored with the measurements (e.g. the system size and the settings)
+
+    Returns
+    ----------
+    filename: (str)
+        The name of the written file
+    """
+    with open(filename, "w") as f:
+        json.dump(dict(metadata or {}, stages=records), f, indent=2)
+
+    return filename
@@ -1,62 +1,159 @@
 import toml
+import argparse
+import os
+from time import perf_counter
 
-from post_process_jfsd.utils import dir_name, simulation_parameters, load_and_check
+from post_process_jfsd.utils import dir_name, simulation_parameters, load_and_check, compute_dtype
 from post_process_jfsd.msd import calculate_msd
-from post_process_jfsd.av_stress import caclulate_average_stress, calculate_particle_stress_correction
+from post_process_jfsd.av_stress import caclulate_average_stress, calculate_particle_stress_correction, stress_profile
 from post_process_jfsd.npy_to_xyz import npy_to_xyz
 from post_process_jfsd.gofr_2d import gofxy_image
 from post_process_jfsd.gofr import gofr
+from post_process_jfsd.structure_factor import structure_factor
+from post_process_jfsd.structure_evolution import structure_evolution
 from post_process_jfsd.velocity_profile import vel_profile
 from post_process_jfsd.msdtolve import msd_to_lve
+from post_process_jfsd.dynamics import calculate_self_dynamics
+from post_process_jfsd.correlation import calculate_stress_autocorrelation, calculate_velocity_autocorrelation
+from post_process_jfsd.scheduler import Task, run_tasks
+from post_process_jfsd.cache import CACHE_DIR, evict_cache
+from post_process_jfsd.incremental import update_incremental
+from post_process_jfsd.instrumentation import REPORT_FILE, measure_stage, print_report, write_report
 
 
 
 
-def main():
-    
-    print("JFSD post processing script\n")
+def post_process(directory: str = ".", settings_path: str | None = None, cache: bool = True, incremental: bool = False, profile_stage: str | None = None) -> dict:
+    """
+    Runs the post processing of one simulation directory
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory with the input files. The output files are written there
+    settings_path: (str)
+        The settings file. If None, the post_process_settings.toml file of the directory is used
+    cache: (bool)
+        Flag whether the cache of intermediate results can be used (it can still be disabled in the settings)
+    incremental: (bool)
+        Flag whether only the frames written since the last incremental run are processed (it can also be enabled in the settings)
+    profile_stage: (str)
+        The stage ("load", an analysis task name or "incremental") that runs under cProfile. The profile is saved in profile_{stage}.prof in the directory
+
+    Returns
+    ----------
+    results: (dict)
+        The results of the analyses, by their task name
+    """
+    if settings_path is None:
+        settings_path = os.path.join(directory, 'post_process_settings.toml')
     
     print("Reading the settings file...")
     try:
-        with open('post_process_settings.toml', 'r') as f:
+        with open(settings_path, 'r') as f:
             settings_file = toml.load(f)
             print(f"Settings obtained from {f.name}\n")
         
         basic_process = bool(settings_file['basic']['just_basic_calculation'])
+        lazy_flag = bool(settings_file['basic'].get('lazy_loading', True))
+        output_format = str(settings_file['basic'].get('output_format', 'text'))
+        precision = str(settings_file['basic'].get('precision', 'float64'))
+        n_workers = int(settings_file['basic'].get('n_workers', 1))
+        incremental_flag = bool(settings_file['basic'].get('incremental', False))
+        cache_flag = bool(settings_file.get('cache', {}).get('enabled', True))
+        cache_max_size = float(settings_file.get('cache', {}).get('max_size_MB', 2000))
+        report_flag = bool(settings_file.get('instrumentation', {}).get('report', True))
+        settings_profile_stage = str(settings_file.get('instrumentation', {}).get('profile_stage', ''))
 
     except FileNotFoundError:
         print("There is no post processing file! Assuming basic post processing\n")
         basic_process = True
+        lazy_flag = True
+        output_format = 'text'
+        precision = 'float64'
+        n_workers = 1
+        incremental_flag = False
+        cache_flag = True
+        cache_max_size = 2000
+        report_flag = True
+        settings_profile_stage = ''
+
+    # Fail before loading anything if the precision is unknown
+    compute_dtype(precision)
+
+    if not cache:
+        cache_flag = False
+    if incremental:
+        incremental_flag = True
+    cache_dir = os.path.join(directory, CACHE_DIR) if cache_flag else None
+    if profile_stage is None:
+        profile_stage = settings_profile_stage
+    profile = {profile_stage: os.path.join(directory, f"profile_{profile_stage}.prof")} if profile_stage else {}
+
+    # The wall time, CPU time, memory and input/output of every stage
+    records = [] if report_flag else None
+    start_time = perf_counter()
 
     if basic_process == True:
         msd_flag = True
-        msd_windowed = True
+        msd_windowed_flag = True
+        msd_non_affine_flag = False
+        save_unwrapped_flag = False
+        msd_block_size = 1000
+        msd_n_workers = 1
+        msd_n_origins = 64
+        N_msd_bins = 80
         
         av_stress_flag = True
         N_stress_bins = 80
         raw_stress_flag = False
         xF_flag = False
+        stress_profile_flag = False
         
         gofxy_flag = False
 
         gofr_flag = False
 
+        sq_flag = False
+
+        evolution_flag = False
+
         v_profile_flag = False
+
+        stress_acf_flag = False
+        vacf_flag = False
+
+        dynamics_flag = False
         
         ovito_flag = False
 
         lve_flag = False
     else:
         msd_flag = bool(settings_file['MSD']['MSD_calculation'])
-        msd_windowed_flag = bool(settings_file['MSD']['windowed_msd'])
+        msd_windowed_flag = settings_file['MSD']['windowed_msd']
+        if msd_windowed_flag != 'log':
+            msd_windowed_flag = bool(msd_windowed_flag)
+        msd_n_origins = int(settings_file['MSD'].get('n_origins', 64))
+        N_msd_bins = int(settings_file['MSD'].get('N_msd_bins', 80))
+        msd_non_affine_flag = bool(settings_file['MSD'].get('non_affine', False))
+        save_unwrapped_flag = bool(settings_file['MSD'].get('save_unwrapped', False))
+        msd_block_size = int(settings_file['MSD'].get('block_size', 1000))
+        msd_n_workers = int(settings_file['MSD'].get('n_workers', 1))
         
         av_stress_flag = bool(settings_file['Stresses']['Binned_stress_average_calculation'])
         N_stress_bins = int(settings_file['Stresses']['N_stress_bins'])
         raw_stress_flag = bool(settings_file['Stresses']['Raw_stress_output'])
         xF_flag = bool(settings_file['Stresses']['particle_stress_correction'])
+        stress_profile_flag = bool(settings_file['Stresses'].get('stress_profile', False))
+        stress_profile_bins = int(settings_file['Stresses'].get('N_profile_bins', 80))
+        stress_profile_frame_range = list(settings_file['Stresses'].get('profile_frame_range', []))
+        stress_profile_stride = int(settings_file['Stresses'].get('profile_stride', 1))
 
         gofxy_flag = bool(settings_file['gofxy']['gofxy_calculation'])
         gofxy_frame = int(settings_file['gofxy']['frame'])
+        gofxy_frame_range = list(settings_file['gofxy'].get('frame_range', []))
+        gofxy_stride = int(settings_file['gofxy'].get('stride', 1))
+        gofxy_rest_frame_range = list(settings_file['gofxy'].get('rest_frame_range', []))
         gofxy_slice_width = float(settings_file['gofxy']['slice_width'])
         gofxy_subtract_rest_flag = bool(settings_file['gofxy']['subtract_rest'])
         N_gofxy_bins = int(settings_file['gofxy']['N_gofxy_bins'])
@@ -65,28 +162,90 @@ def main():
 
         gofr_flag = bool(settings_file['gofr']['gofr_calculation'])
         gofr_frame = int(settings_file['gofr']['frame'])
+        gofr_frame_range = list(settings_file['gofr'].get('frame_range', []))
+        gofr_stride = int(settings_file['gofr'].get('stride', 1))
+        gofr_n_workers = int(settings_file['gofr'].get('n_workers', 1))
         N_gofr_bins = int(settings_file['gofr']['N_gofr_bins'])
         gofr_r_max = float(settings_file['gofr']['r_max'])
 
+        sq_settings = settings_file.get('structure_factor', {})
+        sq_flag = bool(sq_settings.get('sq_calculation', False))
+        sq_frame = int(sq_settings.get('frame', -1))
+        sq_frame_range = list(sq_settings.get('frame_range', []))
+        sq_stride = int(sq_settings.get('stride', 1))
+        sq_n_grid = int(sq_settings.get('N_grid', 64))
+        N_sq_bins = int(sq_settings.get('N_sq_bins', 100))
+        sq_direct_sum = bool(sq_settings.get('direct_sum', False))
+        sq_n_workers = int(sq_settings.get('n_workers', 1))
+
+        evolution_settings = settings_file.get('structure_evolution', {})
+        evolution_flag = bool(evolution_settings.get('evolution_calculation', False))
+        evolution_frames = list(evolution_settings.get('frames', []))
+        evolution_frame_range = list(evolution_settings.get('frame_range', []))
+        evolution_stride = int(evolution_settings.get('stride', 1))
+        evolution_n_log_frames = int(evolution_settings.get('n_log_frames', 0))
+        evolution_window = int(evolution_settings.get('window', 0))
+        evolution_n_workers = int(evolution_settings.get('n_workers', 1))
+
         v_profile_flag = bool(settings_file['velocity_profile']['v_profile_calculation'])
         v_profile_bins = int(settings_file['velocity_profile']['N_bins'])
+        v_profile_frame_range = list(settings_file['velocity_profile'].get('frame_range', []))
+        v_profile_stride = int(settings_file['velocity_profile'].get('stride', 1))
+
+        correlation_settings = settings_file.get('correlation', {})
+        stress_acf_flag = bool(correlation_settings.get('stress_autocorrelation', False))
+        stress_acf_components = list(correlation_settings.get('stress_components', ['xy']))
+        vacf_flag = bool(correlation_settings.get('velocity_autocorrelation', False))
+        vacf_non_affine_flag = bool(correlation_settings.get('non_affine', False))
+        N_correlation_bins = int(correlation_settings.get('N_bins', 80))
+        correlation_block_size = int(correlation_settings.get('block_size', 1000))
+        correlation_n_workers = int(correlation_settings.get('n_workers', 1))
+
+        dynamics_settings = settings_file.get('dynamics', {})
+        dynamics_flag = bool(dynamics_settings.get('self_dynamics', False))
+        dynamics_q_values = list(dynamics_settings.get('q_values', [1.0, 2.0, 3.5, 5.0]))
+        dynamics_r_max = float(dynamics_settings.get('r_max', 5.0))
+        N_vanhove_bins = int(dynamics_settings.get('N_vanhove_bins', 100))
+        dynamics_N_lags = int(dynamics_settings.get('N_lags', 40))
+        dynamics_n_origins = int(dynamics_settings.get('n_origins', 64))
+        dynamics_non_affine_flag = bool(dynamics_settings.get('non_affine', False))
+        dynamics_block_size = int(dynamics_settings.get('block_size', 1000))
+        dynamics_n_workers = int(dynamics_settings.get('n_workers', 1))
 
         ovito_flag = bool(settings_file['ovito_file']['xyz_file'])
+        ovito_format = str(settings_file['ovito_file'].get('file_format', 'xyz'))
+        ovito_frame_range = list(settings_file['ovito_file'].get('frame_range', []))
+        ovito_stride = int(settings_file['ovito_file'].get('stride', 1))
 
         lve_flag = bool(settings_file['MSD_to_LVE']['lve_calculation'])
+        lve_n_points = int(settings_file['MSD_to_LVE'].get('N_points', 100))
+        lve_window = int(settings_file['MSD_to_LVE'].get('window', 7))
+        lve_polynomial_order = int(settings_file['MSD_to_LVE'].get('polynomial_order', 2))
 
-    # Load the input files
-    (trajectory, stresslet, velocities, last_frame_index) = load_and_check(av_stress_flag, v_profile_flag)
+    with measure_stage("load", records, profile.get("load")):
+        # Load the input files
+        (trajectory, stresslet, velocities, last_frame_index) = load_and_check(av_stress_flag or stress_acf_flag or stress_profile_flag, v_profile_flag or vacf_flag, lazy=lazy_flag, directory=directory)
 
-    # Load the simulation parameters
-    input_params = simulation_parameters(trajectory)
+        # Load the simulation parameters
+        input_params = simulation_parameters(trajectory, directory)
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
     print("Post processing parameters")
     print("-------------------------")
+    print(f"Memory-mapped input files: {lazy_flag}")
+    print(f"Output format: {output_format}")
+    print(f"Precision: {precision}")
+    print(f"Parallel analyses: {n_workers}")
+    print(f"Cached intermediate results: {cache_flag}")
+    print(f"Incremental update: {incremental_flag}")
+    print(f"Performance report: {report_flag}")
+    if profile_stage:
+        print(f"Profiled stage: {profile_stage}")
+    print("")
     print(f"MSD calculation: {msd_flag}")
     if msd_flag:
         print(f"Windowed msd: {msd_windowed_flag}")
+        print(f"Non-affine msd: {msd_non_affine_flag}")
     print("")
     if av_stress_flag:
         print(f"Stress calculation: {av_stress_flag} with Pe = {shear_rate*tb}")
@@ -94,57 +253,232 @@ def main():
         print(f"    <xF> correction: {xF_flag}")
     else:
         print(f"Stress calculation: {av_stress_flag}")
+    print(f"Stress profile calculation: {stress_profile_flag}")
     print("")
     print(f"g(r) calculation is: {gofr_flag}")
     if gofr_flag:
-        print(f"Frame = {gofr_frame}")
+        if gofr_frame_range:
+            print(f"Frames = {gofr_frame_range} with stride {gofr_stride}")
+        else:
+            print(f"Frame = {gofr_frame}")
+    print("")
+    print(f"S(q) calculation: {sq_flag}")
+    if sq_flag:
+        if sq_frame_range:
+            print(f"Frames = {sq_frame_range} with stride {sq_stride}")
+        else:
+            print(f"Frame = {sq_frame}")
+        print(f"Direct sum: {sq_direct_sum}" if sq_direct_sum else f"Grid = {sq_n_grid}^3")
+    print("")
+    print(f"g(r) and g(r) on xy plane evolution: {evolution_flag}")
+    if evolution_flag:
+        if evolution_frames:
+            print(f"Frames = {evolution_frames}")
+        elif evolution_n_log_frames > 0:
+            print(f"{evolution_n_log_frames} log-spaced frames in {evolution_frame_range or 'all frames'}")
+        else:
+            print(f"Frames = {evolution_frame_range or 'all frames'} with stride {evolution_stride}")
+        print(f"Window = {evolution_window} frames on each side")
     print("")
     print(f"g(r) on xy plane calculation: {gofxy_flag}")
     if gofxy_flag:
-        print(f"Frame = {gofxy_frame}")
+        if gofxy_frame_range:
+            print(f"Frames = {gofxy_frame_range} with stride {gofxy_stride}")
+        else:
+            print(f"Frame = {gofxy_frame}")
         print(f"Subtract zeroth frame: {gofxy_subtract_rest_flag}")
     print("")
     print(f"Velocity profile calculation: {v_profile_flag}")
     print("")
+    print(f"Stress autocorrelation (Green-Kubo) calculation: {stress_acf_flag}")
+    if stress_acf_flag:
+        print(f"Stress components: {stress_acf_components}")
+    print(f"Velocity autocorrelation calculation: {vacf_flag}")
+    if vacf_flag:
+        print(f"Non-affine velocities: {vacf_non_affine_flag}")
+    print("")
+    print(f"Self dynamics (F_s(q,t), van Hove, alpha_2) calculation: {dynamics_flag}")
+    if dynamics_flag:
+        print(f"q = {dynamics_q_values}")
+        print(f"Non-affine displacements: {dynamics_non_affine_flag}")
+    print("")
     print(f"Ovito file output: {ovito_flag}")
+    if ovito_flag:
+        print(f"Format = {ovito_format}")
     print("")
     print(f"LVE spectrum calculation: {lve_flag}")
     print("-------------------------")
 
 
     # Get the directory name
-    fileout = dir_name()
+    fileout = dir_name(directory)
+
+    if incremental_flag:
+        # Only the analyses with running sums are updated, with the frames written since the last run
+        incremental_settings = dict(stress_flag=av_stress_flag, msd_flag=msd_flag, gofr_flag=gofr_flag, v_profile_flag=v_profile_flag)
+        if av_stress_flag:
+            incremental_settings.update(raw_stress_flag=raw_stress_flag, N_stress_bins=N_stress_bins)
+        if msd_flag:
+            incremental_settings.update(non_affine=msd_non_affine_flag, N_msd_bins=N_msd_bins)
+        if gofr_flag:
+            incremental_settings.update(N_gofr_bins=N_gofr_bins, r_max=gofr_r_max, gofr_frame_range=gofr_frame_range, gofr_stride=gofr_stride)
+        if v_profile_flag:
+            incremental_settings.update(v_profile_bins=v_profile_bins, v_profile_frame_range=v_profile_frame_range, v_profile_stride=v_profile_stride)
+
+        skipped = [name for name, flag in (("<xF> correction", av_stress_flag and xF_flag), ("stress profile", stress_profile_flag), ("S(q)", sq_flag),
+                                           ("g(r) and g(r) on xy plane evolution", evolution_flag), ("g(r) on xy plane", gofxy_flag),
+                                           ("stress autocorrelation", stress_acf_flag), ("velocity autocorrelation", vacf_flag),
+                                           ("self dynamics", dynamics_flag), ("ovito file", ovito_flag), ("LVE spectrum", lve_flag)) if flag]
+        if skipped:
+            print(f"Incremental update only supports the stress, direct MSD, g(r) and velocity profile. Skipping: {', '.join(skipped)}")
+        if msd_flag and msd_windowed_flag is not False:
+            print(f"Incremental update calculates the direct MSD instead of the {'log' if msd_windowed_flag == 'log' else 'windowed'} MSD")
+
+        print("Updating the stress, direct MSD, g(r) and velocity profile with the new frames...")
+        with measure_stage("incremental", records, profile.get("incremental")):
+            n_new_frames = update_incremental(trajectory, stresslet, velocities, input_params, fileout, **incremental_settings,
+                                              output_format=output_format, directory=directory)
+        results = {"incremental": n_new_frames}
+        _report(records, directory, input_params, n_workers, start_time)
+        return results
+
+    # Every analysis is a task with its inputs, so the independent ones can run at the same time
+    tasks = []
 
-    # Calculate the msd
     if msd_flag:
-        print("Calculating MSD...")
-        calculate_msd(trajectory, input_params, msd_windowed_flag, fileout)
+        unwrapped_file = os.path.join(directory, "unwrapped_trajectory.npy") if save_unwrapped_flag else None
+        tasks.append(Task("msd", calculate_msd, ("trajectory",), 
+                          (input_params, msd_windowed_flag, fileout, unwrapped_file, msd_non_affine_flag),
+                          dict(block_size=msd_block_size, n_workers=msd_n_workers, n_origins=msd_n_origins, N_msd_bins=N_msd_bins, output_format=output_format, cache_dir=cache_dir, directory=directory, precision=precision),
+                          message="Calculating MSD..."))
 
     if av_stress_flag:
-        print("Calculating stresses...")
-        caclulate_average_stress(stresslet, input_params, raw_stress_flag, N_stress_bins, fileout)
+        tasks.append(Task("stress", caclulate_average_stress, ("stresslet",), 
+                          (input_params, raw_stress_flag, N_stress_bins, fileout, output_format, cache_dir, directory), dict(precision=precision),
+                          message="Calculating stresses..."))
         if xF_flag:
-            calculate_particle_stress_correction(trajectory, input_params, raw_stress_flag, fileout)
+            tasks.append(Task("xF", calculate_particle_stress_correction, ("trajectory",), 
+                              (input_params, raw_stress_flag, fileout), dict(output_format=output_format, cache_dir=cache_dir, directory=directory, precision=precision),
+                              message="Calculating <xF> stress correction..."))
+
+    if stress_profile_flag:
+        tasks.append(Task("stress_profile", stress_profile, ("trajectory", "stresslet"), 
+                          (input_params, stress_profile_bins, fileout, stress_profile_frame_range, stress_profile_stride), dict(output_format=output_format, directory=directory),
+                          message="Calculating stress profile..."))
 
     if gofr_flag:
-        print("Calculating g(r)...")
-        gofr(trajectory, gofr_frame, last_frame_index, input_params, N_gofr_bins, gofr_r_max, fileout)
+        tasks.append(Task("gofr", gofr, ("trajectory",), 
+                          (gofr_frame, last_frame_index, input_params, N_gofr_bins, gofr_r_max, fileout, gofr_frame_range, gofr_stride, gofr_n_workers, output_format, directory),
+                          message="Calculating g(r)..."))
     
+    if sq_flag:
+        tasks.append(Task("sq", structure_factor, ("trajectory",), 
+                          (sq_frame, last_frame_index, input_params, fileout, sq_n_grid, N_sq_bins, sq_frame_range, sq_stride, sq_direct_sum, sq_n_workers, output_format, directory),
+                          dict(precision=precision),
+                          message="Calculating S(q)..."))
+
     if gofxy_flag:
-        print("Calculating g(r) on xy plane...")
-        gofxy_image(trajectory, input_params, last_frame_index, gofxy_frame, gofxy_subtract_rest_flag, fileout, gofxy_slice_width, N_gofxy_bins, Xmax, Ymax)
+        tasks.append(Task("gofxy", gofxy_image, ("trajectory",), 
+                          (input_params, last_frame_index, gofxy_frame, gofxy_subtract_rest_flag, fileout, gofxy_slice_width, N_gofxy_bins, Xmax, Ymax, gofxy_frame_range, gofxy_stride, gofxy_rest_frame_range, output_format, directory),
+                          dict(precision=precision),
+                          message="Calculating g(r) on xy plane..."))
+
+    if evolution_flag:
+        tasks.append(Task("structure_evolution", structure_evolution, ("trajectory",), 
+                          (last_frame_index, input_params, fileout, N_gofr_bins, gofr_r_max, N_gofxy_bins, Xmax, Ymax, gofxy_slice_width,
+                           evolution_frames, evolution_frame_range, evolution_stride, evolution_n_log_frames, evolution_window, evolution_n_workers, directory),
+                          dict(precision=precision),
+                          message="Calculating g(r) and g(r) on xy plane evolution..."))
 
     if v_profile_flag:
-        print("Calculating velocity profile...")
-        vel_profile(trajectory, velocities, input_params, v_profile_bins, fileout)
+        tasks.append(Task("velocity_profile", vel_profile, ("trajectory", "velocities"), 
+                          (input_params, v_profile_bins, fileout, v_profile_frame_range, v_profile_stride), dict(output_format=output_format, directory=directory),
+                          message="Calculating velocity profile..."))
+
+    if stress_acf_flag:
+        tasks.append(Task("stress_acf", calculate_stress_autocorrelation, ("stresslet",), 
+                          (input_params, fileout, stress_acf_components, N_correlation_bins), dict(output_format=output_format, cache_dir=cache_dir, directory=directory),
+                          message="Calculating stress autocorrelation..."))
+
+    if vacf_flag:
+        tasks.append(Task("vacf", calculate_velocity_autocorrelation, ("velocities", "trajectory"), 
+                          (input_params, fileout, vacf_non_affine_flag, N_correlation_bins, correlation_block_size, correlation_n_workers), dict(output_format=output_format, cache_dir=cache_dir, directory=directory),
+                          message="Calculating velocity autocorrelation..."))
+
+    if dynamics_flag:
+        # The unwrapped trajectory is read from the cache entry of the msd, if it is calculated
+        tasks.append(Task("dynamics", calculate_self_dynamics, ("trajectory",), 
+                          (input_params, fileout, dynamics_q_values, dynamics_r_max, N_vanhove_bins, dynamics_N_lags, dynamics_n_origins, dynamics_non_affine_flag,
+                           dynamics_block_size, dynamics_n_workers), dict(output_format=output_format, cache_dir=cache_dir, directory=directory, precision=precision),
+                          depends=("msd",) if msd_flag and cache_flag else (),
+                          message="Calculating self dynamics..."))
 
     if ovito_flag:
-        print("Writing ovito file...")
-        npy_to_xyz(trajectory, fileout)
+        tasks.append(Task("ovito", npy_to_xyz, ("trajectory",), 
+                          (fileout,), dict(frame_range=ovito_frame_range, stride=ovito_stride, file_format=ovito_format, box_length=box_length, directory=directory),
+                          message="Writing ovito file..."))
 
     if lve_flag:
-        print("Calculating LVE spectrum...")
-        msd_to_lve(fileout)
+        # The LVE spectrum is calculated from the MSD of the pipeline, or else from the MSD file
+        tasks.append(Task("lve", _lve_of_msd if msd_flag else msd_to_lve, ("msd",) if msd_flag else (), (fileout, output_format, directory),
+                          dict(n_points=lve_n_points, window=lve_window, polynomial_order=lve_polynomial_order),
+                          message="Calculating LVE spectrum..."))
+
+    stages = ["load", "incremental"] + [task.name for task in tasks]
+    if profile_stage and profile_stage not in stages:
+        raise ValueError(f"Unknown stage {profile_stage} to profile. Use one of {stages}")
+
+    results = run_tasks(tasks, dict(trajectory=trajectory, stresslet=stresslet, velocities=velocities), n_workers, records, profile)
+
+    if cache_flag:
+        evict_cache(cache_dir, cache_max_size)
+
+    _report(records, directory, input_params, n_workers, start_time)
+
+    return results
+
+
+def _lve_of_msd(msd_data: tuple, *args, **kwargs):
+    """
+    Calculates the LVE spectrum from the MSD result of the pipeline, which the scheduler passes as the first positional input
+    """
+    return msd_to_lve(*args, msd_data=msd_data, **kwargs)
+
+
+def _report(records: list | None, directory: str, input_params: tuple, n_workers: int, start_time: float):
+    """
+    Prints the measurements of the stages and writes them in the report file of the directory
+    """
+    if records is None:
+        return
+
+    (n_steps, N) = input_params[:2]
+    total_time = perf_counter() - start_time
+
+    print("\nPerformance report")
+    print("-------------------------")
+    print_report(records)
+    print(f"Total wall time: {total_time:.3f} s")
+    print("-------------------------")
+
+    write_report(records, os.path.join(directory, REPORT_FILE),
+                 dict(directory=os.path.abspath(directory), N=int(N), n_steps=int(n_steps), n_workers=n_workers, wall_time=total_time))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="JFSD post processing script")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every intermediate result, without reading or writing the cache")
+    parser.add_argument("--incremental", action="store_true", help="Update the outputs of a running simulation with the frames written since the last incremental run")
+    parser.add_argument("--profile", metavar="STAGE", default=None, help="Run a stage ('load', 'incremental' or an analysis: msd, stress, xF, gofr, sq, structure_evolution, gofxy, velocity_profile, stress_profile, stress_acf, vacf, dynamics, ovito, lve) under cProfile")
+    args = parser.parse_args()
+
+    # The figures are only saved, never shown
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    
+    print("JFSD post processing script\n")
+
+    post_process(".", cache=not args.no_cache, incremental=args.incremental, profile_stage=args.profile)
     
     print("Done!")
 
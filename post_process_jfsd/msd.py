@@ -1,9 +1,386 @@
 import numpy as np
 from numpy import ndarray as Array
-import freud
+from concurrent.futures import ProcessPoolExecutor
 
+from post_process_jfsd.utils import frame_chunks, share_array, open_source, log_bin_reduce, log_bin_edges, compute_dtype
+from post_process_jfsd.output import write_output, output_metadata
+from post_process_jfsd.cache import cached_array, cache_key, input_fingerprint
 
-def calculate_msd(trajectory: Array, input_params: tuple, windowed_msd_flag: bool, fileout: str) -> tuple[Array, Array]:
+
+def unwrap_frames(frames: Array, previous_frame: Array, previous_unwrapped: Array, strain: Array, input_params: tuple, non_affine: bool = False) -> Array:
+    """
+    Function to unwrap consecutive frames, continuing from the last already unwrapped frame (see unwrap_trajectory)
+
+    Parameters
+    -----------
+    frames: (Array)
+        The wrapped positions of the consecutive frames
+    previous_frame: (Array)
+        The wrapped positions of the frame before the first one
+    previous_unwrapped: (Array)
+        The unwrapped positions of the frame before the first one
+    strain: (Array)
+        The accumulated strain at every one of the frames
+    input_params: (tuple)
+        The input parameters
+    non_affine: (bool)
+        Flag whether the affine displacement of the shear flow is subtracted from the x coordinates
+
+    Returns
+    -----------
+    unwrapped_frames: (Array)
+        The unwrapped positions of the frames (the cumulative sums are always in double precision)
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    frame_dt = dt * period
+
+    # Frame to frame displacements
+    delta = np.diff(frames, axis=0, prepend=previous_frame[np.newaxis])
+
+    # Boundary crossings in the gradient direction and the corresponding Lees-Edwards image shift
+    y_crossings = np.round(delta[..., 1] / box_length)
+    delta[..., 1] -= y_crossings * box_length
+    delta[..., 0] -= y_crossings * strain[:, np.newaxis] * box_length
+
+    # Apply the minimum image convention in the x and z directions
+    delta[..., [0, 2]] -= box_length * np.round(delta[..., [0, 2]] / box_length)
+
+    if non_affine:
+        # Subtract the affine displacement of the flow, evaluated at the midpoint y of every step
+        y_unwrapped = previous_unwrapped[:, 1] + np.cumsum(delta[..., 1], axis=0, dtype=np.float64)
+        y_previous = np.concatenate((previous_unwrapped[np.newaxis, :, 1], y_unwrapped[:-1]), axis=0)
+        delta[..., 0] -= shear_rate * frame_dt * 0.5 * (y_previous + y_unwrapped)
+
+    # Update the unwrapped positions
+    return previous_unwrapped + np.cumsum(delta, axis=0, dtype=np.float64)
+
+
+def unwrap_trajectory(trajectory: Array, input_params: tuple, chunk_size: int = 1000, output_file: str | None = None, non_affine: bool = False, dtype: type = np.float64) -> Array:
+    """
+    Function to unwrap the trajectory of a (sheared) periodic box. The trajectory is read in chunks of frames and the unwrapped positions are the cumulative sum of the corrected frame-to-frame displacements
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The input (wrapped) trajectory, can be memory-mapped
+    input_params: (tuple)
+        The input parameters
+    chunk_size: (int)
+        The number of frames read from the trajectory at once
+    output_file: (str)
+        Name of a .npy file where the unwrapped trajectory is written (and memory-mapped). If None, the unwrapped trajectory is kept in memory
+    non_affine: (bool)
+        Flag whether the affine displacement of the shear flow is subtracted from the x coordinates
+    dtype: (type)
+        The floating point type of the frame to frame displacements and of the stored unwrapped trajectory. The positions are accumulated in double precision
+
+    Returns
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory; has the same dimensions as the input trajectory
+
+    Notes
+    -----------
+    The shear flow is along x with the gradient along y. With Lees-Edwards boundary conditions a particle crossing the y boundary of the box is shifted in x by the accumulated strain times the box length, which is removed from the displacement before the minimum image convention is applied in x
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    # Initialize an array to store the unwrapped trajectory
+    if output_file is None:
+        unwrapped_trajectory = np.empty((n_steps, N, 3), dtype=dtype)
+    else:
+        unwrapped_trajectory = np.lib.format.open_memmap(output_file, mode='w+', dtype=dtype, shape=(n_steps, N, 3))
+
+    strain = shear_rate * time
+
+    previous_frame = np.asarray(trajectory[0], dtype=dtype)
+    unwrapped_trajectory[0] = previous_frame  # Start with the first frame as is
+    previous_unwrapped = previous_frame.astype(np.float64)
+
+    for chunk in frame_chunks(n_steps - 1, chunk_size):
+        frames = np.asarray(trajectory[chunk.start + 1:chunk.stop + 1], dtype=dtype)
+
+        unwrapped_chunk = unwrap_frames(frames, previous_frame, previous_unwrapped, strain[chunk.start + 1:chunk.stop + 1], input_params, non_affine)
+        unwrapped_trajectory[chunk.start + 1:chunk.stop + 1] = unwrapped_chunk
+
+        previous_frame = frames[-1]
+        previous_unwrapped = unwrapped_chunk[-1]
+
+    if output_file is not None:
+        unwrapped_trajectory.flush()
+
+    return unwrapped_trajectory
+
+
+def windowed_msd_block(source: str | tuple | Array, first_particle: int, last_particle: int) -> Array:
+    """
+    Function to calculate the windowed msd of a block of particles, using all time origins. The displacement autocorrelation is calculated with FFTs, so the cost is O(T log T) per particle
+
+    Parameters
+    -----------
+    source: (str | tuple | Array)
+        The unwrapped trajectory, or its file name / shared memory block (see utils.share_array)
+    first_particle: (int)
+        The index of the first particle of the block
+    last_particle: (int)
+        The index after the last particle of the block
+
+    Returns
+    -----------
+    msd_sum: (Array)
+        The windowed msd of every lag time, summed over the particles of the block
+    """
+    from scipy.fft import rfft, irfft, next_fast_len
+
+    positions = np.asarray(open_source(source)[:, first_particle:last_particle], dtype=np.float64)
+    n_steps = positions.shape[0]
+    remaining = n_steps - np.arange(n_steps)  # Number of time origins of every lag time
+
+    # S1(m) = sum_t (r(t+m)^2 + r(t)^2) / (T - m), from the cumulative sums of the squared positions
+    squared = np.sum(positions**2, axis=2)
+    cumulative = np.concatenate((np.zeros((1, squared.shape[1])), np.cumsum(squared, axis=0)), axis=0)
+    S1 = (cumulative[-1] - cumulative[:-1] + cumulative[::-1][:-1]) / remaining[:, np.newaxis]
+
+    # S2(m) = sum_t r(t+m) r(t) / (T - m), with a zero padded FFT
+    n_fft = next_fast_len(2 * n_steps, real=True)
+    transform = rfft(positions, n=n_fft, axis=0)
+    S2 = np.sum(irfft(transform * transform.conj(), n=n_fft, axis=0)[:n_steps], axis=2) / remaining[:, np.newaxis]
+
+    return np.sum(S1 - 2.0 * S2, axis=1)
+
+
+def windowed_msd(unwrapped_trajectory: Array, block_size: int = 1000, n_workers: int = 1) -> Array:
+    """
+    Function to calculate the windowed (all time origins) msd of an unwrapped trajectory. The particles are processed in independent blocks, so the memory is bounded by the block size, and the blocks can be shared by a pool of worker processes
+
+    Parameters
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory, can be memory-mapped
+    block_size: (int)
+        The number of particles processed at once by every worker
+    n_workers: (int)
+        The number of worker processes
+
+    Returns
+    -----------
+    msd: (Array)
+        The ensemble averaged msd of every lag time (same as the 'window' mode of freud.msd.MSD)
+    """
+    (n_steps, N, _) = unwrapped_trajectory.shape
+    blocks = [(block.start, block.stop) for block in frame_chunks(N, block_size)]
+    n_workers = min(max(int(n_workers), 1), len(blocks))
+
+    if n_workers == 1:
+        msd_sum = sum(windowed_msd_block(unwrapped_trajectory, first, last) for first, last in blocks)
+    else:
+        # The workers read their blocks from the memory-mapped file or a shared memory copy of the trajectory
+        source, shared_block = share_array(unwrapped_trajectory)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(windowed_msd_block, source, first, last) for first, last in blocks]
+                msd_sum = sum(future.result() for future in futures)
+        finally:
+            if shared_block is not None:
+                shared_block.close()
+                shared_block.unlink()
+
+    return msd_sum / N
+
+
+def direct_msd(unwrapped_trajectory: Array, chunk_size: int = 1000) -> Array:
+    """
+    Function to calculate the direct msd of an unwrapped trajectory, using only the first frame as time origin
+
+    Parameters
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory, can be memory-mapped
+    chunk_size: (int)
+        The number of frames read at once
+
+    Returns
+    -----------
+    msd: (Array)
+        The ensemble averaged msd of every frame (same as the 'direct' mode of freud.msd.MSD)
+    """
+    n_steps = unwrapped_trajectory.shape[0]
+    origin = np.asarray(unwrapped_trajectory[0], dtype=np.float64)
+
+    msd = np.zeros(n_steps)
+    for chunk in frame_chunks(n_steps, chunk_size):
+        displacements = np.asarray(unwrapped_trajectory[chunk], dtype=np.float64) - origin
+        msd[chunk] = np.mean(np.sum(displacements**2, axis=2), axis=1)
+
+    return msd
+
+
+def log_lags(n_steps: int, num_bins: int = 80) -> Array:
+    """
+    A helper function to get logarithmically spaced lag times (in frames), aligned with the bins of utils.log_bin_stat: for evenly spaced frames the bin edges are the same, and every lag is the first frame of a bin (bins without a frame have no lag)
+
+    Parameters
+    -----------
+    n_steps: (int)
+        The number of frames
+    num_bins: (int)
+        The number of logarithmic bins
+
+    Returns
+    -----------
+    lags: (Array)
+        The unique lags (in frames) from 1 to at most n_steps - 1
+    """
+    if n_steps < 2:
+        raise ValueError(f"Logarithmic lag times need at least two frames, the trajectory has {n_steps}")
+
+    edges = log_bin_edges(1, n_steps - 1, num_bins)
+
+    # The first integer lag of every bin (the last edge closes the last bin), not moved past an edge by its rounding error
+    return np.unique(np.ceil(edges[:-1] * (1.0 - 1e-10)).astype(int))
+
+
+def log_msd(unwrapped_trajectory: Array, n_origins: int = 64, num_bins: int = 80) -> tuple[Array, Array]:
+    """
+    Function to calculate the msd at logarithmically spaced lag times, averaged over a subsample of evenly spaced time origins. The cost is set by the number of origins and lags instead of the trajectory length
+
+    Parameters
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory, can be memory-mapped
+    n_origins: (int)
+        The maximum number of time origins
+    num_bins: (int)
+        The number of logarithmic lag times
+
+    Returns
+    -----------
+    lags: (Array)
+        The lag times (in frames)
+    msd: (Array)
+        The ensemble averaged msd of every lag time
+    """
+    n_steps = unwrapped_trajectory.shape[0]
+    lags = log_lags(n_steps, num_bins)
+    origins = np.unique(np.rint(np.linspace(0, n_steps - 2, max(int(n_origins), 1))).astype(int))
+
+    msd_sum = np.zeros(len(lags))
+    n_samples = np.zeros(len(lags))
+
+    # Every origin frame is read once, followed by the frames at all of its lag times
+    for origin in origins:
+        origin_frame = np.asarray(unwrapped_trajectory[origin], dtype=np.float64)
+        valid_lags = np.flatnonzero(origin + lags < n_steps)
+        for i in valid_lags:
+            displacements = np.asarray(unwrapped_trajectory[origin + lags[i]], dtype=np.float64) - origin_frame
+            msd_sum[i] += np.mean(np.sum(displacements**2, axis=1))
+            n_samples[i] += 1
+
+    return lags, msd_sum / n_samples
+
+
+def cached_unwrapped_trajectory(trajectory: Array,
+                                input_params: tuple,
+                                unwrapped_file: str | None = None,
+                                non_affine: bool = False,
+                                chunk_size: int = 1000,
+                                cache_dir: str | None = None,
+                                precision: str = "float64",
+                                directory: str = ".") -> Array:
+    """
+    Function to get the unwrapped trajectory, shared by the analyses of the particle displacements. It is cached (memory-mapped), unless it is saved in a given file
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The input trajectory
+    input_params: (tuple)
+        The input parameters
+    unwrapped_file: (str)
+        Name of a .npy file where the unwrapped trajectory is written. If None, it is cached in cache_dir
+    non_affine: (bool)
+        Flag whether the affine shear displacements are subtracted
+    chunk_size: (int)
+        The number of frames read from the trajectory at once
+    cache_dir: (str)
+        The cache directory. If None (and no file is given), the unwrapped trajectory is kept in memory
+    precision: (str)
+        The floating point precision of the unwrapped trajectory ("float64" or "float32")
+    directory: (str)
+        The simulation directory of the trajectory file (identifies the cached unwrapped trajectory)
+
+    Returns
+    -----------
+    unwrapped_trajectory: (Array)
+        The unwrapped trajectory
+    """
+    dtype = compute_dtype(precision)
+
+    if unwrapped_file is not None:
+        return unwrap_trajectory(trajectory, input_params, chunk_size, unwrapped_file, non_affine, dtype)
+
+    key = cache_key(input_fingerprint(trajectory, "trajectory", directory), output_metadata(input_params), non_affine, precision) if cache_dir is not None else None
+
+    return cached_array(cache_dir, "unwrapped", key, 
+                        lambda path: unwrap_trajectory(trajectory, input_params, chunk_size, path, non_affine, dtype), 
+                        writes_file=True)
+
+
+def msd_of_trajectory(trajectory: Array,
+                      input_params: tuple,
+                      windowed_msd_flag: bool,
+                      unwrapped_file: str | None = None,
+                      non_affine: bool = False,
+                      chunk_size: int = 1000,
+                      block_size: int = 1000,
+                      n_workers: int = 1,
+                      n_origins: int = 64,
+                      N_msd_bins: int = 80,
+                      cache_dir: str | None = None,
+                      precision: str = "float64",
+                      directory: str = ".") -> Array:
+    """
+    Function to unwrap the trajectory and calculate the msd, without writing any output. The parameters are the same as in calculate_msd
+
+    Returns
+    -----------
+    msd_data: (Array)
+        The lag times (first row) and the msd values (second row), without the zero lag time
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    # Unwrap the trajectory (the unwrapped trajectory is cached, unless it is saved in a given file)
+    unwrapped_trajectory = cached_unwrapped_trajectory(trajectory, input_params, unwrapped_file, non_affine, chunk_size, cache_dir, precision, directory)
+
+    # Compute the MSD using the unwrapped trajectory
+    if windowed_msd_flag == 'log':
+        lags, msd = log_msd(unwrapped_trajectory, n_origins, N_msd_bins)
+        msd_time = time[lags]
+    elif windowed_msd_flag:
+        msd = windowed_msd(unwrapped_trajectory, block_size, n_workers)[1:]
+        msd_time = time[1:]
+    else:
+        msd = direct_msd(unwrapped_trajectory, chunk_size)[1:]
+        msd_time = time[1:]
+
+    return np.stack((msd_time, msd))
+
+
+def calculate_msd(trajectory: Array, 
+                  input_params: tuple, 
+                  windowed_msd_flag: bool, 
+                  fileout: str, 
+                  unwrapped_file: str | None = None, 
+                  non_affine: bool = False, 
+                  chunk_size: int = 1000,
+                  block_size: int = 1000,
+                  n_workers: int = 1,
+                  n_origins: int = 64,
+                  N_msd_bins: int = 80,
+                  output_format: str = "text",
+                  cache_dir: str | None = None,
+                  directory: str = ".",
+                  precision: str = "float64") -> tuple[Array, Array]:
     """
     Function to calculate the msd from the unwrapped trajectory
     
@@ -13,61 +390,114 @@ def calculate_msd(trajectory: Array, input_params: tuple, windowed_msd_flag: boo
         The input trajectory
     input_params: (tuple)
         The input parameters
-    windowed_msd_flag: (bool)
-        Flag whether the windowed or direct msd is calculated
+    windowed_msd_flag: (bool | str)
+        Flag whether the windowed (True) or direct (False) msd is calculated. With 'log' the msd is calculated at logarithmically spaced lag times with a subsample of the time origins
     fileout: (str)
         The name of the parent directory (for naming the output files)
+    unwrapped_file: (str)
+        Name of a .npy file where the unwrapped trajectory is saved for other analyses. If None, it is not saved
+    non_affine: (bool)
+        Flag whether the msd of the non-affine displacements (affine shear displacement subtracted) is calculated
+    chunk_size: (int)
+        The number of frames read from the trajectory at once during the unwrapping
+    block_size: (int)
+        The number of particles processed at once for the windowed msd
+    n_workers: (int)
+        The number of worker processes for the windowed msd
+    n_origins: (int)
+        The number of time origins of the 'log' msd
+    N_msd_bins: (int)
+        The number of logarithmic lag times of the 'log' msd, or of the logarithmic bins of the binned windowed/direct msd
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    cache_dir: (str)
+        The directory where the unwrapped trajectory and the msd are cached for later runs. If None, nothing is cached
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision of the unwrapping and of the stored unwrapped trajectory ("float64" or "float32"). The msd itself is always summed in double precision
 
     Returns
     -----------
     time/tb: (Array)
-        The time intervals normalized by the brownian time
+        The time intervals normalized by the brownian time (only the lag times for the 'log' msd)
     msd: (Array)
         The calculated msds 
 
     """
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
-    # Define the box dimensions (assuming a cubic box for simplicity)
-    half_box_length = box_length / 2.0
+    # The msd only depends on the trajectory, the simulation parameters and the msd mode
+    if cache_dir is not None and unwrapped_file is None:
+        mode_settings = (windowed_msd_flag, n_origins, N_msd_bins) if windowed_msd_flag == 'log' else (windowed_msd_flag,)
+        key = cache_key(input_fingerprint(trajectory, "trajectory", directory), output_metadata(input_params), non_affine, mode_settings, precision)
+    else:
+        key = None
 
-    # Initialize an array to store the unwrapped trajectory
-    unwrapped_trajectory = np.zeros_like(trajectory)
-    unwrapped_trajectory[0] = trajectory[0]  # Start with the first frame as is
+    msd_time, msd = cached_array(cache_dir if key is not None else None, "msd", key,
+                                 lambda: msd_of_trajectory(trajectory, input_params, windowed_msd_flag, unwrapped_file, non_affine, 
+                                                           chunk_size, block_size, n_workers, n_origins, N_msd_bins, cache_dir, precision, directory))
 
-    # Unwrap the trajectory by checking for boundary crossings
-    for t in range(1, trajectory.shape[0]):
-        delta = trajectory[t] - trajectory[t - 1]
-        
-        # Apply the minimum image convention for each particle
-        delta[delta > half_box_length] -= box_length  # Adjust if the displacement is > half the box length (positive direction)
-        delta[delta < -half_box_length] += box_length  # Adjust if the displacement is < -half the box length (negative direction)
+    write_msd(msd_time, msd, input_params, windowed_msd_flag, fileout, non_affine, N_msd_bins, output_format, directory)
 
-        # Update the unwrapped position
-        unwrapped_trajectory[t] = unwrapped_trajectory[t - 1] + delta
+    return msd_time/tb, msd
 
-    #np.save("unwrappedtrajectory",unwrapped_trajectory)
 
-    # Initialize the MSD calculator
-    if windowed_msd_flag:
-        msd_mode = 'window'
+def write_msd(msd_time: Array,
+              msd: Array,
+              input_params: tuple,
+              windowed_msd_flag: bool,
+              fileout: str,
+              non_affine: bool = False,
+              N_msd_bins: int = 80,
+              output_format: str = "text",
+              directory: str = "."):
+    """
+    Function to write the msd output files, and the log binned msd (for the windowed and direct msd)
+
+    Parameters
+    -----------
+    msd_time: (Array)
+        The lag times, without the zero lag time
+    msd: (Array)
+        The msd values
+    input_params: (tuple)
+        The input parameters
+    windowed_msd_flag: (bool | str)
+        The msd mode (see calculate_msd), for naming the output files
+    fileout: (str)
+        The name of the parent directory (for naming the output files)
+    non_affine: (bool)
+        Flag whether the msd is of the non-affine displacements
+    N_msd_bins: (int)
+        The number of logarithmic bins of the binned msd
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    if windowed_msd_flag == 'log':
+        fileoutadd = 'log'
+    elif windowed_msd_flag:
         fileoutadd = ''
     else:
-        msd_mode = 'direct'
         fileoutadd = 'direct'
+    if non_affine:
+        fileoutadd += 'nonaffine'
 
-    msd_calculator = freud.msd.MSD(mode=msd_mode)
-
-    # Compute the MSD using the unwrapped trajectory
-    msd_calculator.compute(unwrapped_trajectory)
+    write_output("MSD"+fileoutadd+fileout, r"t/t\-(B)    MSD", {"time": msd_time / tb, "msd": msd}, input_params, output_format, directory=directory) #storing the unwrappped MSD
 
-    # Retrieve the mean squared displacement results
-    msd = msd_calculator.msd
+    if windowed_msd_flag != 'log':
+        # Log binned msd, with the standard error of the binned values
+        binned_time, binned_msd, counts, variances = log_bin_reduce(time, np.concatenate(([0.0], msd)), num_bins=N_msd_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            msd_errors = np.sqrt(variances / counts)
 
-    file=open("MSD"+fileoutadd+fileout+".dat","w+") #storing the unwrappped MSD
-    file.write("t/t\-(B)    MSD\n")
-    for i in range(n_steps-1):
-        file.write(str(time[i+1]/tb)+"   "+str(msd[i+1])+"\n")
-    file.close
+        filled = counts > 0
+        write_output("MSD"+fileoutadd+fileout+"binned", r"t/t\-(B)    MSD   \g(d)MSD",
+                     {"time": binned_time[filled] / tb, "msd": binned_msd[filled], "msd_error": msd_errors[filled]},
+                     input_params, output_format, directory=directory)
 
-    return time/tb, msd
\ No newline at end of file
+    return
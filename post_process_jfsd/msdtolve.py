@@ -1,91 +1,188 @@
 import numpy as np
 from numpy import ndarray as Array
-from scipy.special import gamma
 
 from post_process_jfsd.utils import simulation_parameters, load_and_check
 from post_process_jfsd.msd import calculate_msd
+from post_process_jfsd.output import write_output, read_output
 
 
-def msd_to_lve(fileout: str) -> tuple[Array, Array, Array] :
+def log_resample(time: Array, msd: Array, n_points: int = 100) -> tuple[Array, Array]:
     """
-    Function to calculate the Linear Viscoelastic spectrum from the MSD. If the MSD file is not found, it is calculated, provided the trajectory exists.
+    Function to resample the MSD on a logarithmic time grid. The logarithms of the times and of the MSD are averaged in logarithmic bins, and the bin averages are interpolated on an evenly spaced grid between the first and the last average (which also fills the bins without any point at short times)
 
     Parameters
     -----------
-    fileout: (str)
-        The name of the parent directory
+    time: (Array)
+        The lag times
+    msd: (Array)
+        The MSD values; the non-positive times and values are dropped
+    n_points: (int)
+        The number of points of the logarithmic grid
+
+    Returns
+    -----------
+    log_time: (Array)
+        The evenly spaced logarithms of the grid times
+    log_msd: (Array)
+        The logarithm of the MSD at the grid times
+    """
+    time, msd = np.asarray(time, dtype=np.float64), np.asarray(msd, dtype=np.float64)
+    positive = (time > 0) & (msd > 0)
+    log_t, log_r2 = np.log(time[positive]), np.log(msd[positive])
+
+    if len(log_t) < 2:
+        raise ValueError("The MSD needs at least two points with positive time and value")
+
+    log_bins = np.linspace(log_t.min(), log_t.max(), n_points)
+    index = np.clip(np.rint((log_t - log_bins[0]) / (log_bins[1] - log_bins[0])).astype(np.intp), 0, n_points - 1)
+
+    counts = np.bincount(index, minlength=n_points)
+    filled = counts > 0
+    mean_log_t = np.bincount(index, weights=log_t, minlength=n_points)[filled] / counts[filled]
+    mean_log_r2 = np.bincount(index, weights=log_r2, minlength=n_points)[filled] / counts[filled]
+
+    log_time = np.linspace(mean_log_t[0], mean_log_t[-1], n_points)
+
+    return log_time, np.interp(log_time, mean_log_t, mean_log_r2)
+
+
+def local_power_law(log_time: Array, log_msd: Array, window: int = 7, polynomial_order: int = 2) -> tuple[Array, Array]:
+    """
+    Function to fit a polynomial in log space in a sliding window around every point of the MSD. The fits of all the windows are solved at once; at the edges the windows are shifted inside the data
+
+    Parameters
+    -----------
+    log_time: (Array)
+        The logarithms of the times
+    log_msd: (Array)
+        The logarithms of the MSD
+    window: (int)
+        The number of points of every window (reduced to the number of points if larger)
+    polynomial_order: (int)
+        The order of the fitted polynomial
+
+    Returns
+    -----------
+    log_msd_fit: (Array)
+        The fitted logarithm of the MSD at every point
+    alpha: (Array)
+        The local slope d log(MSD) / d log(t) at every point
+    """
+    n_points = len(log_time)
+    window = min(max(int(window), polynomial_order + 1), n_points)
+
+    # The window of every point, centered where possible
+    start = np.clip(np.arange(n_points) - window // 2, 0, n_points - window)
+    window_index = start[:, np.newaxis] + np.arange(window)
+
+    # Polynomials in the time offsets from the fitted point, so the first two coefficients are the value and the slope there
+    offsets = log_time[window_index] - log_time[:, np.newaxis]
+    vandermonde = offsets[..., np.newaxis] ** np.arange(polynomial_order + 1)
+    coefficients = np.einsum('nkw,nw->nk', np.linalg.pinv(vandermonde), log_msd[window_index])
+
+    return coefficients[:, 0], coefficients[:, 1]
+
+
+def lve_from_msd(time: Array, msd: Array, n_points: int = 100, window: int = 7, polynomial_order: int = 2) -> tuple[Array, Array, Array, Array]:
+    """
+    Function to calculate the Linear Viscoelastic spectrum from the MSD with the generalized Stokes-Einstein relation, using the local power law approximation of Mason: G*(w) = 1 / (pi a MSD(1/w) Gamma(1 + alpha)), with the local slope alpha from sliding polynomial fits of the log resampled MSD
+
+    Parameters
+    -----------
+    time: (Array)
+        The lag times (normalized by tb)
+    msd: (Array)
+        The MSD values
+    n_points: (int)
+        The number of points of the logarithmic grid
+    window: (int)
+        The number of grid points of every local fit
+    polynomial_order: (int)
+        The order of the local fits
 
     Returns
     -----------
     omega: (Array)
-        The values of the angular frequency (normalized by tb)
+        The values of the angular frequency (normalized by tb), in increasing order
     Gp: (Array)
         The normalized storage modulus values
     Gdp: (Array)
         The normalized loss modulus values
+    alpha: (Array)
+        The local slope of the MSD
     """
-    # Constants
-    pi = np.pi
+    from scipy.special import gamma
+
+    # Particle radius
     a = 1
 
-    # Load data (text format)
-    try:
-        data = np.loadtxt("MSD"+fileout+".dat", skiprows=1)
-    except FileNotFoundError:
-        print("MSD file not found. Calculating now...")
+    log_time, log_msd = log_resample(time, msd, n_points)
+    log_msd_fit, alpha = local_power_law(log_time, log_msd, window, polynomial_order)
+
+    Gstar = 1.0 / (np.pi * a * np.exp(log_msd_fit) * gamma(1 + alpha))
+    Gp = np.abs(Gstar) * np.cos(np.pi * alpha / 2)
+    Gdp = np.abs(Gstar) * np.sin(np.pi * alpha / 2)
+
+    return np.exp(-log_time)[::-1], Gp[::-1], Gdp[::-1], alpha[::-1]
 
-        trajectory, _, _, _ = load_and_check(False)
-        input_params = simulation_parameters(trajectory)
-        calculate_msd(trajectory, input_params, fileout)
 
-        print("MSD calculated!")
+def msd_to_lve(fileout: str,
+               output_format: str = "text",
+               directory: str = ".",
+               n_points: int = 100,
+               window: int = 7,
+               polynomial_order: int = 2,
+               *,
+               msd_data: tuple | None = None) -> tuple[Array, Array, Array] :
+    """
+    Function to calculate the Linear Viscoelastic spectrum from the MSD. Without the MSD of the pipeline, it is read from the MSD file, or calculated if the file is not found, provided the trajectory exists.
+
+    Parameters
+    -----------
+    fileout: (str)
+        The name of the parent directory
+    output_format: (str)
+        The format of the output file ("text" or "npz"). The MSD is read in either format
+    directory: (str)
+        The simulation directory, where the MSD is read and the output file is written
+    n_points: (int)
+        The number of points of the logarithmic grid on which the MSD is resampled
+    window: (int)
+        The number of grid points of every local power law fit
+    polynomial_order: (int)
+        The order of the local fits
+    msd_data: (tuple)
+        The lag times (normalized by tb) and the MSD values, as returned by msd.calculate_msd. If None, the MSD is read from the file of the windowed MSD
+
+    Returns
+    -----------
+    omega: (Array)
+        The values of the angular frequency (normalized by tb)
+    Gp: (Array)
+        The normalized storage modulus values
+    Gdp: (Array)
+        The normalized loss modulus values
+    """
+    if msd_data is None:
+        # Load data (text or binary format)
         try:
-            data = np.loadtxt("MSD"+fileout+".dat", skiprows=1)
+            msd_data = list(read_output("MSD"+fileout, directory).values())[:2]
         except FileNotFoundError:
-            print("MSD file still not found. Something else is wrong. Abort!")
-            exit()
-    # Transpose the data to read them properly
-    data = np.transpose(data)
-
-    time = data[0]
-    del_r2 = data[1]
-
-    # Preallocate arrays
-    alpha = []
-    omega = []
-    x_vals = []
-    Gstar = []
-
-    # Compute alpha, omega, x, and Gstar
-    for i in range(1, len(time) - 1):
-        log_ratio_r2 = np.log(del_r2[i + 1] / del_r2[i - 1])
-        log_ratio_time = np.log(time[i + 1] / time[i - 1])
-        alpha_val = log_ratio_r2 / log_ratio_time
-        alpha.append(alpha_val)
-        
-        omega_val = 1 / time[i]
-        omega.append(omega_val)
-        
-        x = 1 + alpha_val
-        x_vals.append(x)
-        
-        Gstar_val = 1.0 / (pi * a * del_r2[i] * gamma(x))
-        Gstar.append(Gstar_val)
-
-    # Compute G' and G''
-    Gp = [abs(G) * np.cos(pi * a_val / 2) for G, a_val in zip(Gstar, alpha)]
-    Gdp = [abs(G) * np.sin(pi * a_val / 2) for G, a_val in zip(Gstar, alpha)]
-
-    # Convert to NumPy arrays for easier handling
-    omega = np.array(omega)
-    Gp = np.array(Gp)
-    Gdp = np.array(Gdp)
+            print("MSD file not found. Calculating now...")
+
+            trajectory, _, _, _ = load_and_check(False, False, directory=directory)
+            input_params = simulation_parameters(trajectory, directory)
+            msd_data = calculate_msd(trajectory, input_params, True, fileout, directory=directory)
+
+            print("MSD calculated!")
+
+    time, del_r2 = msd_data
+
+    omega, Gp, Gdp, alpha = lve_from_msd(time, del_r2, n_points, window, polynomial_order)
 
     # Write the output in a file
-    file = open("LVEfromMSD"+fileout+".dat","w+")
-    file.write("\g(w)   Gp   Gpp\n")
-    for i in range(len(omega)):
-        file.write(str(omega[i])+"   "+str(Gp[i])+"   "+str(Gdp[i])+"\n")
-    file.close
+    write_output("LVEfromMSD"+fileout, r"\g(w)   Gp   Gpp   \g(a)", {"omega": omega, "Gp": Gp, "Gpp": Gdp, "alpha": alpha},
+                 comments=[f"Local power law fits of order {polynomial_order} over {window} of {n_points} log spaced points"],
+                 output_format=output_format, directory=directory)
 
     return omega, Gp, Gdp
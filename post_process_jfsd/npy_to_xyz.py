@@ -1,28 +1,123 @@
+import numpy as np
 from numpy import ndarray as Array
+import struct
+import os
 
-def npy_to_xyz(trajectory: Array, fileout: str, atom_type='C'):
+from post_process_jfsd.utils import frame_selection, frame_chunks
+
+
+def write_dcd_header(f, n_frames: int, n_atoms: int, first_frame: int, stride: int, title: str):
+    """
+    Writes the header of a CHARMM/NAMD style .dcd file (little endian, with unit cell)
+
+    Parameters:
+        f: (file)
+            The binary output file
+        n_frames: (int)
+            Number of frames in the file
+        n_atoms: (int)
+            Number of atoms per frame
+        first_frame: (int)
+            The index of the first written frame
+        stride: (int)
+            The step between the written frames
+        title: (str)
+            Title line stored in the file
+    """
+    control = [0] * 20
+    control[0] = n_frames       # NSET
+    control[1] = first_frame    # ISTART
+    control[2] = stride         # NSAVC
+    control[10] = 1             # unit cell in every frame
+    control[19] = 24            # CHARMM version
+
+    header = b"CORD" + struct.pack("<9i", *control[:9]) + struct.pack("<f", 1.0) + struct.pack("<10i", *control[10:])
+    f.write(struct.pack("<i", len(header)) + header + struct.pack("<i", len(header)))
+
+    title_record = struct.pack("<i", 1) + title.encode("ascii", "replace")[:80].ljust(80)
+    f.write(struct.pack("<i", len(title_record)) + title_record + struct.pack("<i", len(title_record)))
+
+    f.write(struct.pack("<3i", 4, n_atoms, 4))
+
+
+def write_dcd_frames(f, positions: Array, box_length: float):
     """
-    Converts a .npy trajectory to an .xyz file.
+    Writes a chunk of frames to a .dcd file
 
     Parameters:
-        trajectory: (Array) 
+        f: (file)
+            The binary output file
+        positions: (Array)
+            The positions of the chunk of frames; has dimensions (n_frames, n_atoms, 3)
+        box_length: (float)
+            The length of the cubic box
+    """
+    n_atoms = positions.shape[1]
+    cell = struct.pack("<i6di", 48, box_length, 90.0, box_length, 90.0, 90.0, box_length, 48)
+    marker = struct.pack("<i", 4 * n_atoms)
+
+    for frame in positions.astype("<f4"):
+        f.write(cell)
+        for axis in range(3):
+            f.write(marker + np.ascontiguousarray(frame[:, axis]).tobytes() + marker)
+
+
+def npy_to_xyz(trajectory: Array,
+               fileout: str,
+               atom_type='C',
+               frame_range: list | None = None,
+               stride: int = 1,
+               file_format: str = "xyz",
+               box_length: float | None = None,
+               chunk_size: int = 100,
+               directory: str = "."):
+    """
+    Converts a .npy trajectory to an .xyz file, or to a binary .dcd file. The trajectory is read and written in chunks of frames, so it can be memory-mapped
+
+    Parameters:
+        trajectory: (Array)
             The input trajectory
-        fileout: (str) 
+        fileout: (str)
             Name of the parent directory
-        atom_type: (str) 
+        atom_type: (str)
             Atom type to label in the XYZ file (default: 'C').
+        frame_range: (list)
+            The [start, stop] frames to be written. If None or empty, all frames are written
+        stride: (int)
+            The step between the written frames
+        file_format: (str)
+            "xyz" for a text .xyz file or "dcd" for a binary (single precision) .dcd file, readable by OVITO and VMD
+        box_length: (float)
+            The length of the cubic box, stored in the .dcd frames
+        chunk_size: (int)
+            The number of frames read and written at once
+        directory: (str)
+            The simulation directory, where the file is written
     """
-    
-    frames, atoms, _ = trajectory.shape
 
-    with open(fileout+".xyz", 'w') as f:
-        for frame in range(frames):
-            f.write(f"{atoms}\n")
-            f.write(f"Frame {frame + 1}\n")
-            for atom in range(atoms):
-                x, y, z = trajectory[frame][atom]
-                f.write(f"{atom_type} {x:.3f} {y:.3f} {z:.3f}\n")
+    frames = frame_selection(trajectory.shape[0], frame_range, stride)
+    atoms = trajectory.shape[1]
+
+    if file_format == "xyz":
+        atom_format = f"{atom_type} %.3f %.3f %.3f\n" * atoms
+
+        with open(os.path.join(directory, fileout+".xyz"), 'w') as f:
+            for chunk in frame_chunks(len(frames), chunk_size):
+                for frame, positions in zip(frames[chunk], np.asarray(trajectory[frames[chunk]])):
+                    f.write(f"{atoms}\n")
+                    f.write(f"Frame {frame + 1}\n")
+                    f.write(atom_format % tuple(positions.ravel()))
+
+    elif file_format == "dcd":
+        if box_length is None:
+            raise ValueError("The box length is needed for the .dcd file")
+
+        with open(os.path.join(directory, fileout+".dcd"), 'wb') as f:
+            write_dcd_header(f, len(frames), atoms, int(frames[0]), int(stride), f"{fileout} post_process_jfsd")
+            for chunk in frame_chunks(len(frames), chunk_size):
+                write_dcd_frames(f, np.asarray(trajectory[frames[chunk]]), box_length)
 
-    f.close
+    else:
+        raise ValueError(f"Unknown trajectory file format {file_format}. Use 'xyz' or 'dcd'")
 
-    return
\ No newline at end of file
+    return
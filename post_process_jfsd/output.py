@@ -0,0 +1,151 @@
+import numpy as np
+from numpy import ndarray as Array
+import os
+
+
+# Number of rows formatted at once by the text writer
+TEXT_CHUNK_ROWS = 100000
+
+
+def _write_text(name: str, header: str, columns: dict, metadata: dict, comments: list) -> str:
+    """
+    Text backend: whitespace separated columns with the column header in the first line (after optional comment lines). The values are written with the shortest representation that reads back to the same double, as the npz backend
+    """
+    filename = name + ".dat"
+    data = np.column_stack([np.asarray(column, dtype=np.float64) for column in columns.values()]) if columns else np.zeros((0, 0))
+    row_format = "   ".join(["%r"] * data.shape[1]) + "\n"
+
+    with open(filename, "w+") as file:
+        for comment in comments:
+            file.write("# " + comment + "\n")
+        file.write(header + "\n")
+
+        # Format many rows with a single string operation
+        for start in range(0, data.shape[0], TEXT_CHUNK_ROWS):
+            chunk = data[start:start + TEXT_CHUNK_ROWS]
+            file.write((row_format * chunk.shape[0]) % tuple(chunk.ravel().tolist()))
+
+    return filename
+
+
+def _write_npz(name: str, header: str, columns: dict, metadata: dict, comments: list) -> str:
+    """
+    Binary backend: every column is an array of an .npz file, together with the metadata
+    """
+    filename = name + ".npz"
+
+    arrays = {key: np.asarray(column) for key, column in columns.items()}
+    arrays.update({"meta_" + key: np.asarray(value) for key, value in metadata.items()})
+    arrays["header"] = np.asarray(header)
+    arrays["comments"] = np.asarray(comments, dtype=str)
+
+    np.savez(filename, **arrays)
+
+    return filename
+
+
+# The available output backends
+WRITERS = {
+    "text": _write_text,
+    "npz": _write_npz,
+}
+
+
+def output_metadata(input_params: tuple) -> dict:
+    """
+    A helper function to collect the simulation parameters stored with the binary outputs
+
+    Parameters
+    ----------
+    input_params: (tuple)
+        The simulation parameters
+
+    Returns
+    ----------
+    metadata: (dict)
+        The scalar simulation parameters
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    return dict(n_steps=n_steps, N=N, dt=dt, period=period, kT=kT, shear_rate=shear_rate, box_length=box_length, tb=tb)
+
+
+def write_output(name: str,
+                 header: str,
+                 columns: dict,
+                 input_params: tuple | None = None,
+                 output_format: str = "text",
+                 comments: list | None = None,
+                 directory: str = ".") -> str:
+    """
+    A function to write the columns of an analysis result with the selected output backend
+
+    Parameters
+    ----------
+    name: (str)
+        The file name without the extension (e.g. "AVST"+fileout)
+    header: (str)
+        The column header line of the text file
+    columns: (dict)
+        The columns of the output, by their name. All columns should have the same length
+    input_params: (tuple)
+        The simulation parameters, stored as metadata by the binary backend
+    output_format: (str)
+        The output backend, one of WRITERS ("text" or "npz")
+    comments: (list)
+        Extra lines of information (e.g. the number of averaged frames)
+    directory: (str)
+        The directory where the file is written
+
+    Returns
+    ----------
+    filename: (str)
+        The name of the written file
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format {output_format}. Available formats are {list(WRITERS)}")
+
+    metadata = output_metadata(input_params) if input_params is not None else {}
+
+    return WRITERS[output_format](os.path.join(directory, name), header, columns, metadata, comments or [])
+
+
+def read_output(name: str, directory: str = ".") -> dict:
+    """
+    A function to read back an output written by write_output, with either backend
+
+    Parameters
+    ----------
+    name: (str)
+        The file name without the extension
+    directory: (str)
+        The directory of the file
+
+    Returns
+    ----------
+    columns: (dict)
+        The columns of the output. For text files the columns are named by their position ("0", "1", ...)
+    """
+    name = os.path.join(directory, name)
+
+    if os.path.exists(name + ".npz"):
+        with np.load(name + ".npz") as data:
+            return {key: data[key] for key in data.files if not key.startswith("meta_") and key not in ("header", "comments")}
+
+    data = np.loadtxt(name + ".dat", comments="#", skiprows=_comment_lines(name + ".dat") + 1, ndmin=2)
+
+    return {str(i): column for i, column in enumerate(data.T)}
+
+
+def _comment_lines(filename: str) -> int:
+    """
+    The number of comment lines before the header of a text output
+    """
+    n_comments = 0
+    with open(filename) as file:
+        for line in file:
+            if not line.startswith("#"):
+                break
+            n_comments += 1
+
+    return n_comments
@@ -0,0 +1,134 @@
+from typing import Callable, NamedTuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from post_process_jfsd.utils import share_array, open_source
+from post_process_jfsd.instrumentation import measure_stage
+
+
+class Task(NamedTuple):
+    """
+    An analysis of the post processing pipeline
+
+    The function is called as function(*inputs, *args, **kwargs), where the inputs are the loaded arrays ("trajectory", "stresslet", "velocities") or the results of other tasks, given by their names
+    """
+    name: str
+    function: Callable
+    inputs: tuple = ()
+    args: tuple = ()
+    kwargs: dict | None = None # None for no keyword arguments (a dict default would be shared by all tasks)
+    depends: tuple = () # Tasks that have to finish first, without using their results
+    message: str = ""
+
+
+def _run_task(task: Task, inputs: list, measure: bool = False, profile_file: str | None = None):
+    """
+    Runs a task in a worker process, opening the shared arrays of its inputs. Returns the result and the measurement of the task (None if not measured)
+    """
+    if task.message:
+        print(task.message)
+
+    arrays = [open_source(source)[:n_frames] if n_frames is not None else source for source, n_frames in inputs]
+
+    records = [] if measure else None
+    with measure_stage(task.name, records, profile_file):
+        result = task.function(*arrays, *task.args, **(task.kwargs or {}))
+
+    return result, records[0] if measure else None
+
+
+def _check_tasks(tasks: list[Task], arrays: dict):
+    """
+    Checks that every input and dependency of the tasks exists and that there are no cycles
+    """
+    names = [task.name for task in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Task names should be unique, got {names}")
+
+    for task in tasks:
+        for requirement in task.inputs + task.depends:
+            if requirement not in names and requirement not in arrays:
+                raise ValueError(f"Task {task.name} needs {requirement}, which is neither a loaded array nor a task")
+            if requirement in arrays and arrays[requirement] is None:
+                raise ValueError(f"Task {task.name} needs {requirement}, which was not loaded")
+
+    done = set(arrays)
+    remaining = list(tasks)
+    while remaining:
+        ready = [task for task in remaining if set(task.inputs + task.depends) <= done]
+        if not ready:
+            raise ValueError(f"The tasks {[task.name for task in remaining]} have circular dependencies")
+        done.update(task.name for task in ready)
+        remaining = [task for task in remaining if task not in ready]
+
+
+def run_tasks(tasks: list[Task], arrays: dict, n_workers: int = 1, records: list | None = None, profile: dict | None = None) -> dict:
+    """
+    Runs the analyses of the pipeline, respecting their dependencies. With more than one worker, the independent tasks run at the same time in a process pool, and the loaded arrays are shared through their memory-mapped files or shared memory
+
+    Parameters
+    ----------
+    tasks: (list)
+        The tasks to be executed
+    arrays: (dict)
+        The loaded arrays by name ("trajectory", "stresslet", "velocities"), can be None if not loaded
+    n_workers: (int)
+        The number of worker processes. With one worker the tasks are executed in order in this process
+    records: (list)
+        If given, the measurement of every task (see instrumentation.measure_stage) is appended to it, in the order the tasks finish
+    profile: (dict)
+        The tasks that run under cProfile, with the name of their profile file
+
+    Returns
+    ----------
+    results: (dict)
+        The return value of every task, by its name
+    """
+    _check_tasks(tasks, arrays)
+
+    profile = profile or {}
+    results = {}
+    remaining = list(tasks)
+
+    if n_workers <= 1:
+        while remaining:
+            task = next(task for task in remaining if all(name in results or name in arrays for name in task.inputs + task.depends))
+            if task.message:
+                print(task.message)
+            inputs = [arrays[name] if name in arrays else results[name] for name in task.inputs]
+            with measure_stage(task.name, records, profile.get(task.name)):
+                results[task.name] = task.function(*inputs, *task.args, **(task.kwargs or {}))
+            remaining.remove(task)
+
+        return results
+
+    # Share every loaded array that a task needs only once
+    needed = {name for task in tasks for name in task.inputs if name in arrays}
+    sources = {}
+    shared_blocks = []
+    for name in needed:
+        source, shared_block = share_array(arrays[name])
+        sources[name] = (source, len(arrays[name]))
+        if shared_block is not None:
+            shared_blocks.append(shared_block)
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            running = {}
+            while remaining or running:
+                # Submit every task whose inputs and dependencies are finished
+                for task in [task for task in remaining if all(name in results or name in arrays for name in task.inputs + task.depends)]:
+                    inputs = [sources[name] if name in arrays else (results[name], None) for name in task.inputs]
+                    running[executor.submit(_run_task, task, inputs, records is not None, profile.get(task.name))] = task
+                    remaining.remove(task)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[running.pop(future).name], record = future.result()
+                    if record is not None:
+                        records.append(record)
+    finally:
+        for shared_block in shared_blocks:
+            shared_block.close()
+            shared_block.unlink()
+
+    return results
@@ -0,0 +1,270 @@
+import numpy as np
+from numpy import ndarray as Array
+from concurrent.futures import ProcessPoolExecutor
+import warnings
+
+from post_process_jfsd.utils import frame_selection, array_source, open_source, compute_dtype
+from post_process_jfsd.gofr_2d import pair_vectors, gofxy_from_pairs
+from post_process_jfsd.output import write_output
+
+
+def evolution_frames(n_frames: int,
+                     frames: list | None = None,
+                     frame_range: list | None = None,
+                     stride: int = 1,
+                     n_log_frames: int = 0) -> Array:
+    """
+    A helper function to get the frames of a time-resolved analysis: an explicit list, a frame range with a stride, or log-spaced frames within the frame range
+
+    Parameters
+    ----------
+    n_frames: (int)
+        The total number of (non-zero) frames
+    frames: (list)
+        The explicit frame indices (negative values count from the end). If None or empty, the frames are taken from the frame range
+    frame_range: (list)
+        The [start, stop] frames of the range, following the python slicing conventions. If None or empty, all frames are used
+    stride: (int)
+        The step between the frames of the range (ignored for log-spaced frames)
+    n_log_frames: (int)
+        If larger than 0, the number of log-spaced frames in the range (fewer if the log-spaced indices coincide); the first frame of the range is always included
+
+    Returns
+    ----------
+    frames: (Array)
+        The sorted, unique indices of the selected frames
+    """
+    if frames:
+        frames = np.asarray(frames, dtype=int)
+        if np.any(frames >= n_frames) or np.any(frames < -n_frames):
+            raise ValueError(f"Selected frames {list(frames)} are out of range. Last frame has index {n_frames - 1}")
+        return np.unique(np.arange(n_frames)[frames])
+
+    if n_log_frames > 0:
+        frames = frame_selection(n_frames, frame_range, 1)
+        if len(frames) == 1 or n_log_frames == 1:
+            return frames[:1]
+        offsets = np.rint(np.geomspace(1, len(frames) - 1, n_log_frames - 1)).astype(int)
+        return frames[np.unique(np.concatenate(([0], offsets)))]
+
+    return frame_selection(n_frames, frame_range, stride)
+
+
+def frame_windows(frames: Array, window: int, last_frame_index: int) -> list:
+    """
+    A helper function to get the frames averaged around every selected frame
+
+    Parameters
+    ----------
+    frames: (Array)
+        The selected frames
+    window: (int)
+        The number of frames averaged on each side of a selected frame
+    last_frame_index: (int)
+        The last non zero frame of the simulation; the windows are clamped to [0, last_frame_index]
+
+    Returns
+    ----------
+    windows: (list)
+        The frames of the window of every selected frame
+    """
+    window = max(int(window), 0)
+
+    return [np.arange(max(frame - window, 0), min(frame + window, last_frame_index) + 1) for frame in frames]
+
+
+def structure_for_windows(source: str | Array,
+                          windows: list,
+                          n_steps: int,
+                          box_length: float,
+                          r_bins: Array,
+                          x_bins: Array,
+                          y_bins: Array,
+                          slice_width: float,
+                          dtype: type = np.float64) -> tuple[Array, Array]:
+    """
+    A function to calculate the g(r) and the gofxy averaged over every window of frames. A single neighbour query per frame serves both, and a frame shared by overlapping windows is evaluated only once
+
+    Parameters
+    ----------
+    source: (str | Array)
+        The trajectory, or the file name of the memory-mapped trajectory (see utils.array_source)
+    windows: (list)
+        The frames averaged for every entry of the stack
+    n_steps: (int)
+        The number of frames of the trajectory (a memory-mapped file can have more, unwritten frames)
+    box_length: (float)
+        The length of the cubic box
+    r_bins: (Array)
+        The edges of the radial bins, starting at 0
+    x_bins: (Array)
+        The edges of the x bins of the gofxy
+    y_bins: (Array)
+        The edges of the y bins of the gofxy
+    slice_width: (float)
+        The width of the z-axis slice of the gofxy
+    dtype: (type)
+        The floating point type of the positions and distance vectors
+
+    Returns
+    ----------
+    gofr_stack: (Array)
+        The g(r) of every window; has dimensions (len(windows), len(r_bins) - 1)
+    gofxy_stack: (Array)
+        The gofxy of every window; has dimensions (len(windows), len(x_bins) - 1, len(y_bins) - 1)
+    """
+    import freud
+
+    trajectory = open_source(source)[:n_steps]
+    box = freud.box.Box.cube(box_length)
+
+    # The periodic query reaches just below half of the box, which can leave the gofxy corners incomplete (see gofr_2d.gofxy_for_frame)
+    r_max = min(max(r_bins[-1], np.sqrt(x_bins[-1]**2 + y_bins[-1]**2 + slice_width**2)), 0.5 * box_length * (1.0 - 1e-6))
+    shell_volumes = 4.0 / 3.0 * np.pi * (r_bins[1:]**3 - r_bins[:-1]**3)
+
+    # The histograms of every frame of the windows
+    per_frame = {}
+    for frame in np.unique(np.concatenate(windows)):
+        positions = np.asarray(trajectory[frame], dtype=dtype)
+        N = len(positions)
+
+        i, distance_vectors = pair_vectors(positions, box, r_max)
+
+        # Every pair is counted from both particles, normalized by the ideal gas at the particle density (as freud.density.RDF)
+        pair_counts = np.histogram(np.linalg.norm(distance_vectors, axis=1), bins=r_bins)[0]
+        gofr = pair_counts / (N * N / box_length**3 * shell_volumes)
+
+        per_frame[frame] = (gofr,) + gofxy_from_pairs(i, distance_vectors, N, x_bins, y_bins, slice_width)
+
+    gofr_stack = np.array([np.mean([per_frame[frame][0] for frame in window], axis=0) for window in windows])
+    gofxy_stack = np.array([sum(per_frame[frame][1] for frame in window) / max(sum(per_frame[frame][2] for frame in window), 1)
+                            for window in windows])
+
+    return gofr_stack, gofxy_stack
+
+
+def structure_evolution(trajectory: Array,
+                        last_frame_index: int,
+                        input_params: tuple,
+                        fileout: str,
+                        N_gofr_bins: int,
+                        r_max: float,
+                        N_gofxy_bins: int,
+                        Xmax: float,
+                        Ymax: float,
+                        slice_width: float,
+                        frames: list | None = None,
+                        frame_range: list | None = None,
+                        stride: int = 1,
+                        n_log_frames: int = 0,
+                        window: int = 0,
+                        n_workers: int = 1,
+                        directory: str = ".",
+                        precision: str = "float64") -> tuple[Array, Array, Array]:
+    """
+    A function to calculate the time evolution of the g(r) and of the gofxy for a set of frames, optionally averaged over a window of frames around each of them. All results are stored as stacked arrays in a single .npz file, together with the frames, their times and strains
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The input trajectory
+    last_frame_index: (int)
+        The last non zero frame of the simulation
+    input_params: (tuple)
+        The simulation parameters
+    fileout: (str)
+        The name of the parent directory
+    N_gofr_bins: (int)
+        Number of g(r) bins
+    r_max: (float)
+        Maximum r for g(r) calculation
+    N_gofxy_bins: (int)
+        The number of bin edges for each axis of the gofxy (as in gofr_2d.gofxy_image)
+    Xmax: (float)
+        The maximum x value of the gofxy (total range [-Xmax, Xmax])
+    Ymax: (float)
+        The maximum y value of the gofxy (total range [-Ymax, Ymax])
+    slice_width: (float)
+        The width of the z-axis slice for which the gofxy is calculated
+    frames: (list)
+        The explicit frames of the evolution. If None or empty, the frames are taken from the frame range
+    frame_range: (list)
+        The [start, stop] frames of the evolution. If None or empty, all frames are used
+    stride: (int)
+        The step between the frames of the range
+    n_log_frames: (int)
+        If larger than 0, the number of log-spaced frames in the range, instead of the stride
+    window: (int)
+        The number of frames averaged on each side of every frame
+    n_workers: (int)
+        The number of worker processes sharing the frames
+    directory: (str)
+        The simulation directory, where the output file is written
+    precision: (str)
+        The floating point precision of the distance vectors ("float64" or "float32")
+
+    Returns
+    ----------
+    frames: (Array)
+        The frames of the evolution
+    gofr_stack: (Array)
+        The g(r) of every frame; has dimensions (n_frames, N_gofr_bins)
+    gofxy_stack: (Array)
+        The gofxy of every frame; has dimensions (n_frames, N_gofxy_bins - 1, N_gofxy_bins - 1)
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    dtype = compute_dtype(precision)
+
+    if r_max >= box_length / 2.:
+        raise ValueError(f"r_max cannot be further than half of the box size ({box_length*0.5})")
+    if np.sqrt(Xmax**2 + Ymax**2 + slice_width**2) >= box_length / 2.:
+        warnings.warn(f"The gofxy corners (sqrt(Xmax^2 + Ymax^2 + slice_width^2)) are further than half of the box size ({box_length*0.5}). "
+                      "The pairs beyond it are not counted, so the corners of the gofxy are incomplete. Use smaller Xmax and Ymax for a complete gofxy", RuntimeWarning)
+
+    frames = evolution_frames(last_frame_index + 1, frames, frame_range, stride, n_log_frames)
+    windows = frame_windows(frames, window, last_frame_index)
+
+    r_bins = np.linspace(0.0, r_max, N_gofr_bins + 1)
+    x_bins = np.linspace(-Xmax, Xmax, N_gofxy_bins)
+    y_bins = np.linspace(-Ymax, Ymax, N_gofxy_bins)
+
+    n_workers = min(max(int(n_workers), 1), len(frames))
+
+    if n_workers == 1:
+        gofr_stack, gofxy_stack = structure_for_windows(trajectory, windows, n_steps, box_length, r_bins, x_bins, y_bins, slice_width, dtype)
+    else:
+        # Every worker evaluates a contiguous part of the stack
+        window_sets = np.array_split(np.arange(len(windows)), n_workers)
+        source = array_source(trajectory)
+        if isinstance(source, str):
+            jobs = [(source, [windows[index] for index in window_set]) for window_set in window_sets]
+        else:
+            jobs = []
+            for window_set in window_sets:
+                job_frames = np.unique(np.concatenate([windows[index] for index in window_set]))
+                jobs.append((trajectory[job_frames], [np.searchsorted(job_frames, windows[index]) for index in window_set]))
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(structure_for_windows, job_source, job_windows, n_steps, box_length, r_bins, x_bins, y_bins, slice_width, dtype)
+                       for job_source, job_windows in jobs]
+            partials = [future.result() for future in futures]
+
+        gofr_stack = np.concatenate([partial[0] for partial in partials])
+        gofxy_stack = np.concatenate([partial[1] for partial in partials])
+
+    comments = [f"{len(frames)} frames ({frames[0]} to {frames[-1]}), averaged over {2 * max(int(window), 0) + 1} frames around each (clamped to the trajectory)"]
+
+    # The stacks are stored in a single binary file, whatever the output format of the other analyses
+    write_output("Structureevolution"+fileout, r"frame   t/t\-(B)   \g(g)   r/R   g(r)   x   y   g(x,y)",
+                 {"frames": frames,
+                  "time": time[frames] / tb,
+                  "strain": shear_rate * time[frames],
+                  "window": np.array([[window_frames[0], window_frames[-1]] for window_frames in windows]),
+                  "r": (r_bins[:-1] + r_bins[1:]) / 2.0,
+                  "gofr": gofr_stack,
+                  "x": (x_bins[:-1] + x_bins[1:]) / 2.0,
+                  "y": (y_bins[:-1] + y_bins[1:]) / 2.0,
+                  "gofxy": gofxy_stack},
+                 input_params, "npz", comments=comments, directory=directory)
+
+    return frames, gofr_stack, gofxy_stack
@@ -0,0 +1,329 @@
+import numpy as np
+from numpy import ndarray as Array
+from concurrent.futures import ProcessPoolExecutor
+
+from post_process_jfsd.utils import frame_selection, frame_chunks, array_source, open_source, compute_dtype
+from post_process_jfsd.output import write_output
+
+
+def lees_edwards_coordinates(positions: Array, strain: float, box_length: float, dtype: type = np.float64) -> Array:
+    """
+    A function to get the coordinates of the particles in the sheared periodic cell. With Lees-Edwards boundary conditions the images repeat along (strain * L, L, 0) instead of (0, L, 0), so the x coordinate is taken along the sheared cell, x' = x - strain * y. The system is periodic in (x', y, z) with period L
+
+    Parameters
+    ----------
+    positions: (Array)
+        The positions of the particles in [-box_length/2, box_length/2); has dimensions (N, 3)
+    strain: (float)
+        The accumulated strain of the frame (only its fractional part matters)
+    box_length: (float)
+        The length of the cubic box
+    dtype: (type)
+        The floating point type of the coordinates
+
+    Returns
+    ----------
+    coordinates: (Array)
+        The coordinates in the sheared cell, in [0, 1) units of the box length; has dimensions (N, 3)
+    """
+    offset = strain - np.round(strain)
+
+    coordinates = np.array(positions, dtype=dtype) / box_length + 0.5
+    coordinates[:, 0] -= offset * (coordinates[:, 1] - 0.5)
+
+    return coordinates - np.floor(coordinates)
+
+
+def cic_density(coordinates: Array, n_grid: int) -> Array:
+    """
+    A function to deposit the particles on a periodic grid with the cloud-in-cell scheme: every particle is shared by the 8 grid points around it, with weights linear in the distance
+
+    Parameters
+    ----------
+    coordinates: (Array)
+        The coordinates of the particles in [0, 1) units of the box length; has dimensions (N, 3)
+    n_grid: (int)
+        The number of grid points along each axis
+
+    Returns
+    ----------
+    density: (Array)
+        The number of particles deposited on every grid point; has dimensions (n_grid, n_grid, n_grid)
+    """
+    scaled = coordinates * n_grid
+    lower = np.floor(scaled).astype(np.intp)
+    fraction = scaled - lower
+
+    density = np.zeros(n_grid**3)
+    for corner in np.ndindex(2, 2, 2):
+        index = (lower + corner) % n_grid
+        weights = np.prod(np.where(corner, fraction, 1.0 - fraction), axis=1)
+        density += np.bincount((index[:, 0] * n_grid + index[:, 1]) * n_grid + index[:, 2], weights=weights, minlength=n_grid**3)
+
+    return density.reshape(n_grid, n_grid, n_grid)
+
+
+def grid_wave_numbers(n_grid: int) -> tuple[Array, Array, Array]:
+    """
+    A helper function to get the integer wave numbers of the half-space layout of a real 3D FFT, and the weight of every wave vector in the averages over all wave vectors (the wave vectors of the missing half are the negatives of the others, with the same |rho(q)|^2)
+
+    Parameters
+    ----------
+    n_grid: (int)
+        The number of grid points along each axis
+
+    Returns
+    ----------
+    k_full: (Array)
+        The wave numbers of the two full axes
+    k_half: (Array)
+        The wave numbers of the last (half) axis
+    weights: (Array)
+        The weight of every wave vector; zero for the zero wave vector and the Nyquist wave numbers; has dimensions (n_grid, n_grid, n_grid // 2 + 1)
+    """
+    k_full = np.rint(np.fft.fftfreq(n_grid) * n_grid).astype(int)
+    k_half = np.arange(n_grid // 2 + 1)
+
+    weights = np.full((n_grid, n_grid, len(k_half)), 2.0)
+    weights[:, :, 0] = 1.0
+    nyquist = n_grid // 2
+    weights[np.abs(k_full) == nyquist, :, :] = 0.0
+    weights[:, np.abs(k_full) == nyquist, :] = 0.0
+    weights[:, :, k_half == nyquist] = 0.0
+    weights[0, 0, 0] = 0.0
+
+    return k_full, k_half, weights
+
+
+def density_modes(coordinates: Array, n_grid: int, direct_sum: bool = False) -> Array:
+    """
+    A function to get the Fourier modes rho(k) = sum_j exp(-2 pi i k . s_j) of the particle density, on the wave numbers of grid_wave_numbers
+
+    Parameters
+    ----------
+    coordinates: (Array)
+        The coordinates s_j of the particles in [0, 1) units of the box length; has dimensions (N, 3)
+    n_grid: (int)
+        The number of grid points along each axis
+    direct_sum: (bool)
+        Flag whether the modes are summed exactly over the particles (O(N M^3), for checks with small systems) instead of the FFTs of the cloud-in-cell density on two interlaced grids (O(M^3 log M))
+
+    Returns
+    ----------
+    rho: (Array)
+        The density modes; has dimensions (n_grid, n_grid, n_grid // 2 + 1)
+    """
+    k_full, k_half, _ = grid_wave_numbers(n_grid)
+
+    if direct_sum:
+        # The exponential factorizes over the three axes
+        phases = [np.exp(-2j * np.pi * np.outer(coordinates[:, axis], k)) for axis, k in enumerate((k_full, k_full, k_half))]
+        return np.einsum('ja,jb,jc->abc', *phases, optimize=True)
+
+    from scipy.fft import rfftn
+
+    # A second grid shifted by half a grid spacing cancels the leading aliased images of the first one (interlacing)
+    shift = np.exp(1j * np.pi * (k_full[:, np.newaxis, np.newaxis] + k_full[np.newaxis, :, np.newaxis] + k_half[np.newaxis, np.newaxis, :]) / n_grid)
+    rho = 0.5 * (rfftn(cic_density(coordinates, n_grid)) + shift * rfftn(cic_density((coordinates + 0.5 / n_grid) % 1.0, n_grid)))
+
+    # Divide by the Fourier transform of the cloud-in-cell window
+    window = np.sinc(k_full / n_grid)**2
+    window = window[:, np.newaxis, np.newaxis] * window[np.newaxis, :, np.newaxis] * (np.sinc(k_half / n_grid)**2)[np.newaxis, np.newaxis, :]
+
+    return rho / window
+
+
+def structure_factor_for_frames(source: str | Array,
+                                frames: Array,
+                                strains: Array,
+                                box_length: float,
+                                n_grid: int,
+                                N_sq_bins: int,
+                                direct_sum: bool = False,
+                                chunk_size: int = 100,
+                                dtype: type = np.float64) -> tuple[Array, Array, Array, Array]:
+    """
+    A function to accumulate the static structure factor S(q) = |rho(q)|^2 / N of frames, binned by |q| and on the shear (qx, qy) plane
+
+    Parameters
+    ----------
+    source: (str | Array)
+        The trajectory, or the file name of the memory-mapped trajectory (see utils.array_source)
+    frames: (Array)
+        The indices of the accumulated frames
+    strains: (Array)
+        The accumulated strain of every accumulated frame
+    box_length: (float)
+        The length of the cubic box
+    n_grid: (int)
+        The number of grid points along each axis
+    N_sq_bins: (int)
+        The number of |q| bins, from 0 to the Nyquist wave number pi * n_grid / box_length
+    direct_sum: (bool)
+        Flag whether the density modes are summed exactly over the particles (see density_modes)
+    chunk_size: (int)
+        The number of frames read at once
+    dtype: (type)
+        The floating point type of the positions and the coordinates in the sheared cell. The grid density and the sums are in double precision
+
+    Returns
+    ----------
+    radial_sums: (Array)
+        The weighted sums of S(q) in every |q| bin
+    radial_weights: (Array)
+        The summed weights of the wave vectors in every |q| bin
+    plane_sums: (Array)
+        The sums of S(q) in the qz = 0 plane, on a (qx, qy) grid with spacing 2 pi / box_length and wave numbers -n_grid/2 + 1 to n_grid/2 - 1
+    plane_counts: (Array)
+        The number of wave vectors in every (qx, qy) bin
+    """
+    trajectory = open_source(source)
+    k_full, k_half, weights = grid_wave_numbers(n_grid)
+    k_x, k_y, k_z = np.meshgrid(k_full, k_full, k_half, indexing='ij')
+    dq = 2.0 * np.pi / box_length
+    q_max = np.pi * n_grid / box_length
+
+    radial_sums, radial_weights = np.zeros(N_sq_bins), np.zeros(N_sq_bins)
+    n_plane = 2 * (n_grid // 2) - 1
+    plane_sums, plane_counts = np.zeros(n_plane**2), np.zeros(n_plane**2)
+    in_plane = (k_z[:, :, 0] == 0) & (weights[:, :, 0] > 0)
+
+    for chunk in frame_chunks(len(frames), chunk_size):
+        positions_chunk = np.asarray(trajectory[frames[chunk]], dtype=dtype)
+
+        for positions, strain in zip(positions_chunk, strains[chunk]):
+            N = positions.shape[0]
+            coordinates = lees_edwards_coordinates(positions, strain, box_length, dtype)
+            sq = np.abs(density_modes(coordinates, n_grid, direct_sum))**2 / N
+
+            # The wave vectors of the sheared cell
+            offset = strain - np.round(strain)
+            q_x, q_y, q_z = dq * k_x, dq * (k_y - offset * k_x), dq * k_z
+            q = np.sqrt(q_x**2 + q_y**2 + q_z**2)
+
+            index = np.minimum((q / q_max * N_sq_bins).astype(np.intp), N_sq_bins)
+            frame_weights = np.where(q < q_max, weights, 0.0).ravel()
+            radial_sums += np.bincount(index.ravel(), weights=frame_weights * sq.ravel(), minlength=N_sq_bins + 1)[:N_sq_bins]
+            radial_weights += np.bincount(index.ravel(), weights=frame_weights, minlength=N_sq_bins + 1)[:N_sq_bins]
+
+            # The qz = 0 plane on a regular (qx, qy) grid
+            i_x = np.rint(q_x[:, :, 0][in_plane] / dq).astype(np.intp) + n_plane // 2
+            i_y = np.rint(q_y[:, :, 0][in_plane] / dq).astype(np.intp) + n_plane // 2
+            inside = (i_y >= 0) & (i_y < n_plane)
+            plane_index = i_x[inside] * n_plane + i_y[inside]
+            plane_sums += np.bincount(plane_index, weights=sq[:, :, 0][in_plane][inside], minlength=n_plane**2)
+            plane_counts += np.bincount(plane_index, minlength=n_plane**2)
+
+    return radial_sums, radial_weights, plane_sums.reshape(n_plane, n_plane), plane_counts.reshape(n_plane, n_plane)
+
+
+def structure_factor(trajectory: Array,
+                     frame: int,
+                     last_frame_index: int,
+                     input_params: tuple,
+                     fileout: str,
+                     n_grid: int = 64,
+                     N_sq_bins: int = 100,
+                     frame_range: list | None = None,
+                     stride: int = 1,
+                     direct_sum: bool = False,
+                     n_workers: int = 1,
+                     output_format: str = "text",
+                     directory: str = ".",
+                     precision: str = "float64") -> tuple[Array, Array, Array]:
+    """
+    A function to calculate the static structure factor S(q), radially averaged and on the shear (qx, qy) plane, for one frame or averaged over a range of frames. The particle density is deposited on a periodic grid and Fourier transformed, so the cost per frame is O(M^3 log M) for M grid points per axis, independent of the number of particle pairs
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The input trajectory
+    frame: (int)
+        Frame for which S(q) is calculated (if no frame range is given)
+    last_frame_index: (int)
+        The last non zero frame of the simulation
+    input_params: (tuple)
+        The simulation parameters
+    fileout: (str)
+        The name of the parent directory
+    n_grid: (int)
+        The number of grid points along each axis. The largest wave number is pi * n_grid / box_length
+    N_sq_bins: (int)
+        The number of |q| bins
+    frame_range: (list)
+        The [start, stop] frames over which S(q) is averaged. If None or empty, only the given frame is used
+    stride: (int)
+        The step between the averaged frames
+    direct_sum: (bool)
+        Flag whether the density modes are summed exactly over the particles instead of the grid FFT (O(N M^3), only for small systems or as a check)
+    n_workers: (int)
+        The number of worker processes sharing the frames
+    output_format: (str)
+        The format of the output files ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+    precision: (str)
+        The floating point precision of the particle coordinates ("float64" or "float32")
+
+    Returns
+    ----------
+    q_values: (Array)
+        The centers of the |q| bins (normalized by the particle radius)
+    sq: (Array)
+        The radially averaged S(q) (nan for empty bins)
+    sq_plane: (Array)
+        S(qx, qy) in the qz = 0 plane; has dimensions (n_grid - 1, n_grid - 1) for even n_grid
+
+    Notes
+    ----------
+    Under shear the wave vectors of the periodic images follow the sheared Lees-Edwards cell, q = 2 pi / L (k_x, k_y - strain * k_x, k_z), so the |q| of the grid points change from frame to frame. The cloud-in-cell window is divided out; the aliasing of the grid makes S(q) less accurate close to the largest wave number
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    if frame_range:
+        frames = frame_selection(last_frame_index + 1, frame_range, stride)
+    else:
+        if frame > last_frame_index:
+            raise ValueError(f"Selected frame is out of range. Last frame has index {last_frame_index}. Exiting...")
+        frames = np.arange(last_frame_index + 1)[[frame]]
+
+    strains = shear_rate * time[frames]
+    dtype = compute_dtype(precision)
+    n_workers = min(max(int(n_workers), 1), len(frames))
+
+    if n_workers == 1:
+        radial_sums, radial_weights, plane_sums, plane_counts = structure_factor_for_frames(trajectory, frames, strains, box_length, n_grid, N_sq_bins, direct_sum, dtype=dtype)
+    else:
+        # Every worker accumulates its own sums over a contiguous part of the frames
+        frame_sets = np.array_split(np.arange(len(frames)), n_workers)
+        source = array_source(trajectory)
+        if isinstance(source, str):
+            jobs = [(source, frames[frame_set], strains[frame_set]) for frame_set in frame_sets]
+        else:
+            jobs = [(trajectory[frames[frame_set]], np.arange(len(frame_set)), strains[frame_set]) for frame_set in frame_sets]
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(structure_factor_for_frames, job_source, job_frames, job_strains, box_length, n_grid, N_sq_bins, direct_sum, dtype=dtype)
+                       for job_source, job_frames, job_strains in jobs]
+            radial_sums, radial_weights, plane_sums, plane_counts = [sum(partial) for partial in zip(*(future.result() for future in futures))]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sq = radial_sums / radial_weights
+        sq_plane = plane_sums / plane_counts
+
+    q_edges = np.linspace(0.0, np.pi * n_grid / box_length, N_sq_bins + 1)
+    q_values = (q_edges[:-1] + q_edges[1:]) / 2.0
+    filled = radial_weights > 0
+
+    n_plane = sq_plane.shape[0]
+    q_plane = 2.0 * np.pi / box_length * (np.arange(n_plane) - n_plane // 2)
+    q_x, q_y = np.meshgrid(q_plane, q_plane, indexing='ij')
+
+    mode = "direct sum" if direct_sum else f"{n_grid}^3 grid"
+    comments = [f"Averaged over {len(frames)} frames ({frames[0]} to {frames[-1]}, stride {stride if frame_range else 1}), {mode}"]
+
+    write_output("Sq"+fileout, "qR   S(q)", {"q": q_values[filled], "sq": sq[filled]}, input_params, output_format, comments=comments, directory=directory)
+    write_output("Sqxy"+fileout, r"q\-(x)R   q\-(y)R   S(q\-(x),q\-(y))", {"q_x": q_x.ravel(), "q_y": q_y.ravel(), "sq": sq_plane.ravel()},
+                 input_params, output_format, comments=comments, directory=directory)
+
+    return q_values, sq, sq_plane
@@ -0,0 +1,346 @@
+import numpy as np
+from numpy import ndarray as Array
+import toml
+import os
+
+
+def box_length_for(N: int, volume_fraction: float, sigma: float = 2.0) -> float:
+    """
+    A helper function to get the length of the cubic box of N spheres at a given volume fraction
+
+    Parameters
+    ----------
+    N: (int)
+        The number of particles
+    volume_fraction: (float)
+        The volume fraction of the spheres
+    sigma: (float)
+        The diameter of the spheres
+
+    Returns
+    ----------
+    box_length: (float)
+        The length of the cubic box
+    """
+    return float((N * np.pi * sigma**3 / 6.0 / volume_fraction)**(1.0 / 3.0))
+
+
+def hard_sphere_positions(N: int, box_length: float, sigma: float = 2.0, seed: int = 0, max_rounds: int = 1000) -> Array:
+    """
+    A function to place non-overlapping spheres at random positions in the periodic box (random sequential addition). Every round inserts a batch of random candidates that overlap neither with the placed spheres nor with each other. Works up to volume fractions of about 0.3
+
+    Parameters
+    ----------
+    N: (int)
+        The number of particles
+    box_length: (float)
+        The length of the cubic box
+    sigma: (float)
+        The diameter of the spheres
+    seed: (int)
+        The seed of the random number generator
+    max_rounds: (int)
+        The maximum number of insertion rounds
+
+    Returns
+    ----------
+    positions: (Array)
+        The positions of the particles in [-box_length/2, box_length/2); has dimensions (N, 3)
+    """
+    import freud
+
+    rng = np.random.default_rng(seed)
+    box = freud.box.Box.cube(box_length)
+    positions = np.zeros((0, 3))
+
+    for _ in range(max_rounds):
+        if len(positions) == N:
+            return positions
+
+        candidates = rng.uniform(-0.5 * box_length, 0.5 * box_length, (max(2 * (N - len(positions)), 1024), 3))
+
+        # Remove the candidates overlapping with the placed spheres
+        if len(positions) > 0:
+            nlist = freud.locality.AABBQuery(box, positions).query(candidates, dict(r_max=sigma)).toNeighborList()
+            candidates = np.delete(candidates, np.unique(nlist.query_point_indices), axis=0)
+
+        if len(candidates) == 0:
+            continue
+
+        # Of two overlapping candidates only the first one is kept
+        nlist = freud.locality.AABBQuery(box, candidates).query(candidates, dict(r_max=sigma, exclude_ii=True)).toNeighborList()
+        later = nlist.query_point_indices > nlist.point_indices
+        candidates = np.delete(candidates, np.unique(nlist.query_point_indices[later]), axis=0)
+
+        positions = np.concatenate((positions, candidates[:N - len(positions)]))
+
+    raise ValueError(f"Could only place {len(positions)} of {N} particles in {max_rounds} rounds. Use a larger box")
+
+
+def crystal_positions(n_cells: int, lattice_constant: float, lattice: str = "fcc") -> tuple[Array, float]:
+    """
+    A function to get the positions of a cubic crystal filling the periodic box
+
+    Parameters
+    ----------
+    n_cells: (int)
+        The number of unit cells along each axis
+    lattice_constant: (float)
+        The length of the unit cell
+    lattice: (str)
+        "sc", "bcc" or "fcc"
+
+    Returns
+    ----------
+    positions: (Array)
+        The positions of the particles in [-box_length/2, box_length/2); has dimensions (N, 3)
+    box_length: (float)
+        The length of the cubic box
+    """
+    bases = {"sc": [[0.0, 0.0, 0.0]],
+             "bcc": [[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]],
+             "fcc": [[0.0, 0.0, 0.0], [0.5, 0.5, 0.0], [0.5, 0.0, 0.5], [0.0, 0.5, 0.5]]}
+    if lattice not in bases:
+        raise ValueError(f"Unknown lattice {lattice}. Use one of {list(bases)}")
+
+    cells = np.stack(np.meshgrid(*[np.arange(n_cells)] * 3, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    positions = ((cells + np.asarray(bases[lattice])) * lattice_constant).reshape(-1, 3)
+
+    box_length = n_cells * lattice_constant
+
+    return positions - 0.5 * box_length + 0.25 * lattice_constant, float(box_length)
+
+
+def sheared_trajectory(initial_positions: Array,
+                       box_length: float,
+                       n_steps: int,
+                       shear_rate: float = 0.0,
+                       frame_dt: float = 0.1,
+                       diffusion: float = 0.0,
+                       seed: int = 0) -> tuple[Array, Array]:
+    """
+    A function to create the trajectory of particles advected by an affine shear flow along x (gradient along y), with optional Brownian displacements, in a box with Lees-Edwards boundary conditions
+
+    Parameters
+    ----------
+    initial_positions: (Array)
+        The positions of the first frame; has dimensions (N, 3)
+    box_length: (float)
+        The length of the cubic box
+    n_steps: (int)
+        The number of frames
+    shear_rate: (float)
+        The shear rate of the flow
+    frame_dt: (float)
+        The time between the frames
+    diffusion: (float)
+        The diffusion coefficient of the Brownian displacements
+    seed: (int)
+        The seed of the random number generator
+
+    Returns
+    ----------
+    trajectory: (Array)
+        The wrapped positions; has dimensions (n_steps, N, 3)
+    unwrapped_trajectory: (Array)
+        The unwrapped positions, as they should be recovered by msd.unwrap_trajectory
+
+    Notes
+    ----------
+    The affine displacement of every step is evaluated at the midpoint y of the step, so the non-affine unwrapping recovers the Brownian displacements exactly
+    """
+    rng = np.random.default_rng(seed)
+    N = initial_positions.shape[0]
+    strain = shear_rate * frame_dt * np.arange(n_steps)
+
+    unwrapped_trajectory = np.empty((n_steps, N, 3))
+    unwrapped_trajectory[0] = initial_positions
+
+    noise = rng.normal(0.0, np.sqrt(2.0 * diffusion * frame_dt), (n_steps - 1, N, 3))
+    for step in range(1, n_steps):
+        previous = unwrapped_trajectory[step - 1]
+        current = previous + noise[step - 1]
+        current[:, 0] += shear_rate * frame_dt * 0.5 * (previous[:, 1] + current[:, 1])
+        unwrapped_trajectory[step] = current
+
+    # Every crossing of the y boundary shifts the x image by the strain at the time of the crossing
+    y_images = np.round(unwrapped_trajectory[..., 1] / box_length)
+    crossings = np.diff(y_images, axis=0, prepend=y_images[:1])
+    x_shift = np.cumsum(crossings * strain[:, np.newaxis] * box_length, axis=0)
+
+    trajectory = unwrapped_trajectory.copy()
+    trajectory[..., 0] -= x_shift
+    trajectory -= box_length * np.round(trajectory / box_length)
+
+    return trajectory, unwrapped_trajectory
+
+
+def synthetic_stresslet(trajectory: Array, shear_rate: float = 0.0, noise: float = 1.0, seed: int = 0) -> Array:
+    """
+    A function to create a stresslet with a known mean: the xy component is proportional to the shear rate and the normal components are constant, with Gaussian noise on every particle
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The trajectory (for the number of frames and particles)
+    shear_rate: (float)
+        The shear rate; the mean xy component is -shear_rate
+    noise: (float)
+        The standard deviation of the noise
+    seed: (int)
+        The seed of the random number generator
+
+    Returns
+    ----------
+    stresslet: (Array)
+        The stresslet (S_xx, S_xy, S_xz, S_yy, S_yz); has dimensions (n_steps, N, 5)
+    """
+    rng = np.random.default_rng(seed)
+    n_steps, N = trajectory.shape[:2]
+
+    mean = np.array([-0.5, -shear_rate, 0.0, -0.5, 0.0])
+
+    return mean + noise * rng.normal(size=(n_steps, N, 5))
+
+
+def affine_velocities(trajectory: Array, shear_rate: float = 0.0, noise: float = 0.1, seed: int = 0) -> Array:
+    """
+    A function to create the velocities of the affine shear flow (v_x = shear_rate * y) with Gaussian noise
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The wrapped trajectory
+    shear_rate: (float)
+        The shear rate of the flow
+    noise: (float)
+        The standard deviation of the noise
+    seed: (int)
+        The seed of the random number generator
+
+    Returns
+    ----------
+    velocities: (Array)
+        The velocities; has the same dimensions as the trajectory
+    """
+    rng = np.random.default_rng(seed)
+
+    velocities = noise * rng.normal(size=trajectory.shape)
+    velocities[..., 0] += shear_rate * trajectory[..., 1]
+
+    return velocities
+
+
+def write_simulation(directory: str,
+                     trajectory: Array,
+                     stresslet: Array | None = None,
+                     velocities: Array | None = None,
+                     box_length: float = 10.0,
+                     dt: float = 0.01,
+                     period: int = 10,
+                     kT: float = 1.0,
+                     shear_rate: float = 0.0,
+                     n_unwritten: int = 0):
+    """
+    A function to write a synthetic simulation directory, in the format of the JFSD outputs
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory (created if needed)
+    trajectory: (Array)
+        The wrapped trajectory
+    stresslet: (Array)
+        The stresslet. If None, no stresslet.npy is written
+    velocities: (Array)
+        The velocities. If None, no velocities.npy is written
+    box_length: (float)
+        The length of the cubic box
+    dt: (float)
+        The time step of the simulation
+    period: (int)
+        The number of time steps between the frames
+    kT: (float)
+        The temperature
+    shear_rate: (float)
+        The shear rate
+    n_unwritten: (int)
+        The number of all-zero frames appended to the files (as for a simulation that ended prematurely)
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    for name, array in (("trajectory", trajectory), ("stresslet", stresslet), ("velocities", velocities)):
+        if array is not None:
+            np.save(os.path.join(directory, name + ".npy"), np.concatenate((array, np.zeros((n_unwritten,) + array.shape[1:]))))
+
+    input_file = {"general": {"dt": dt},
+                  "output": {"writing_period": period},
+                  "physics": {"kT": kT, "shear_rate": shear_rate},
+                  "box": {"Lx": box_length, "Ly": box_length, "Lz": box_length}}
+    with open(os.path.join(directory, "input.toml"), "w") as f:
+        toml.dump(input_file, f)
+
+
+def synthetic_simulation(directory: str,
+                         N: int,
+                         n_steps: int,
+                         system: str = "hard_spheres",
+                         volume_fraction: float = 0.2,
+                         shear_rate: float = 0.1,
+                         diffusion: float = 0.1,
+                         dt: float = 0.01,
+                         period: int = 10,
+                         n_unwritten: int = 0,
+                         seed: int = 0) -> tuple[Array, float]:
+    """
+    A function to write a complete synthetic simulation (trajectory, stresslet and velocities) of a sheared system
+
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory
+    N: (int)
+        The number of particles. For a crystal it is rounded to a full fcc lattice
+    n_steps: (int)
+        The number of frames
+    system: (str)
+        "hard_spheres" for random non-overlapping spheres or "crystal" for an fcc crystal
+    volume_fraction: (float)
+        The volume fraction of the spheres (of diameter 2)
+    shear_rate: (float)
+        The shear rate of the affine flow
+    diffusion: (float)
+        The diffusion coefficient of the Brownian displacements
+    dt: (float)
+        The time step of the simulation
+    period: (int)
+        The number of time steps between the frames
+    n_unwritten: (int)
+        The number of all-zero frames appended to the files
+    seed: (int)
+        The seed of the random number generator
+
+    Returns
+    ----------
+    unwrapped_trajectory: (Array)
+        The exact unwrapped trajectory
+    box_length: (float)
+        The length of the cubic box
+    """
+    box_length = box_length_for(N, volume_fraction)
+
+    if system == "hard_spheres":
+        positions = hard_sphere_positions(N, box_length, seed=seed)
+    elif system == "crystal":
+        n_cells = max(int(round((N / 4) ** (1.0 / 3.0))), 1)
+        positions, box_length = crystal_positions(n_cells, box_length_for(4 * n_cells**3, volume_fraction) / n_cells)
+    else:
+        raise ValueError(f"Unknown system {system}. Use 'hard_spheres' or 'crystal'")
+
+    trajectory, unwrapped_trajectory = sheared_trajectory(positions, box_length, n_steps, shear_rate, dt * period, diffusion, seed)
+    stresslet = synthetic_stresslet(trajectory, shear_rate, seed=seed)
+    velocities = affine_velocities(trajectory, shear_rate, seed=seed)
+
+    write_simulation(directory, trajectory, stresslet, velocities, box_length, dt, period, 1.0, shear_rate, n_unwritten)
+
+    return unwrapped_trajectory, box_length
@@ -2,25 +2,68 @@ import numpy as np
 from numpy import ndarray as Array
 import toml
 import os
-from scipy.stats import binned_statistic
+from multiprocessing import shared_memory
 
 
-def dir_name() -> str:
+# Shared memory blocks attached by a worker process, kept alive while their arrays are in use
+_attached_shared_memory = {}
+
+# Bin edges and indices of the last logarithmically binned time axis
+_log_bin_cache = {}
+
+# The floating point types of the precision setting
+PRECISIONS = {"float64": np.float64, "float32": np.float32}
+
+
+def dir_name(directory: str = ".") -> str:
     """
     A helper function to get the directory name for the output file names
 
+    Parameters
+    ----------
+    directory: (str)
+        The simulation directory
+
     Returns
     ---------
     fileout: (str)
         Parent directory name
     """
-    script_dir = os.getcwd()
+    script_dir = os.path.abspath(directory)
     fileout = os.path.basename(script_dir)
 
     return fileout
 
 
-def load_and_check(stress_flag: bool, velocity_flag: bool) -> tuple[Array, Array, int]:
+def find_last_frame(trajectory: Array) -> int:
+    """
+    A function to find the number of written frames of a trajectory. Unwritten frames are all zeros and are always at the end of the file, so the first all-zero frame is found with a bisection over the frames
+
+    Parameters
+    ----------
+    trajectory: (Array)
+        The trajectory, can be memory-mapped. Shape should be (n_steps, N_particles, 3)
+
+    Returns
+    ----------
+    n_frames: (int)
+        The number of non-zero frames
+    """
+    lower = 0
+    upper = trajectory.shape[0]
+
+    # Only single frames are read, so a memory-mapped file is never loaded as a whole
+    while lower < upper:
+        middle = (lower + upper) // 2
+        if np.all(trajectory[middle] == 0.0):
+            upper = middle
+        else:
+            lower = middle + 1
+
+    return lower
+
+
+def load_and_check(stress_flag: bool, velocity_flag: bool, lazy: bool = False, directory: str = ".") -> tuple[Array, Array, Array, int]:
     """
     A function to load the trajectory and stresslet files. It also checks whether the simulation ended prematurely. Returns the files without the unwritten frames
 
@@ -30,6 +73,10 @@ def load_and_check(stress_flag: bool, velocity_flag: bool) -> tuple[Array, Array
         Flag whether the stress calculation is turned on
     velocity_flag: (bool)
         Flag wheter the velocity calculations are turned on
+    lazy: (bool)
+        Flag whether the files are memory-mapped instead of read into memory
+    directory: (str)
+        The simulation directory with the input files
 
     Returns
     ----------
@@ -41,30 +88,187 @@ def load_and_check(stress_flag: bool, velocity_flag: bool) -> tuple[Array, Array
         The non-zero velocity frames   
     ending_frame: (int)
         The index of the last frame
+
+    Notes
+    ----------
+    The returned arrays are views of the loaded (or memory-mapped) files, so no copies are made when the unwritten frames are removed
     """
-    trajectory = np.load("trajectory.npy")  # Shape should be (n_steps, N_particles, 3)
+    mmap_mode = 'r' if lazy else None
+
+    trajectory = np.load(os.path.join(directory, "trajectory.npy"), mmap_mode=mmap_mode)  # Shape should be (n_steps, N_particles, 3)
     if stress_flag==True:
-        stresslet = np.load("stresslet.npy")   # Shape should be (n_steps, N_particles, 5)
+        stresslet = np.load(os.path.join(directory, "stresslet.npy"), mmap_mode=mmap_mode)   # Shape should be (n_steps, N_particles, 5)
     else:
         stresslet = None
     
     if velocity_flag:
-        velocities = np.load("velocities.npy")
+        velocities = np.load(os.path.join(directory, "velocities.npy"), mmap_mode=mmap_mode)   # Shape should be (n_steps, N_particles, 3)
     else:
         velocities = None
 
-    for i in range(trajectory.shape[0]):
-        if np.all(trajectory[i] == 0.0):
-            trajectory = trajectory[:i]
-            if stress_flag==True:
-                 stresslet = stresslet[:i]
+    n_frames = find_last_frame(trajectory)
+
+    if n_frames == 0:
+        raise ValueError(f"The trajectory contains no written frames (all frames of {os.path.join(directory, 'trajectory.npy')} are zero)")
 
-            print(f"File ends at frame {i}. Continuing with analysis")
-            break
+    if n_frames < trajectory.shape[0]:
+        trajectory = trajectory[:n_frames]
+        if stress_flag==True:
+            stresslet = stresslet[:n_frames]
+        if velocity_flag:
+            velocities = velocities[:n_frames]
+
+        print(f"File ends at frame {n_frames}. Continuing with analysis")
     
-    return trajectory, stresslet, velocities, i
+    return trajectory, stresslet, velocities, n_frames - 1
+
+def compute_dtype(precision: str) -> type:
+    """
+    A helper function to get the floating point type of the analyses from the precision setting. In single precision the positions are converted chunk by chunk and the sums are still accumulated in double precision
+
+    Parameters
+    ----------
+    precision: (str)
+        "float64" or "float32"
+
+    Returns
+    ----------
+    dtype: (type)
+        The floating point type
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}. Use one of {list(PRECISIONS)}")
+
+    return PRECISIONS[precision]
+
+
+def frame_chunks(n_frames: int, chunk_size: int) -> list[slice]:
+    """
+    A helper function to split the frames in chunks, so that long trajectories are processed a few frames at a time
+
+    Parameters
+    ----------
+    n_frames: (int)
+        The total number of frames
+    chunk_size: (int)
+        The maximum number of frames in every chunk
+
+    Returns
+    ----------
+    chunks: (list)
+        The slices of the frames of every chunk
+    """
+    chunk_size = max(int(chunk_size), 1)
+
+    return [slice(start, min(start + chunk_size, n_frames)) for start in range(0, n_frames, chunk_size)]
+
+
+def frame_selection(n_frames: int, frame_range: list | None = None, stride: int = 1) -> Array:
+    """
+    A helper function to get the frame indices of a frame range, as used in the settings file
+
+    Parameters
+    ----------
+    n_frames: (int)
+        The total number of (non-zero) frames
+    frame_range: (list)
+        The [start, stop] frames of the range, following the python slicing conventions (negative values count from the end). If None or empty, all frames are selected
+    stride: (int)
+        The step between the selected frames
+
+    Returns
+    ----------
+    frames: (Array)
+        The indices of the selected frames
+    """
+    if not frame_range:
+        frame_range = [None, None]
+
+    if len(frame_range) != 2:
+        raise ValueError(f"The frame range should be given as [start, stop], got {frame_range}")
+
+    frames = np.arange(n_frames)[slice(frame_range[0], frame_range[1], max(int(stride), 1))]
+
+    if len(frames) == 0:
+        raise ValueError(f"No frames selected with range {frame_range} and stride {stride}. Last frame has index {n_frames - 1}")
+
+    return frames
 
-def simulation_parameters(trajectory: Array) -> tuple[int, int, float, int, Array: float, float, float, float, float, float]:
+
+def array_source(array: Array) -> str | Array:
+    """
+    A helper function to pass arrays to worker processes. Memory-mapped arrays are passed by their file name, so every worker maps the file itself instead of receiving a copy
+
+    Parameters
+    ----------
+    array: (Array)
+        The (possibly memory-mapped) array
+
+    Returns
+    ----------
+    source: (str | Array)
+        The file name of a memory-mapped array, else the array itself
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return array.filename
+
+    return array
+
+
+def share_array(array: Array) -> tuple[str | tuple, shared_memory.SharedMemory | None]:
+    """
+    A helper function to share an array with worker processes without copying it for every worker. Memory-mapped arrays are passed by their file name, other arrays are copied once to a shared memory block
+
+    Parameters
+    ----------
+    array: (Array)
+        The (possibly memory-mapped) array
+
+    Returns
+    ----------
+    source: (str | tuple)
+        The file name of a memory-mapped array, or the name, shape and dtype of the shared memory block. Opened in the workers with open_source
+    shared_block: (SharedMemory | None)
+        The shared memory block, which has to be closed and unlinked by the caller when the workers are done
+    """
+    source = array_source(array)
+    if isinstance(source, str):
+        return source, None
+
+    shared_block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shared_block.buf)
+    shared_array[:] = array
+
+    return (shared_block.name, array.shape, array.dtype.str), shared_block
+
+
+def open_source(source: str | tuple | Array) -> Array:
+    """
+    A helper function to open an array passed to a worker process with array_source or share_array
+
+    Parameters
+    ----------
+    source: (str | tuple | Array)
+        The file name of a .npy file, the description of a shared memory block or an array
+
+    Returns
+    ----------
+    array: (Array)
+        The memory-mapped file, the array in shared memory or the array itself
+    """
+    if isinstance(source, str):
+        return np.load(source, mmap_mode='r')
+
+    if isinstance(source, tuple):
+        (name, shape, dtype) = source
+        if name not in _attached_shared_memory:
+            _attached_shared_memory[name] = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, dtype=dtype, buffer=_attached_shared_memory[name].buf)
+
+    return source
+
+
+def simulation_parameters(trajectory: Array, directory: str = ".") -> tuple[int, int, float, int, Array: float, float, float, float, float, float]:
     """
     A helper function to get the simulation parameters from the input.toml file
 
@@ -72,6 +276,8 @@ def simulation_parameters(trajectory: Array) -> tuple[int, int, float, int, Arra
     ----------
     trajectory: (Array)
         The input trajectory (necessary for the number of particles and the number of steps; should not be read from the toml file)
+    directory: (str)
+        The simulation directory with the input.toml file
 
     Returns
     ----------
@@ -80,7 +286,7 @@ def simulation_parameters(trajectory: Array) -> tuple[int, int, float, int, Arra
     """
 
     #read the parameters form the toml file
-    with open('input.toml', 'r') as f:
+    with open(os.path.join(directory, 'input.toml'), 'r') as f:
         input_file = toml.load(f) 
 
     #get the simulation parameters
@@ -103,6 +309,176 @@ def simulation_parameters(trajectory: Array) -> tuple[int, int, float, int, Arra
     return (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb)
 
 
+def log_bin_edges(first: float, last: float, num_bins=80) -> Array:
+    """
+    A helper function to get the edges of the logarithmic bins between the first (non-zero) and the last time, shared by the binning of the time series and the logarithmic lags of the msd
+    """
+    return np.logspace(np.log10(first), np.log10(last), num_bins)
+
+
+def log_bin_index(time: Array, num_bins=80) -> tuple[Array, Array]:
+    """
+    A function to get the logarithmic bins of a time axis and the bin of every time. The result is cached, so every time series on the same time axis is binned without recomputing the bin assignments. The cache is keyed on the length and the first, second and last times, which identify an evenly spaced time axis (as the one of the simulation) without reading all of it
+
+    Parameters
+    ----------
+    time: (Array)
+        Array with the time steps
+    num_bins: (int)
+        The number of bin edges (there are num_bins - 1 bins)
+
+    Returns
+    ----------
+    bins: (Array)
+        The bin edges
+    index: (Array)
+        The bin index of every time. Times outside of the bins get the index num_bins - 1, which is dropped by bin_sums
+    """
+    time = np.asarray(time)
+    key = (num_bins, time.shape, time[0], time[1], time[-1])
+
+    if key not in _log_bin_cache:
+        bins = log_bin_edges(time[1], time[-1], num_bins) # create the bins
+        n_bins = num_bins - 1
+
+        index = np.searchsorted(bins, time, side='right') - 1
+        index[np.isclose(time, bins[-1], rtol=1e-10, atol=0.0)] = n_bins - 1  # the last bin includes its upper edge
+        index[(index < 0) | (index > n_bins)] = n_bins
+
+        _log_bin_cache.clear() # only the last time axis is kept
+        _log_bin_cache[key] = (bins, index)
+
+    return _log_bin_cache[key]
+
+
+def binned_stats(index: Array, data: Array, n_bins: int) -> tuple[Array, Array, Array]:
+    """
+    A function to calculate the mean, count and variance of data in bins, with bincount passes over all components at once. The variance is calculated in a second pass from the deviations from the bin means, in double precision, so it does not cancel for nearly constant bins
+
+    Parameters
+    ----------
+    index: (Array)
+        The bin index of every data point (see log_bin_index and lin_bin_index)
+    data: (Array)
+        The data to be binned; has dimensions (len(index),) or (len(index), k) for k components
+    n_bins: (int)
+        The number of bins
+
+    Returns
+    ----------
+    bin_means: (Array)
+        The mean of every bin (nan for empty bins); has dimensions (n_bins,) or (n_bins, k)
+    bin_counts: (Array)
+        The number of data points in every bin
+    bin_variances: (Array)
+        The variance of every bin (nan for empty bins)
+    """
+    bin_counts, sums, squared_deviations = bin_deviations(index, data, n_bins)
+    counts = bin_counts.reshape((n_bins,) + (1,) * (sums.ndim - 1))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bin_means = sums / counts
+        bin_variances = np.maximum(squared_deviations / counts, 0.0)
+
+    return bin_means, bin_counts, bin_variances
+
+
+def bin_deviations(index: Array, data: Array, n_bins: int) -> tuple[Array, Array, Array]:
+    """
+    A function to accumulate the counts, sums and squared deviations from the bin means of data in bins. The deviations are summed in a second pass over the data, so they do not cancel for data with a large mean
+
+    Parameters
+    ----------
+    index: (Array)
+        The bin index of every data point. Indices equal to n_bins are ignored
+    data: (Array)
+        The data to be binned; has dimensions (len(index),) or (len(index), k) for k components
+    n_bins: (int)
+        The number of bins
+
+    Returns
+    ----------
+    counts: (Array)
+        The number of data points in every bin
+    sums: (Array)
+        The sum of the data in every bin; has dimensions (n_bins,) or (n_bins, k)
+    squared_deviations: (Array)
+        The sum of the squared deviations from the mean of every bin
+    """
+    data = np.asarray(data, dtype=np.float64)
+    counts, sums, _ = bin_sums(index, data, n_bins)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bin_means = sums / counts.reshape((n_bins,) + (1,) * (sums.ndim - 1))
+
+    # The deviations of every point from the mean of its bin (points outside of the bins keep their value, they are dropped by bin_sums)
+    bin_means_padded = np.concatenate((np.nan_to_num(bin_means), np.zeros((1,) + bin_means.shape[1:])))
+    _, _, squared_deviations = bin_sums(index, data - bin_means_padded[index], n_bins)
+
+    return counts, sums, squared_deviations
+
+
+def merge_bin_deviations(counts: Array, sums: Array, squared_deviations: Array, other_counts: Array, other_sums: Array, other_squared_deviations: Array) -> tuple[Array, Array, Array]:
+    """
+    A function to merge the binned counts, sums and squared deviations of two sets of data (see bin_deviations), e.g. of consecutive chunks of frames. The squared deviations are combined with the difference of the bin means (Chan et al.), so the variances of long accumulations do not lose their precision
+
+    Parameters
+    ----------
+    counts, sums, squared_deviations: (Array)
+        The accumulated bin values of the first set
+    other_counts, other_sums, other_squared_deviations: (Array)
+        The bin values of the second set
+
+    Returns
+    ----------
+    counts: (Array)
+        The number of data points in every bin of both sets
+    sums: (Array)
+        The sum of the data in every bin of both sets
+    squared_deviations: (Array)
+        The sum of the squared deviations from the common mean of every bin
+    """
+    shape = (len(counts),) + (1,) * (np.ndim(sums) - 1)
+    n_a, n_b = counts.reshape(shape).astype(np.float64), other_counts.reshape(shape).astype(np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = other_sums / n_b - sums / n_a
+        shift = np.where((n_a > 0) & (n_b > 0), delta**2 * n_a * n_b / (n_a + n_b), 0.0)
+
+    return counts + other_counts, sums + other_sums, squared_deviations + other_squared_deviations + shift
+
+
+def log_bin_reduce(time: Array, data: Array, num_bins=80) -> tuple[Array, Array, Array, Array]:
+    """
+    A function to perform the logarithmic binning of any number of time series at once
+
+    Parameters
+    ----------
+    time: (Array)
+        Array with the time steps
+    data: (Array)
+        Array with the data to be averaged; has dimensions (len(time),) or (len(time), k) for k components
+    num_bins: (int)
+        The number of bin edges (there are num_bins - 1 bins)
+
+    Returns
+    ----------
+    bin_centers: (Array)
+        Array with the binned times
+    bin_means: (Array)
+        Array with the averaged values
+    bin_counts: (Array)
+        Array with the number of values in every bin
+    bin_variances: (Array)
+        Array with the variances of the values in every bin
+    """
+    bins, index = log_bin_index(time, num_bins)
+    bin_means, bin_counts, bin_variances = binned_stats(index, data, num_bins - 1)
+    bin_centers = np.sqrt(bins[:-1] * bins[1:])  # geometric mean for center
+
+    return bin_centers, bin_means, bin_counts, bin_variances
+
+
 def log_bin_stat(time: Array, data: Array, num_bins=80) -> tuple[Array, Array]:
     """
     A function to perform the logarithmic binning average over some data
@@ -112,7 +488,7 @@ def log_bin_stat(time: Array, data: Array, num_bins=80) -> tuple[Array, Array]:
     time: (Array)
         Array with the time steps
     data: (Array)
-        Array with the data to be averaged (has to be same size as time)
+        Array with the data to be averaged (has to be same size as time, can have more components as columns)
     num_bins: (int)
         The number of bins
 
@@ -123,9 +499,7 @@ def log_bin_stat(time: Array, data: Array, num_bins=80) -> tuple[Array, Array]:
     bin_means: (Array)
         Array with the averaged values
     """
-    bins = np.logspace(np.log10(time[1]), np.log10(time[-1]), num_bins) # create the bins
-    bin_means, _, _ = binned_statistic(time, data, statistic='mean', bins=bins) # do the binned average
-    bin_centers = np.sqrt(bins[:-1] * bins[1:])  # geometric mean for center
+    bin_centers, bin_means, _, _ = log_bin_reduce(time, data, num_bins)
 
     return bin_centers, bin_means
 
@@ -139,7 +513,7 @@ def lin_bin_stat(time: Array, data: Array, box_size: float, num_bins=80)-> tuple
     time: (Array)
         Array with the time steps
     data: (Array)
-        Array with the data to be averaged (has to be same size as time)
+        Array with the data to be averaged (has to be same size as time, can have more components as columns)
     box_size: (float)
         The simulation box size
     num_bins: (int)
@@ -153,8 +527,77 @@ def lin_bin_stat(time: Array, data: Array, box_size: float, num_bins=80)-> tuple
         Array with the averaged values
     """
     bins = np.linspace(0.0 - 0.5 * box_size, 0.5 * box_size, num_bins) # create the bins
-    bin_means, _, _ = binned_statistic(time, data, statistic='mean', bins=bins) # do the binned average
+    bin_means, _, _ = binned_stats(lin_bin_index(np.asarray(time), box_size, num_bins), data, num_bins - 1) # do the binned average
     bin_centers = (bins[:-1] + bins[1:]) / 2.0  # mean for center
     
     return bin_centers, bin_means
 
+
+def lin_bin_index(values: Array, box_size: float, num_bins=80) -> Array:
+    """
+    A function to get the linear bin of every value, with the same bins as lin_bin_stat
+
+    Parameters
+    ----------
+    values: (Array)
+        The values to be binned (e.g. the y positions of the particles)
+    box_size: (float)
+        The simulation box size
+    num_bins: (int)
+        The number of bin edges (there are num_bins - 1 bins)
+
+    Returns
+    ----------
+    index: (Array)
+        The bin index of every value. Values outside of the box get the index num_bins - 1, which is dropped by bin_sums
+    """
+    n_bins = num_bins - 1
+    bin_width = box_size / n_bins
+
+    index = np.floor((values + 0.5 * box_size) / bin_width).astype(np.intp)
+    index[values == 0.5 * box_size] = n_bins - 1  # the last bin includes its upper edge
+    index[(index < 0) | (index > n_bins)] = n_bins
+
+    return index
+
+
+def bin_sums(index: Array, data: Array, n_bins: int) -> tuple[Array, Array, Array]:
+    """
+    A function to accumulate the counts, sums and sums of squares of data in bins with a single bincount pass
+
+    Parameters
+    ----------
+    index: (Array)
+        The bin index of every data point. Indices equal to n_bins are ignored
+    data: (Array)
+        The data to be binned; has dimensions (len(index),) or (len(index), k) for k components
+    n_bins: (int)
+        The number of bins
+
+    Returns
+    ----------
+    counts: (Array)
+        The number of data points in every bin
+    sums: (Array)
+        The sum of the data in every bin; has dimensions (n_bins,) or (n_bins, k)
+    squared_sums: (Array)
+        The sum of the squared data in every bin
+
+    Notes
+    ----------
+    The sums are accumulated in double precision, also for single precision data
+    """
+    data = np.asarray(data, dtype=np.float64)
+    components = data.reshape(len(index), -1)
+    k = components.shape[1]
+
+    # Every component of every bin gets its own index, so all components are binned at once
+    flat_index = (index[:, np.newaxis] * k + np.arange(k)).ravel()
+
+    counts = np.bincount(index, minlength=n_bins + 1)[:n_bins]
+    sums = np.bincount(flat_index, weights=components.ravel(), minlength=(n_bins + 1) * k)[:n_bins * k]
+    squared_sums = np.bincount(flat_index, weights=components.ravel()**2, minlength=(n_bins + 1) * k)[:n_bins * k]
+
+    shape = (n_bins,) + data.shape[1:]
+
+    return counts, sums.reshape(shape), squared_sums.reshape(shape)
@@ -1,11 +1,22 @@
 from numpy import ndarray as Array
 import numpy as np
+import warnings
 
-from post_process_jfsd.utils import lin_bin_stat
+from post_process_jfsd.utils import lin_bin_index, bin_deviations, merge_bin_deviations, frame_selection, frame_chunks
+from post_process_jfsd.output import write_output
 
-def vel_profile(trajectory: Array, velocities: Array, input_params: tuple, n_bins: int, fileout: str) -> tuple[Array, Array]:
+def vel_profile(trajectory: Array, 
+                velocities: Array, 
+                input_params: tuple, 
+                n_bins: int, 
+                fileout: str, 
+                frame_range: list | None = None, 
+                stride: int = 1, 
+                chunk_size: int = 1000,
+                output_format: str = "text",
+                directory: str = ".") -> tuple[Array, Array, Array]:
     """
-    Function to calculate the velocity profile of the sheared system, averaged over all of the frames
+    Function to calculate the velocity profile of the sheared system, averaged over all of the (selected) frames. Every particle velocity of every frame has the same weight
 
     Parameters
     -----------
@@ -19,6 +30,16 @@ def vel_profile(trajectory: Array, velocities: Array, input_params: tuple, n_bin
         The number of the bins for the velocities averaging
     fileout: (str)
         The name of the parent directory
+    frame_range: (list)
+        The [start, stop] frames over which the profile is averaged (e.g. only the steady state). If None or empty, all frames are used
+    stride: (int)
+        The step between the averaged frames
+    chunk_size: (int)
+        The number of frames read at once
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
 
     Returns
     ------------
@@ -26,32 +47,114 @@ def vel_profile(trajectory: Array, velocities: Array, input_params: tuple, n_bin
         The y binned coordinate values
     binned_velocities: (Array)
         The averaged velocity values
+    velocity_errors: (Array)
+        The standard errors of the averaged velocities
     """
-    # Define the positions and velocities for this frame
-    positions = trajectory[:,:,1] # the y positions 
-    velocities = velocities[:,:,0] # the x velocities
-
     # Get the input parameters
     (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
 
     # Prompt that there is no shear
     if shear_rate == 0.0:
-        RuntimeWarning(f"Shear rate is zero!")
+        warnings.warn("Shear rate is zero!", RuntimeWarning)
+
+    frames = frame_selection(n_steps, frame_range, stride)
+
+    counts, sums, squared_deviations = velocity_bin_sums(trajectory, velocities, frames, box_length, n_bins, chunk_size)
+
+    return write_velocity_profile(counts, sums, squared_deviations, input_params, n_bins, fileout, output_format, directory)
+
+
+def velocity_bin_sums(trajectory: Array, velocities: Array, frames: Array, box_length: float, n_bins: int, chunk_size: int = 1000) -> tuple[Array, Array, Array]:
+    """
+    Function to accumulate the x velocities of the particles in bins of their y position
+
+    Parameters
+    -----------
+    trajectory: (Array)
+        The positions of the particles
+    velocities: (Array)
+        The velocities of the particles
+    frames: (Array)
+        The indices of the accumulated frames
+    box_length: (float)
+        The length of the box
+    n_bins: (int)
+        The number of the bin edges (n_bins - 1 bins)
+    chunk_size: (int)
+        The number of frames read at once
+
+    Returns
+    ------------
+    counts: (Array)
+        The number of velocities in every bin
+    sums: (Array)
+        The sum of the velocities in every bin
+    squared_deviations: (Array)
+        The sum of the squared deviations from the mean velocity of every bin
+    """
+    counts = np.zeros(n_bins - 1, dtype=np.int64)
+    sums = np.zeros(n_bins - 1)
+    squared_deviations = np.zeros(n_bins - 1)
+
+    # Accumulate the x velocities in the y bins, over chunks of frames
+    for chunk in frame_chunks(len(frames), chunk_size):
+        positions = np.asarray(trajectory[frames[chunk], :, 1]) # the y positions 
+        velocities_x = np.asarray(velocities[frames[chunk], :, 0]) # the x velocities
+
+        index = lin_bin_index(positions.ravel(), box_length, n_bins)
+        counts, sums, squared_deviations = merge_bin_deviations(counts, sums, squared_deviations, *bin_deviations(index, velocities_x.ravel(), n_bins - 1))
+
+    return counts, sums, squared_deviations
+
+
+def write_velocity_profile(counts: Array, sums: Array, squared_deviations: Array, input_params: tuple, n_bins: int, fileout: str, output_format: str = "text", directory: str = ".") -> tuple[Array, Array, Array]:
+    """
+    Function to write the velocity profile from the accumulated bin sums (see velocity_bin_sums)
+
+    Parameters
+    -----------
+    counts: (Array)
+        The number of velocities in every bin
+    sums: (Array)
+        The sum of the velocities in every bin
+    squared_deviations: (Array)
+        The sum of the squared deviations from the mean velocity of every bin
+    input_params: (tuple)
+        The input parameters
+    n_bins: (int)
+        The number of the bin edges (n_bins - 1 bins)
+    fileout: (str)
+        The name of the parent directory
+    output_format: (str)
+        The format of the output file ("text" or "npz")
+    directory: (str)
+        The simulation directory, where the output files are written
+
+    Returns
+    ------------
+    binned_y: (Array)
+        The y binned coordinate values
+    binned_velocities: (Array)
+        The averaged velocity values
+    velocity_errors: (Array)
+        The standard errors of the averaged velocities
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        binned_velocities = sums / counts
+        velocity_errors = np.sqrt(squared_deviations / counts / (counts - 1))
 
-    # Calculate velocity profile at each frame and average over all frames
-    binned_velocities_over_frames = np.array([lin_bin_stat(positions[i], velocities[i], box_length, num_bins=n_bins)[1] for i in range(len(positions))])
-    binned_velocities = binned_velocities_over_frames.mean(axis=0)
     binned_velocities = binned_velocities[::-1] # flip them for some reason
+    velocity_errors = velocity_errors[::-1]
 
     # Create the y_bins
     y_range = np.linspace(0.0 - 0.5 * box_length,  0.5 * box_length, n_bins,)
     binned_y = (y_range[:-1] + y_range[1:]) / 2.0 # take the center of the bin
 
     # Write the output to a file
-    file = open("Velocityprofile"+fileout+".dat","w+")
-    file.write("y   v\-(x)  v_real\n")
-    for i in range(len(binned_y)):
-        file.write(str(binned_y[i])+"   "+str(binned_velocities[i])+"   "+str(binned_y[i]*shear_rate/period)+"\n")
-    file.close
+    write_output("Velocityprofile"+fileout, r"y   v\-(x)  v_real   \g(d)v\-(x)",
+                 {"y": binned_y, "v_x": binned_velocities, "v_real": binned_y * shear_rate / period, "v_x_error": velocity_errors},
+                 input_params, output_format, directory=directory)
 
-    return binned_y, binned_velocities
+    return binned_y, binned_velocities, velocity_errors
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from functools import lru_cache
+
+from post_process_jfsd.synthetic import sheared_trajectory, hard_sphere_positions, box_length_for
+
+
+@lru_cache(maxsize=None)
+def _sheared_system(N: int = 200, n_steps: int = 200, volume_fraction: float = 0.2, shear_rate: float = 0.5, diffusion: float = 0.5, seed: int = 1) -> tuple:
+    box_length = box_length_for(N, volume_fraction)
+    dt, period, kT = 0.01, 10, 1.0
+    trajectory, unwrapped_trajectory = sheared_trajectory(hard_sphere_positions(N, box_length, seed=seed), box_length, n_steps,
+                                                          shear_rate, dt * period, diffusion, seed)
+    time_steps = np.arange(n_steps) * dt * period
+    input_params = (n_steps, N, dt, period, time_steps, kT, shear_rate, box_length, 1.0 / kT)
+
+    # The systems are shared by the tests, so they cannot be changed
+    for array in (trajectory, unwrapped_trajectory, time_steps):
+        array.setflags(write=False)
+
+    return trajectory, unwrapped_trajectory, input_params
+
+
+@pytest.fixture
+def sheared_system():
+    """
+    A factory of small synthetic sheared systems: sheared_system(N, n_steps, volume_fraction, shear_rate, diffusion, seed) returns the (Lees-Edwards wrapped) trajectory, the unwrapped trajectory and the simulation parameters. Every system is built once per session and is read-only
+    """
+    return _sheared_system
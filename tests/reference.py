@@ -0,0 +1,96 @@
+import numpy as np
+from numpy import ndarray as Array
+
+from post_process_jfsd.benchmark import relative_deviation
+
+
+def reference_windowed_msd(unwrapped_trajectory: Array) -> Array:
+    """
+    The windowed msd directly from its definition, averaging over every pair of frames (O(T^2))
+    """
+    n_steps = unwrapped_trajectory.shape[0]
+    msd = np.zeros(n_steps)
+    for lag in range(1, n_steps):
+        displacements = unwrapped_trajectory[lag:] - unwrapped_trajectory[:-lag]
+        msd[lag] = np.mean(np.sum(displacements**2, axis=2))
+
+    return msd
+
+
+def reference_particle_stress(positions: Array, input_params: tuple) -> Array:
+    """
+    The <xF> stress tensor of a frame from all pairs of particles (O(N^2))
+    """
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    k = 2500 / dt
+    sigma = 2. * (1.001)
+
+    distance_vectors = positions[:, np.newaxis] - positions[np.newaxis]
+    distance_vectors -= box_length * np.round(distance_vectors / box_length)
+    norms = np.linalg.norm(distance_vectors, axis=2)
+    np.fill_diagonal(norms, np.inf)
+
+    interacting = norms < sigma
+    pairs, norms = distance_vectors[interacting], norms[interacting]
+    forces = (k * (1 - sigma / norms) / norms)[:, np.newaxis] * pairs
+
+    return pairs.T @ forces / box_length**3 / kT
+
+
+def reference_gofr(positions: Array, box_length: float, N_gofr_bins: int, r_max: float) -> Array:
+    """
+    The g(r) of a frame from the histogram of all pair distances (O(N^2)). As in freud.density.RDF, the distances are binned in single precision and normalized with N^2/V
+    """
+    N = len(positions)
+    positions = positions.astype(np.float32)
+    distance_vectors = positions[:, np.newaxis] - positions[np.newaxis]
+    distance_vectors -= np.float32(box_length) * np.round(distance_vectors / np.float32(box_length))
+    distances = np.sqrt(np.sum(distance_vectors**2, axis=2))[~np.eye(N, dtype=bool)]
+
+    distances = distances[distances < np.float32(r_max)]
+    counts = np.bincount((distances / (np.float32(r_max) / np.float32(N_gofr_bins))).astype(int), minlength=N_gofr_bins)[:N_gofr_bins]
+    edges = np.linspace(0.0, r_max, N_gofr_bins + 1)
+    shell_volumes = 4.0 / 3.0 * np.pi * (edges[1:]**3 - edges[:-1]**3)
+
+    return counts / (N * N / box_length**3 * shell_volumes)
+
+
+def reference_gofxy(positions: Array, box_length: float, x_bins: Array, y_bins: Array, slice_width: float, r_max: float = np.inf) -> tuple[Array, int]:
+    """
+    The gofxy sum of a frame from a normalized 2d histogram of the neighbours of every particle (closer than r_max), as in the original implementation
+    """
+    gofxy_sum = np.zeros((len(x_bins) - 1, len(y_bins) - 1))
+    n_particles = 0
+
+    for i in range(len(positions)):
+        distance_vectors = positions[i] - np.delete(positions, i, axis=0)
+        distance_vectors -= box_length * np.round(distance_vectors / box_length)
+        in_image = (np.abs(distance_vectors[:, 2]) < slice_width) & (np.abs(distance_vectors[:, 0]) <= x_bins[-1]) & (np.abs(distance_vectors[:, 1]) <= y_bins[-1])
+        in_image &= np.linalg.norm(distance_vectors, axis=1) < r_max
+        if np.any(in_image):
+            histogram, _, _ = np.histogram2d(distance_vectors[in_image, 0], distance_vectors[in_image, 1], bins=[x_bins, y_bins], density=True)
+            gofxy_sum += histogram
+            n_particles += 1
+
+    return gofxy_sum, n_particles
+
+
+def reference_autocorrelation(series: Array) -> Array:
+    """
+    The autocorrelation of time series directly from its definition, averaging over every pair of frames (O(T^2))
+    """
+    n_steps = series.shape[0]
+    return np.stack([np.mean(series[lag:] * series[:n_steps - lag], axis=0) for lag in range(n_steps)])
+
+
+def reference_self_dynamics(unwrapped_trajectory: Array, lags: Array, q: float, r_bins: Array) -> tuple[Array, Array, Array]:
+    """
+    F_s(q,t), G_s(r,t) and alpha_2(t) from the displacements of every time origin, one lag at a time
+    """
+    fs, gs, alpha2 = [], [], []
+    for lag in lags:
+        r = np.linalg.norm(unwrapped_trajectory[lag:] - unwrapped_trajectory[:len(unwrapped_trajectory) - lag], axis=2).ravel()
+        fs.append(np.mean(np.sin(q * r) / (q * r)))
+        gs.append(np.histogram(r, bins=r_bins)[0] / (len(r) * 4.0 / 3.0 * np.pi * np.diff(r_bins**3)))
+        alpha2.append(3.0 * np.mean(r**4) / (5.0 * np.mean(r**2)**2) - 1.0)
+    return np.array(fs), np.array(gs), np.array(alpha2)
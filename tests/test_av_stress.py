@@ -0,0 +1,57 @@
+import numpy as np
+
+from post_process_jfsd.av_stress import particle_stress_tensor, stress_profile
+from post_process_jfsd.synthetic import synthetic_stresslet
+from tests.reference import relative_deviation, reference_particle_stress
+
+
+def test_particle_stress(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=20)
+    reference = np.stack([reference_particle_stress(positions, input_params) for positions in trajectory])
+    assert relative_deviation(particle_stress_tensor(trajectory, input_params, chunk_size=7), reference) <= 1e-10
+
+
+def test_particle_stress_float32(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=20)
+    reference = np.stack([reference_particle_stress(positions, input_params) for positions in trajectory])
+    # Single precision pair distances, double precision sums
+    assert relative_deviation(particle_stress_tensor(trajectory, input_params, chunk_size=7, dtype=np.float32), reference) <= 1e-5
+
+
+def test_stress_profile(sheared_system, tmp_path):
+    from scipy.stats import binned_statistic
+    trajectory, _, input_params = sheared_system(n_steps=50)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    stresslet = synthetic_stresslet(trajectory, shear_rate)
+
+    _, binned_stress, _ = stress_profile(trajectory, stresslet, input_params, 40, "check", [10, None], 2, chunk_size=7, directory=tmp_path)
+    bins = np.linspace(-0.5 * box_length, 0.5 * box_length, 40)
+    reference = np.stack([binned_statistic(trajectory[10::2, :, 1].ravel(), stresslet[10::2, :, column].ravel(), 'mean', bins)[0] for column in (1, 0, 3)], axis=1)
+
+    assert relative_deviation(binned_stress[:, :3], reference[::-1] * N / box_length**3 / kT) <= 1e-12
+
+
+def test_stress_profile_errors_large_offset(sheared_system, tmp_path):
+    from scipy.stats import binned_statistic
+    trajectory, _, input_params = sheared_system(n_steps=50)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    stresslet = synthetic_stresslet(trajectory, shear_rate)
+
+    # The deviations are merged over the chunks about the bin means, so a large mean stresslet does not cancel the standard errors
+    _, _, stress_errors = stress_profile(trajectory, stresslet + 1e8, input_params, 40, "check", chunk_size=7, directory=tmp_path)
+    bins = np.linspace(-0.5 * box_length, 0.5 * box_length, 40)
+    y = trajectory[..., 1].ravel()
+    counts, _, _ = binned_statistic(y, y, 'count', bins)
+    reference = np.stack([binned_statistic(y, stresslet[..., column].ravel(), 'std', bins)[0] for column in (1, 0, 3)], axis=1) / np.sqrt(counts - 1)[:, np.newaxis]
+
+    assert relative_deviation(stress_errors[:, :3], reference[::-1] * N / box_length**3 / kT) <= 1e-6
+
+
+def test_average_stresslet_float32(sheared_system):
+    from post_process_jfsd.av_stress import average_stresslet
+    trajectory, _, input_params = sheared_system(n_steps=20)
+    stresslet = synthetic_stresslet(trajectory, input_params[6])
+
+    # The float64 average is the mean over the particles; in float32 only the frames are converted, the sums stay in double precision
+    assert relative_deviation(average_stresslet(stresslet, chunk_size=7), np.mean(stresslet, axis=1)) == 0
+    assert relative_deviation(average_stresslet(stresslet, chunk_size=7, dtype=np.float32), np.mean(stresslet.astype(np.float32).astype(np.float64), axis=1)) <= 1e-12
@@ -0,0 +1,62 @@
+import numpy as np
+
+from post_process_jfsd.correlation import stress_autocorrelation, velocity_autocorrelation
+from post_process_jfsd.synthetic import synthetic_stresslet, affine_velocities
+from tests.reference import relative_deviation, reference_autocorrelation
+
+
+def test_stress_autocorrelation(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=300)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    # A correlated stress signal, so the modulus does not vanish after the first lag
+    stresslet = synthetic_stresslet(trajectory, shear_rate) + np.sin(0.1 * np.arange(n_steps))[:, np.newaxis, np.newaxis]
+
+    stress = np.sum(stresslet[..., [1, 2]], axis=1) / box_length**3
+    reference = np.mean(reference_autocorrelation(stress - np.mean(stress, axis=0)), axis=1) * box_length**3 / kT**2
+    assert relative_deviation(stress_autocorrelation(stresslet, input_params, ["xy", "xz"], chunk_size=37), reference) <= 1e-12
+
+
+def test_velocity_autocorrelation(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=300)
+    shear_rate = input_params[6]
+    velocities = affine_velocities(trajectory, shear_rate) + np.cos(0.05 * np.arange(300))[:, np.newaxis, np.newaxis]
+
+    non_affine = velocities.copy()
+    non_affine[..., 0] -= shear_rate * trajectory[..., 1]
+    reference = np.mean(np.sum(reference_autocorrelation(non_affine), axis=2), axis=1)
+    assert relative_deviation(velocity_autocorrelation(velocities, trajectory, shear_rate, block_size=64, n_workers=2), reference) <= 1e-12
+
+
+def test_green_kubo_units(sheared_system, tmp_path):
+    from post_process_jfsd.correlation import calculate_velocity_autocorrelation
+    from post_process_jfsd.utils import log_bin_reduce
+    trajectory, _, input_params = sheared_system(n_steps=300)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    input_params = input_params[:8] + (2.5,) # a brownian time different from the time unit
+
+    # Constant velocities: <v(t)v(0)> = <v^2> and D(t) = <v^2> t / 3, in units of (a/tb)^2 and a^2/tb like the viscosity integral over t/tb
+    velocities = np.broadcast_to(np.random.default_rng(0).normal(size=(1, N, 3)), (n_steps, N, 3))
+    squared = np.mean(np.sum(velocities[0]**2, axis=1)) * 2.5**2
+    binned_time, vacf, diffusion = calculate_velocity_autocorrelation(velocities, trajectory, input_params, "check", directory=tmp_path)
+
+    _, reference, counts, _ = log_bin_reduce(time, squared * time / 2.5 / 3.0, 80)
+
+    assert relative_deviation(vacf, np.full_like(vacf, squared)) <= 1e-12
+    assert relative_deviation(diffusion, np.concatenate(([0.0], reference[counts > 0]))) <= 1e-12
+
+
+def test_velocity_autocorrelation_minimum_block(sheared_system, monkeypatch):
+    from post_process_jfsd import correlation
+    trajectory, _, input_params = sheared_system(n_steps=300)
+    N = input_params[1]
+    velocities = affine_velocities(trajectory, input_params[6])
+
+    # For long series the blocks are not reduced below MIN_BLOCK_PARTICLES, so the file is read in a few passes
+    blocks = []
+    block_function = correlation.velocity_autocorrelation_block
+    monkeypatch.setattr(correlation, "MAX_BLOCK_VALUES", 300)
+    monkeypatch.setattr(correlation, "velocity_autocorrelation_block", lambda source, n_steps, first, last, *args: blocks.append(last - first) or block_function(source, n_steps, first, last, *args))
+
+    reference = np.mean(np.sum(reference_autocorrelation(velocities), axis=2), axis=1)
+    assert relative_deviation(correlation.velocity_autocorrelation(velocities), reference) <= 1e-12
+    assert len(blocks) == -(-N // correlation.MIN_BLOCK_PARTICLES)
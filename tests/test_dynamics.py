@@ -0,0 +1,19 @@
+import numpy as np
+
+from post_process_jfsd.dynamics import self_dynamics
+from post_process_jfsd.msd import log_msd
+from tests.reference import relative_deviation, reference_self_dynamics
+
+
+def test_self_dynamics(sheared_system):
+    _, unwrapped_trajectory, _ = sheared_system(n_steps=100)
+    lags, msd = log_msd(unwrapped_trajectory, n_origins=100, num_bins=20)
+    r_bins = np.linspace(0.0, 10.0, 41)
+
+    fused_msd, alpha2, fs, gs = self_dynamics(unwrapped_trajectory, lags, np.arange(99), [2.0], r_bins, block_size=64, n_workers=2)
+    reference_fs, reference_gs, reference_alpha2 = reference_self_dynamics(unwrapped_trajectory, lags, 2.0, r_bins)
+
+    assert relative_deviation(fused_msd, msd) <= 1e-12
+    assert relative_deviation(fs[:, 0], reference_fs) <= 1e-12
+    assert relative_deviation(gs, reference_gs) <= 1e-12
+    assert relative_deviation(alpha2, reference_alpha2) <= 1e-12
@@ -0,0 +1,13 @@
+import numpy as np
+
+from post_process_jfsd.gofr import rdf_for_frames
+from tests.reference import relative_deviation, reference_gofr
+
+
+def test_gofr(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=10)
+    box_length = input_params[7]
+    _, gofr, _ = rdf_for_frames(trajectory, np.arange(10), box_length, 50, 0.45 * box_length)
+    reference = np.mean([reference_gofr(positions, box_length, 50, 0.45 * box_length) for positions in trajectory], axis=0)
+    # freud RDF is single precision
+    assert relative_deviation(gofr, reference) <= 1e-5
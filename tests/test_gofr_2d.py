@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.gofr_2d import gofxy_for_frames, gofxy_image
+from tests.reference import relative_deviation, reference_gofxy
+
+
+def test_gofxy(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=5)
+    box_length = input_params[7]
+    x_bins = y_bins = np.linspace(-0.3 * box_length, 0.3 * box_length, 41)
+
+    reference_sum, reference_particles = 0.0, 0
+    for positions in trajectory:
+        gofxy_sum, n_particles = reference_gofxy(positions, box_length, x_bins, y_bins, 0.7)
+        reference_sum, reference_particles = reference_sum + gofxy_sum, reference_particles + n_particles
+
+    assert relative_deviation(gofxy_for_frames(trajectory, np.arange(5), box_length, x_bins, y_bins, 0.7), reference_sum / reference_particles) <= 1e-12
+
+
+def test_gofxy_corners_beyond_half_box(sheared_system, tmp_path):
+    trajectory, _, input_params = sheared_system(n_steps=5)
+    box_length = input_params[7]
+    x_bins = y_bins = np.linspace(-0.45 * box_length, 0.45 * box_length, 21)
+
+    # The image corners are further than half of the box: only the pairs within the reach of the periodic query are counted
+    reference_sum, reference_particles = 0.0, 0
+    for positions in trajectory:
+        gofxy_sum, n_particles = reference_gofxy(positions, box_length, x_bins, y_bins, 0.7, r_max=0.5 * box_length * (1.0 - 1e-6))
+        reference_sum, reference_particles = reference_sum + gofxy_sum, reference_particles + n_particles
+
+    assert relative_deviation(gofxy_for_frames(trajectory, np.arange(5), box_length, x_bins, y_bins, 0.7), reference_sum / reference_particles) <= 1e-12
+
+    with pytest.warns(RuntimeWarning, match="half of the box size"):
+        gofxy_image(trajectory, input_params, 4, 0, False, "check", 0.7, 21, 0.45 * box_length, 0.45 * box_length, directory=tmp_path)
@@ -0,0 +1,16 @@
+import warnings
+from pathlib import Path
+
+import pytest
+
+import post_process_jfsd
+
+MODULES = sorted(Path(post_process_jfsd.__file__).parent.glob("*.py"))
+
+
+@pytest.mark.parametrize("path", MODULES, ids=lambda path: path.name)
+def test_compiles_without_warnings(path):
+    # As with python -W error: invalid escape sequences (e.g. the Grace notation of the headers outside raw strings) fail to compile
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        compile(path.read_bytes(), str(path), "exec")
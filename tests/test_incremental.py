@@ -0,0 +1,43 @@
+import contextlib
+import io
+import os
+import numpy as np
+
+from post_process_jfsd.incremental import update_incremental
+from post_process_jfsd.output import read_output
+from post_process_jfsd.utils import load_and_check, simulation_parameters
+from post_process_jfsd.av_stress import caclulate_average_stress
+from post_process_jfsd.msd import calculate_msd
+from post_process_jfsd.velocity_profile import vel_profile
+from post_process_jfsd.synthetic import synthetic_simulation
+from tests.reference import relative_deviation
+
+
+def test_incremental_matches_complete_run(tmp_path):
+    complete = os.path.join(tmp_path, "complete")
+    running = os.path.join(tmp_path, "running")
+    synthetic_simulation(complete, 100, 120, seed=2)
+    files = {name: np.load(os.path.join(complete, name + ".npy")) for name in ("trajectory", "stresslet", "velocities")}
+    synthetic_simulation(running, 100, 120, seed=2)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Update a simulation in parts, as if it was still running
+        for n_written in (30, 31, 90, 120):
+            for name, array in files.items():
+                partial = array.copy()
+                partial[n_written:] = 0.0
+                np.save(os.path.join(running, name + ".npy"), partial)
+            trajectory, stresslet, velocities, _ = load_and_check(True, True, directory=running)
+            update_incremental(trajectory, stresslet, velocities, simulation_parameters(trajectory, running), "running",
+                               stress_flag=True, msd_flag=True, v_profile_flag=True, directory=running)
+
+        trajectory, stresslet, velocities, _ = load_and_check(True, True, directory=complete)
+        input_params = simulation_parameters(trajectory, complete)
+        caclulate_average_stress(stresslet, input_params, False, 80, "complete", directory=complete)
+        calculate_msd(trajectory, input_params, False, "complete", directory=complete)
+        vel_profile(trajectory, velocities, input_params, 80, "complete", directory=complete)
+
+    for prefix in ("AVST", "MSDdirect", "Velocityprofile"):
+        reference = np.stack(list(read_output(prefix + "complete", complete).values()))
+        result = np.stack(list(read_output(prefix + "running", running).values()))
+        assert relative_deviation(result, reference) <= 1e-12, prefix
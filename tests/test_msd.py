@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.msd import unwrap_trajectory, windowed_msd, log_msd, direct_msd, log_lags
+from tests.reference import relative_deviation, reference_windowed_msd
+
+
+def test_unwrap_lees_edwards(sheared_system):
+    trajectory, unwrapped_trajectory, input_params = sheared_system()
+    assert relative_deviation(unwrap_trajectory(trajectory, input_params, chunk_size=37), unwrapped_trajectory) <= 1e-12
+
+
+def test_unwrap_non_affine(sheared_system):
+    trajectory, _, input_params = sheared_system(diffusion=0.0)
+    non_affine = unwrap_trajectory(trajectory, input_params, chunk_size=37, non_affine=True)
+    # Without Brownian displacements the non-affine positions do not change
+    assert relative_deviation(non_affine, np.broadcast_to(non_affine[0], non_affine.shape)) <= 1e-12
+
+
+def test_windowed_msd(sheared_system):
+    _, unwrapped_trajectory, _ = sheared_system()
+    assert relative_deviation(windowed_msd(unwrapped_trajectory, block_size=64), reference_windowed_msd(unwrapped_trajectory)) <= 1e-12
+
+
+def test_windowed_msd_workers(sheared_system):
+    _, unwrapped_trajectory, _ = sheared_system()
+    assert relative_deviation(windowed_msd(unwrapped_trajectory, block_size=64, n_workers=2), reference_windowed_msd(unwrapped_trajectory)) <= 1e-12
+
+
+def test_windowed_msd_freud(sheared_system):
+    import freud
+    _, unwrapped_trajectory, _ = sheared_system()
+    # freud accumulates in single precision
+    assert relative_deviation(windowed_msd(unwrapped_trajectory), freud.msd.MSD(mode='window').compute(unwrapped_trajectory).msd) <= 1e-5
+
+
+def test_log_msd(sheared_system):
+    _, unwrapped_trajectory, _ = sheared_system()
+    lags, msd = log_msd(unwrapped_trajectory, n_origins=len(unwrapped_trajectory), num_bins=40)
+    assert relative_deviation(msd, reference_windowed_msd(unwrapped_trajectory)[lags]) <= 1e-12
+
+
+def test_direct_msd(sheared_system):
+    _, unwrapped_trajectory, _ = sheared_system()
+    reference = np.mean(np.sum((unwrapped_trajectory - unwrapped_trajectory[0])**2, axis=2), axis=1)
+    assert relative_deviation(direct_msd(unwrapped_trajectory, chunk_size=37), reference) <= 1e-12
+
+
+def test_float32_unwrap_and_msd(sheared_system):
+    trajectory, unwrapped_trajectory, input_params = sheared_system(n_steps=20)
+    unwrapped = unwrap_trajectory(trajectory, input_params, chunk_size=7, dtype=np.float32)
+    # Single precision positions, double precision sums
+    assert relative_deviation(windowed_msd(unwrapped, block_size=64), reference_windowed_msd(unwrapped_trajectory)) <= 1e-5
+
+
+@pytest.mark.parametrize("n_steps", [2, 3, 10, 100, 1000, 12345])
+def test_log_lags_aligned_with_bins(n_steps):
+    from post_process_jfsd.utils import log_bin_index
+    # Every lag is the first frame of a bin of the log binning of the same time axis, one for every bin with a frame
+    _, index = log_bin_index(0.01 * np.arange(n_steps), 80)
+    first_frames = [np.flatnonzero(index == i)[0] for i in np.unique(index[index < 79])]
+    np.testing.assert_array_equal(log_lags(n_steps, 80), first_frames)
+
+
+def test_log_lags_short_trajectory():
+    with pytest.raises(ValueError):
+        log_lags(1)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from post_process_jfsd.msdtolve import lve_from_msd
+from tests.reference import relative_deviation
+
+
+def test_lve_of_power_law():
+    from scipy.special import gamma
+
+    # A power law MSD on a linear time axis (as the windowed MSD) has a constant slope and G*(w) = w^alpha / (pi 6 Gamma(1 + alpha))
+    time = 0.01 * np.arange(1, 10**5 + 1)
+    omega, Gp, Gdp, alpha = lve_from_msd(time, 6.0 * time**0.7, n_points=60, window=9)
+    Gstar = omega**0.7 / (np.pi * 6.0 * gamma(1.7))
+
+    assert relative_deviation(alpha, np.full_like(alpha, 0.7)) <= 1e-12
+    assert relative_deviation(Gp, Gstar * np.cos(0.35 * np.pi)) <= 1e-12
+    assert relative_deviation(Gdp, Gstar * np.sin(0.35 * np.pi)) <= 1e-12
+
+
+def test_lve_from_msd_file(tmp_path):
+    from post_process_jfsd.msdtolve import msd_to_lve
+    from post_process_jfsd.output import write_output
+
+    # The positional call of the original interface reads the MSD file, and gives the same spectrum as the MSD of the pipeline
+    time = 0.01 * np.arange(1, 10**4 + 1)
+    msd = 6.0 * time / (1.0 + time)**0.5
+    write_output("MSDrun", "t   MSD", {"time": time, "msd": msd}, directory=tmp_path)
+
+    from_file = msd_to_lve("run", "text", tmp_path)
+    from_pipeline = msd_to_lve("run", "text", tmp_path, msd_data=(time, msd))
+
+    for a, b in zip(from_file, from_pipeline):
+        assert relative_deviation(a, b) == 0
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.output import write_output, read_output
+
+
+@pytest.mark.parametrize("output_format", ["text", "npz"])
+def test_round_trip(output_format, tmp_path):
+    columns = {"a": np.random.default_rng(0).normal(size=100), "b": np.arange(100.0)}
+    write_output("round_trip", "a   b", columns, output_format=output_format, comments=["check"], directory=tmp_path)
+    # Both backends give back the same doubles, bit for bit
+    np.testing.assert_array_equal(np.stack(list(read_output("round_trip", tmp_path).values())), np.stack(list(columns.values())))
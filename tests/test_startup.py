@@ -0,0 +1,9 @@
+import pytest
+
+from post_process_jfsd.benchmark import measure_startup, STARTUP_MODULES
+
+
+@pytest.mark.parametrize("module", STARTUP_MODULES)
+def test_no_heavy_imports_at_startup(module):
+    # freud, scipy and matplotlib are only imported when an analysis that needs them runs
+    assert measure_startup(module, repeats=1)["heavy_modules"] == []
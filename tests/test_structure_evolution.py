@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.structure_evolution import structure_evolution, structure_for_windows, frame_windows
+from post_process_jfsd.gofr_2d import gofxy_for_frames
+from tests.reference import relative_deviation, reference_gofr
+
+
+def test_structure_evolution(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=10)
+    box_length = input_params[7]
+    r_bins = np.linspace(0.0, 0.3 * box_length, 51)
+    x_bins = y_bins = np.linspace(-0.2 * box_length, 0.2 * box_length, 41)
+
+    # Overlapping windows, clamped at both ends of the trajectory
+    windows = frame_windows(np.array([0, 3, 4, 9]), 2, 9)
+    gofr_stack, gofxy_stack = structure_for_windows(trajectory, windows, 10, box_length, r_bins, x_bins, y_bins, 0.7)
+
+    for window, gofr, gofxy in zip(windows, gofr_stack, gofxy_stack):
+        reference = np.mean([reference_gofr(trajectory[frame], box_length, 50, r_bins[-1]) for frame in window], axis=0)
+        assert relative_deviation(gofr, reference) <= 1e-12
+        assert relative_deviation(gofxy, gofxy_for_frames(trajectory, window, box_length, x_bins, y_bins, 0.7)) <= 1e-12
+
+
+def test_gofxy_corners_beyond_half_box(sheared_system, tmp_path):
+    trajectory, _, input_params = sheared_system(n_steps=10)
+    box_length = input_params[7]
+
+    # As gofxy_image, the corners beyond half of the box are left incomplete with a warning, with the same gofxy
+    with pytest.warns(RuntimeWarning, match="half of the box size"):
+        _, _, gofxy_stack = structure_evolution(trajectory, 9, input_params, "check", 20, 0.3 * box_length, 21, 0.45 * box_length, 0.45 * box_length, 0.7,
+                                                frames=[0, 9], directory=tmp_path)
+    x_bins = y_bins = np.linspace(-0.45 * box_length, 0.45 * box_length, 21)
+    assert relative_deviation(gofxy_stack[1], gofxy_for_frames(trajectory, [9], box_length, x_bins, y_bins, 0.7)) <= 1e-12
+
+    with pytest.raises(ValueError):
+        structure_evolution(trajectory, 9, input_params, "check", 20, 0.5 * box_length, 21, 1.0, 1.0, 0.7, directory=tmp_path)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from post_process_jfsd.structure_factor import lees_edwards_coordinates, density_modes, grid_wave_numbers, structure_factor_for_frames
+from tests.reference import relative_deviation
+
+
+def test_direct_sum(sheared_system):
+    trajectory, _, input_params = sheared_system(n_steps=20)
+    box_length, strain = input_params[7], input_params[6] * input_params[4][-1]
+    k_full, k_half, _ = grid_wave_numbers(8)
+
+    # The modes of the sheared cell against the sum over the particles with the wave vectors q = 2 pi / L (k_x, k_y - strain * k_x, k_z)
+    rho = density_modes(lees_edwards_coordinates(trajectory[-1], strain, box_length), 8, direct_sum=True)
+    k = np.stack(np.meshgrid(k_full, k_full, k_half, indexing='ij'), axis=-1)
+    q = 2.0 * np.pi / box_length * np.stack((k[..., 0], k[..., 1] - (strain - np.round(strain)) * k[..., 0], k[..., 2]), axis=-1)
+    reference = np.abs(np.exp(-1j * (q @ trajectory[-1].T)).sum(axis=-1))**2
+
+    assert relative_deviation(np.abs(rho)**2, reference) <= 1e-10
+
+
+def test_grid(sheared_system):
+    trajectory, _, input_params = sheared_system(N=1000, n_steps=20)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    frames = np.array([0, 10, 19])
+
+    # The grid S(q) against the exact sums, below half of the largest wave number (aliasing grows towards it), with cloud-in-cell and interlacing
+    grid, exact = [structure_factor_for_frames(trajectory, frames, shear_rate * time[frames], box_length, 32, 40, direct_sum) for direct_sum in (False, True)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        assert relative_deviation((grid[0] / grid[1])[1:20], (exact[0] / exact[1])[1:20]) <= 2e-2
+
+
+def test_grid_float32(sheared_system):
+    trajectory, _, input_params = sheared_system(N=1000, n_steps=20)
+    (n_steps, N, dt, period, time, kT, shear_rate, box_length, tb) = input_params
+    frames = np.array([0, 10, 19])
+
+    # Single precision coordinates, double precision grid density and sums
+    double, single = [structure_factor_for_frames(trajectory, frames, shear_rate * time[frames], box_length, 32, 40, dtype=dtype) for dtype in (np.float64, np.float32)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        assert relative_deviation((single[0] / single[1])[1:], (double[0] / double[1])[1:]) <= 1e-4
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.utils import log_bin_stat, lin_bin_stat
+from tests.reference import relative_deviation
+
+
+def test_log_binning():
+    from scipy.stats import binned_statistic
+    time_steps = np.arange(1000) * 0.1
+    data = np.random.default_rng(0).normal(size=1000)
+    _, bin_means = log_bin_stat(time_steps, data, 60)
+    reference, _, _ = binned_statistic(time_steps, data, 'mean', np.logspace(np.log10(time_steps[1]), np.log10(time_steps[-1]), 60))
+    assert relative_deviation(bin_means, reference) <= 1e-12
+
+
+def test_lin_binning():
+    from scipy.stats import binned_statistic
+    rng = np.random.default_rng(0)
+    values, data = rng.uniform(-5.0, 5.0, 10000), rng.normal(size=10000)
+    _, bin_means = lin_bin_stat(values, data, 10.0, 50)
+    reference, _, _ = binned_statistic(values, data, 'mean', np.linspace(-5.0, 5.0, 50))
+    assert relative_deviation(bin_means, reference) <= 1e-12
+
+
+def test_unwritten_trajectory(tmp_path):
+    from post_process_jfsd.utils import load_and_check
+    # A simulation that wrote no frame has nothing to analyse
+    np.save(tmp_path / "trajectory.npy", np.zeros((10, 5, 3)))
+    with pytest.raises(ValueError, match="no written frames"):
+        load_and_check(False, False, directory=tmp_path)
+
+
+def test_binned_variance():
+    from post_process_jfsd.utils import log_bin_index, log_bin_reduce
+    # A large offset cancels in the two-pass variance (the single-pass E[x^2] - E[x]^2 loses it)
+    time_steps = np.arange(1000) * 0.1
+    data = 1e8 + np.random.default_rng(0).normal(size=1000)
+    _, _, bin_counts, bin_variances = log_bin_reduce(time_steps, data, 60)
+    _, index = log_bin_index(time_steps, 60)
+    filled = bin_counts > 0
+    reference = [np.var(data[index == i]) for i in np.flatnonzero(filled)]
+    assert relative_deviation(bin_variances[filled], np.array(reference)) <= 1e-6
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("n_written", [1, 7, 23, 64])
+def test_partly_written_trajectory(tmp_path, lazy, n_written):
+    from post_process_jfsd.utils import load_and_check
+    # The files of a running simulation are zero padded after the last written frame
+    rng = np.random.default_rng(0)
+    for name, n_components in (("trajectory", 3), ("stresslet", 5), ("velocities", 3)):
+        data = np.zeros((64, 10, n_components))
+        data[:n_written] = rng.normal(size=(n_written, 10, n_components))
+        np.save(tmp_path / f"{name}.npy", data)
+
+    trajectory, stresslet, velocities, ending_frame = load_and_check(True, True, lazy=lazy, directory=tmp_path)
+
+    assert ending_frame == n_written - 1
+    assert trajectory.shape == (n_written, 10, 3)
+    assert stresslet.shape == (n_written, 10, 5)
+    assert velocities.shape == (n_written, 10, 3)
+    # Lazily loaded files stay memory-mapped, also after the unwritten frames are cut off
+    for array in (trajectory, stresslet, velocities):
+        assert isinstance(array, np.memmap) == lazy
+    np.testing.assert_array_equal(trajectory, np.load(tmp_path / "trajectory.npy")[:n_written])
+
+
+def test_find_last_frame():
+    from post_process_jfsd.utils import find_last_frame
+    trajectory = np.zeros((65, 4, 3))
+    for n_written in range(66):
+        trajectory[:n_written] = 1.0
+        assert find_last_frame(trajectory) == n_written
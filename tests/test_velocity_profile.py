@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from post_process_jfsd.velocity_profile import vel_profile
+from post_process_jfsd.synthetic import affine_velocities
+from tests.reference import relative_deviation
+
+
+def test_velocity_profile(sheared_system, tmp_path):
+    from scipy.stats import binned_statistic
+    trajectory, _, input_params = sheared_system(n_steps=50)
+    velocities = affine_velocities(trajectory, input_params[6])
+    box_length = input_params[7]
+
+    _, binned_velocities, _ = vel_profile(trajectory, velocities, input_params, 40, "check", chunk_size=7, directory=tmp_path)
+    reference, _, _ = binned_statistic(trajectory[..., 1].ravel(), velocities[..., 0].ravel(), 'mean', np.linspace(-0.5 * box_length, 0.5 * box_length, 40))
+
+    assert relative_deviation(binned_velocities, reference[::-1]) <= 1e-12
+
+
+def test_velocity_errors_large_offset(sheared_system, tmp_path):
+    from scipy.stats import binned_statistic
+    trajectory, _, input_params = sheared_system(n_steps=50)
+    velocities = affine_velocities(trajectory, input_params[6])
+    box_length = input_params[7]
+
+    # The deviations are merged over the chunks about the bin means, so a large mean velocity does not cancel the standard errors
+    _, _, velocity_errors = vel_profile(trajectory, velocities + np.array([1e8, 0.0, 0.0]), input_params, 40, "check", chunk_size=7, directory=tmp_path)
+    bins = np.linspace(-0.5 * box_length, 0.5 * box_length, 40)
+    std, _, _ = binned_statistic(trajectory[..., 1].ravel(), velocities[..., 0].ravel(), 'std', bins)
+    counts, _, _ = binned_statistic(trajectory[..., 1].ravel(), velocities[..., 0].ravel(), 'count', bins)
+
+    assert relative_deviation(velocity_errors, (std / np.sqrt(counts - 1))[::-1]) <= 1e-6
+
+
+def test_velocity_profile_without_shear(sheared_system, tmp_path):
+    trajectory, _, input_params = sheared_system(n_steps=10)
+    input_params = input_params[:6] + (0.0,) + input_params[7:]
+
+    with pytest.warns(RuntimeWarning, match="Shear rate is zero"):
+        vel_profile(trajectory, affine_velocities(trajectory, 0.0), input_params, 40, "check", directory=tmp_path)